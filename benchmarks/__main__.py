@@ -0,0 +1,63 @@
+"""
+Run the benchmarks.
+
+    python -m benchmarks                        # everything
+    python -m benchmarks -s validate -s process # some scenarios
+    python -m benchmarks -o results.json --compare baseline.json
+"""
+import argparse
+import sys
+
+from benchmarks.harness import compare, measure, write_results
+from benchmarks.scenarios import SCENARIOS
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "-s", "--scenario", action="append", help="scenario to run (repeatable)"
+    )
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="results JSON file from an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="throughput drop that counts as a regression (default: 0.1 = 10%%)",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the peak memory pass"
+    )
+    args = parser.parse_args(argv)
+
+    selected = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+    results = []
+    print(
+        f"{'scenario':<20} {'params':<40} {'ops/s':>12} {'p50 us':>10} "
+        f"{'p99 us':>10} {'peak MB':>8}"
+    )
+    for scenario in selected:
+        for params in scenario.params:
+            r = measure(scenario, params, memory=not args.no_memory)
+            results.append(r)
+            peak = r["peak_memory_bytes"]
+            print(
+                f"{r['scenario']:<20} {str(r['params']):<40} {r['ops_per_sec']:>12.1f} "
+                f"{r['latency_us']['p50']:>10.1f} {r['latency_us']['p99']:>10.1f} "
+                f"{peak / 1e6 if peak is not None else float('nan'):>8.1f}"
+            )
+
+    if args.output:
+        write_results(args.output, results)
+
+    if args.compare:
+        regressions = compare(args.compare, results, args.threshold)
+        for line in regressions:
+            print("REGRESSION:", line)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Benchmark harness.  A scenario's setup builds a list of operations (zero-argument
+callables) up front, so only the operations are timed.  Each run reports
+operations per second, latency percentiles and peak (traced) memory.
+"""
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Mapping, Sequence
+
+Op = Callable[[], Any]
+
+
+class Scenario:
+    def __init__(
+        self,
+        name: str,
+        setup: Callable[..., Sequence[Op]],
+        params: Sequence[Mapping[str, Any]],
+    ):
+        self.name: str = name
+        self.setup = setup
+        self.params: Sequence[Mapping[str, Any]] = params
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def measure(
+    scenario: Scenario, params: Mapping[str, Any], memory: bool = True
+) -> Dict[str, Any]:
+    """
+    Run one scenario with one set of parameters
+    """
+    ops = scenario.setup(**params)
+    clock = time.perf_counter
+    latencies = []
+    start = clock()
+    for op in ops:
+        t = clock()
+        op()
+        latencies.append(clock() - t)
+    elapsed = clock() - start
+    latencies.sort()
+
+    peak = None
+    if memory:
+        # separate pass: tracing slows everything down.
+        # The peak includes the state built by setup (e.g. the UHS)
+        tracemalloc.start()
+        ops = scenario.setup(**params)
+        for op in ops:
+            op()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "scenario": scenario.name,
+        "params": dict(params),
+        "ops": len(latencies),
+        "seconds": elapsed,
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_us": {
+            "p50": percentile(latencies, 50) * 1e6,
+            "p90": percentile(latencies, 90) * 1e6,
+            "p99": percentile(latencies, 99) * 1e6,
+            "max": latencies[-1] * 1e6 if latencies else 0.0,
+        },
+        "peak_memory_bytes": peak,
+    }
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+def write_results(path: str, results: List[Dict[str, Any]]):
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+
+def result_key(result: Mapping[str, Any]) -> str:
+    return result["scenario"] + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(
+    baseline_path: str, results: List[Dict[str, Any]], threshold: float
+) -> List[str]:
+    """
+    Compare against a results file from an earlier run.
+    Returns a line for each scenario whose throughput dropped by more than 'threshold'
+    """
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for r in results:
+        old = baseline.get(result_key(r))
+        if not old or not old["ops_per_sec"]:
+            continue
+        change = r["ops_per_sec"] / old["ops_per_sec"] - 1
+        if change < -threshold:
+            regressions.append(
+                "{} {}: {:.0f} -> {:.0f} ops/s ({:+.1%})".format(
+                    r["scenario"],
+                    r["params"],
+                    old["ops_per_sec"],
+                    r["ops_per_sec"],
+                    change,
+                )
+            )
+    return regressions
@@ -0,0 +1,38 @@
+"""
+Benchmark: 'Wallet.receive_transfer' as the number of keys in the wallet grows.
+The time per payment should stay flat.
+
+Run with: python -m benchmarks.receive_transfer
+"""
+import time
+
+from cbdc.wallet import Wallet
+
+KEY_COUNTS = [100, 1_000, 10_000, 100_000]
+PAYMENTS = 200
+
+
+def run():
+    payer = Wallet()
+    minted = payer.mint_new_coins(PAYMENTS, 1)
+    payer.receive_transfer(minted)
+
+    print(f"{'keys':>10} {'receive_transfer (us)':>24}")
+    for count in KEY_COUNTS:
+        payee = Wallet()
+        for _ in range(count):
+            payee._generate_key()
+        # build the payments up front, only time the receiving side
+        txs = [
+            payer.transfer(1, payee.address) for _ in range(PAYMENTS // len(KEY_COUNTS))
+        ]
+
+        start = time.perf_counter()
+        for tx in txs:
+            payee.receive_transfer(tx)
+        elapsed = time.perf_counter() - start
+        print(f"{count:>10} {elapsed / len(txs) * 1e6:>24.1f}")
+
+
+if __name__ == "__main__":
+    run()
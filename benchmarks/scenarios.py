@@ -0,0 +1,128 @@
+"""
+Benchmark scenarios.  Each setup returns the operations to time
+"""
+import os
+from functools import partial
+from typing import List
+
+from benchmarks.harness import Op, Scenario
+from cbdc.storage.compact import CompactUhsSet
+from cbdc.storage.filtered import FilteredUhs
+from cbdc.transaction import CompactTx, Outpoint, TxIn, TxOut, hash_tx_input
+from cbdc.uhs import UhsController
+from cbdc.wallet import Wallet
+
+UHS_BACKENDS = {
+    "set": set,
+    "compact": CompactUhsSet,
+    "filtered_compact": lambda: FilteredUhs(CompactUhsSet()),
+}
+
+
+def funded_wallet(coins: int, value: float = 1) -> Wallet:
+    wallet = Wallet()
+    wallet.receive_transfer(wallet.mint_new_coins(coins, value))
+    return wallet
+
+
+def mint(n: int, repeat: int = 5) -> List[Op]:
+    wallets = [Wallet() for _ in range(repeat)]
+    return [partial(w.mint_new_coins, n, 1) for w in wallets]
+
+
+def transfer(inputs: int, repeat: int = 5) -> List[Op]:
+    payee = Wallet().address
+    wallets = [funded_wallet(inputs) for _ in range(repeat)]
+    # spends every input
+    return [partial(w.transfer, inputs, payee) for w in wallets]
+
+
+def signed_transfers(count: int, inputs: int):
+    """
+    Returns (uhs with the minted coins, 'count' transfers of 'inputs' inputs each)
+    """
+    uhs = UhsController()
+    payer = Wallet()
+    payee = Wallet().address
+    minted = payer.mint_new_coins(count * inputs, 1)
+    payer.receive_transfer(minted)
+    uhs.process(minted, False)
+    return uhs, [payer.transfer(inputs, payee) for _ in range(count)]
+
+
+def validate(inputs: int, count: int = 200) -> List[Op]:
+    uhs, txs = signed_transfers(count, inputs)
+    return [partial(uhs.validate, tx) for tx in txs]
+
+
+def process(inputs: int, count: int = 200) -> List[Op]:
+    uhs, txs = signed_transfers(count, inputs)
+    return [partial(uhs.process, tx, False) for tx in txs]
+
+
+def compact_tx_create(outputs: int, count: int = 200) -> List[Op]:
+    tx = Wallet().mint_new_coins(outputs, 1)
+    return [partial(CompactTx.create, tx)] * count
+
+
+def unspent_lookups(uhs_size: int, backend: str, lookups: int):
+    """
+    Returns (uhs of 'uhs_size' IDs, 'lookups' TxIns, half of them unspent)
+    """
+    uhs = UhsController(uhs=UHS_BACKENDS[backend]())
+    txins = [
+        TxIn(Outpoint(i, os.urandom(32)), TxOut(1, os.urandom(32)))
+        for i in range(lookups)
+    ]
+    uhs.uhs.update(hash_tx_input(t) for t in txins[::2])
+    uhs.uhs.update(os.urandom(32) for _ in range(uhs_size - len(txins[::2])))
+    return uhs, txins
+
+
+def check_unspent(uhs_size: int, backend: str, lookups: int = 10_000) -> List[Op]:
+    uhs, txins = unspent_lookups(uhs_size, backend, lookups)
+    return [partial(uhs.check_unspent, t) for t in txins]
+
+
+def check_unspent_many(
+    uhs_size: int, backend: str, lookups: int = 10_000, repeat: int = 5
+) -> List[Op]:
+    uhs, txins = unspent_lookups(uhs_size, backend, lookups)
+    return [partial(uhs.check_unspent_many, txins)] * repeat
+
+
+def receive_transfer(keys: int, count: int = 50) -> List[Op]:
+    payee = Wallet()
+    for _ in range(keys):
+        payee._generate_key()
+    payer = funded_wallet(count)
+    txs = [payer.transfer(1, payee.address) for _ in range(count)]
+    return [partial(payee.receive_transfer, tx) for tx in txs]
+
+
+SCENARIOS = [
+    Scenario("mint_new_coins", mint, [{"n": 1_000}, {"n": 10_000}]),
+    Scenario(
+        "transfer", transfer, [{"inputs": 10}, {"inputs": 100}, {"inputs": 1_000}]
+    ),
+    Scenario("validate", validate, [{"inputs": 1}, {"inputs": 10}]),
+    Scenario("process", process, [{"inputs": 1}, {"inputs": 10}]),
+    Scenario(
+        "compact_tx_create", compact_tx_create, [{"outputs": 1}, {"outputs": 100}]
+    ),
+    Scenario(
+        "check_unspent",
+        check_unspent,
+        [
+            {"uhs_size": size, "backend": backend}
+            for size in (100_000, 1_000_000)
+            for backend in UHS_BACKENDS
+        ],
+    ),
+    Scenario(
+        "check_unspent_many",
+        check_unspent_many,
+        [{"uhs_size": 100_000, "backend": backend} for backend in UHS_BACKENDS],
+    ),
+    Scenario("receive_transfer", receive_transfer, [{"keys": 100}, {"keys": 10_000}]),
+]
@@ -0,0 +1,66 @@
+"""
+Benchmark: memory per UTXO held in a wallet ('TxIn' + 'Outpoint' + 'TxOut').
+Compares the slotted classes with the same classes using a per-instance __dict__
+(what they were before), with and without interning the txids.
+
+Run with: python -m benchmarks.utxo_memory
+"""
+import os
+import tracemalloc
+
+from cbdc.transaction import Outpoint, TxidInterner, TxIn, TxOut
+
+UTXOS = 100_000
+# UTXOs per transaction: outputs of the same transaction share a txid
+PER_TX = 10
+
+
+class DictOutpoint:
+    def __init__(self, index, txid):
+        self.index = index
+        self.txid = txid
+
+
+class DictTxOut:
+    def __init__(self, value, witness):
+        self.value = value
+        self.witness = witness
+
+
+class DictTxIn:
+    def __init__(self, outpoint, output):
+        self.prev_outpoint = outpoint
+        self.prev_output_data = output
+
+
+def footprint(outpoint_cls, txout_cls, txin_cls, intern: bool) -> float:
+    raw = [os.urandom(32) for _ in range(UTXOS // PER_TX)]
+    intern_txid = TxidInterner(UTXOS)
+
+    tracemalloc.start()
+    utxos = []
+    for i in range(UTXOS):
+        # as decoded off the wire: a separate txid bytes object per UTXO
+        txid = bytes(bytearray(raw[i // PER_TX]))
+        if intern:
+            txid = intern_txid(txid)
+        utxos.append(
+            txin_cls(outpoint_cls(i % PER_TX, txid), txout_cls(1.0, os.urandom(32)))
+        )
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / UTXOS
+
+
+def run():
+    print(f"{'variant':<28} {'bytes per UTXO':>16}")
+    for name, classes, intern in (
+        ("__dict__ (before)", (DictOutpoint, DictTxOut, DictTxIn), False),
+        ("__slots__", (Outpoint, TxOut, TxIn), False),
+        ("__slots__ + interned txid", (Outpoint, TxOut, TxIn), True),
+    ):
+        print(f"{name:<28} {footprint(*classes, intern):>16.1f}")
+
+
+if __name__ == "__main__":
+    run()
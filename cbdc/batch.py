@@ -0,0 +1,148 @@
+"""
+Columnar batch of transactions.  The fields of thousands of transactions are held in
+NumPy arrays, with per-transaction offsets into the input, output and witness arrays,
+so structure and balance checks run over the whole batch at once.
+"""
+from __future__ import annotations
+
+from typing import List, Sequence
+
+import numpy as np
+
+from cbdc.transaction import Outpoint, Transaction, TxIn, TxOut
+from cbdc.utils.hash import HashSize
+from cbdc.utils.keys import PUBLIC_KEY_SIZE, SIGNATURE_SIZE
+
+WITNESS_SIZE = PUBLIC_KEY_SIZE + SIGNATURE_SIZE
+
+
+def _offsets(counts: Sequence[int]) -> np.ndarray:
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def _rows(fields: Sequence[bytes], width: int) -> np.ndarray:
+    return np.frombuffer(b"".join(fields), dtype=np.uint8).reshape(-1, width)
+
+
+class TxBatch:
+    """
+    Transaction 'i' owns inputs [input_offsets[i], input_offsets[i + 1]),
+    and the same for outputs and witnesses
+    """
+
+    def __init__(self):
+        self.size: int = 0
+        # inputs: the outpoint and the output being spent
+        self.input_txids = np.empty((0, HashSize), dtype=np.uint8)
+        self.input_indices = np.empty(0, dtype=np.uint64)
+        self.input_values = np.empty(0, dtype=np.float64)
+        self.input_witnesses = np.empty((0, HashSize), dtype=np.uint8)
+        self.input_offsets = np.zeros(1, dtype=np.int64)
+        # outputs
+        self.output_values = np.empty(0, dtype=np.float64)
+        self.output_witnesses = np.empty((0, HashSize), dtype=np.uint8)
+        self.output_offsets = np.zeros(1, dtype=np.int64)
+        # witnesses: public key + signature
+        self.witnesses = np.empty((0, WITNESS_SIZE), dtype=np.uint8)
+        self.witness_offsets = np.zeros(1, dtype=np.int64)
+        # transactions with a witness of the wrong size. Those witnesses are
+        # stored as zeros
+        self.malformed = np.zeros(0, dtype=bool)
+
+    def from_transactions(txs: Sequence[Transaction]) -> TxBatch:
+        batch = TxBatch()
+        batch.size = len(txs)
+        inputs = [i for tx in txs for i in tx.inputs]
+        outputs = [o for tx in txs for o in tx.outputs]
+        witnesses = [w for tx in txs for w in tx.witnesses]
+        batch.malformed = np.zeros(len(txs), dtype=bool)
+        if not all(len(w) == WITNESS_SIZE for w in witnesses):
+            # one bad witness only rejects its own transaction
+            empty = bytes(WITNESS_SIZE)
+            witnesses = []
+            for t, tx in enumerate(txs):
+                for w in tx.witnesses:
+                    if len(w) != WITNESS_SIZE:
+                        batch.malformed[t] = True
+                        w = empty
+                    witnesses.append(w)
+
+        if inputs:
+            batch.input_txids = _rows([i.prev_outpoint.txid for i in inputs], HashSize)
+            batch.input_indices = np.array(
+                [i.prev_outpoint.index for i in inputs], dtype=np.uint64
+            )
+            batch.input_values = np.array(
+                [i.prev_output_data.value for i in inputs], dtype=np.float64
+            )
+            batch.input_witnesses = _rows(
+                [i.prev_output_data.witness for i in inputs], HashSize
+            )
+        if outputs:
+            batch.output_values = np.array([o.value for o in outputs], dtype=np.float64)
+            batch.output_witnesses = _rows([o.witness for o in outputs], HashSize)
+        if witnesses:
+            batch.witnesses = _rows(witnesses, WITNESS_SIZE)
+
+        batch.input_offsets = _offsets([len(tx.inputs) for tx in txs])
+        batch.output_offsets = _offsets([len(tx.outputs) for tx in txs])
+        batch.witness_offsets = _offsets([len(tx.witnesses) for tx in txs])
+        return batch
+
+    def to_transactions(self) -> List[Transaction]:
+        txs = []
+        for t in range(self.size):
+            tx = Transaction()
+            for i in range(self.input_offsets[t], self.input_offsets[t + 1]):
+                point = Outpoint(
+                    int(self.input_indices[i]), self.input_txids[i].tobytes()
+                )
+                output = TxOut(
+                    float(self.input_values[i]), self.input_witnesses[i].tobytes()
+                )
+                tx.inputs.append(TxIn(point, output))
+            for o in range(self.output_offsets[t], self.output_offsets[t + 1]):
+                tx.outputs.append(
+                    TxOut(
+                        float(self.output_values[o]), self.output_witnesses[o].tobytes()
+                    )
+                )
+            for w in range(self.witness_offsets[t], self.witness_offsets[t + 1]):
+                tx.witnesses.append(self.witnesses[w].tobytes())
+            txs.append(tx.seal())
+        return txs
+
+    def counts(self, offsets: np.ndarray) -> np.ndarray:
+        return np.diff(offsets)
+
+    def check_structure(self) -> np.ndarray:
+        """
+        Vectorized 'check_structure', plus the witness sizes (a malformed witness
+        fails the signature check otherwise).
+        Returns a mask of the transactions that pass
+        """
+        n_in = self.counts(self.input_offsets)
+        n_out = self.counts(self.output_offsets)
+        n_wit = self.counts(self.witness_offsets)
+        return (n_in > 0) & (n_out > 0) & (n_in == n_wit) & ~self.malformed
+
+    def check_inputs_outputs(self) -> np.ndarray:
+        """
+        Vectorized 'check_inputs_outputs'. Returns a mask of the transactions that pass.
+        Values are summed per transaction in order, the same as the scalar check
+        """
+        owners = np.arange(self.size)
+        in_owner = np.repeat(owners, self.counts(self.input_offsets))
+        out_owner = np.repeat(owners, self.counts(self.output_offsets))
+        in_value = np.bincount(in_owner, self.input_values, minlength=self.size)
+        out_value = np.bincount(out_owner, self.output_values, minlength=self.size)
+        return in_value == out_value
+
+    def valid_mask(self) -> np.ndarray:
+        """
+        Transactions that pass the structure and balance checks.
+        Only these need their signatures checked
+        """
+        return self.check_structure() & self.check_inputs_outputs()
@@ -0,0 +1,134 @@
+"""
+Caches that let validation skip redundant work.
+
+'SignatureCache' remembers signatures that verified, keyed on
+(txid, pubkey, signature), so a transaction that's resubmitted (client retries,
+the same transaction sent to several sentinels) isn't verified again.
+
+'DuplicateFilter' remembers the txids of transactions applied in the last
+'window' seconds.  A txid covers the inputs, so a transaction seen there would
+be rejected as a double spend anyway: it's rejected before any validation.
+
+Both count hits and misses on 'metrics' ('<name>.hits' and '<name>.misses').
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from cbdc.metrics import NullMetrics
+
+
+class SignatureCache:
+    """
+    Bounded: the least recently used entry is evicted past 'max_entries'.
+    Only successful verifications are cached. Thread safe
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 100_000,
+        metrics: Optional[NullMetrics] = None,
+        name: str = "sig_cache",
+    ):
+        assert max_entries > 0, "cache size must be positive"
+        self.max_entries: int = max_entries
+        self.metrics: NullMetrics = NullMetrics() if metrics is None else metrics
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: "OrderedDict[Tuple[bytes, bytes, bytes], None]" = OrderedDict()
+        self._hit_counter = name + ".hits"
+        self._miss_counter = name + ".misses"
+        self._lock = threading.Lock()
+
+    def verified(self, txid: bytes, pubkey: bytes, sig: bytes) -> bool:
+        """
+        Has this signature already been verified?
+        """
+        key = (txid, pubkey, sig)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                hit = True
+            else:
+                self.misses += 1
+                hit = False
+        self.metrics.count(self._hit_counter if hit else self._miss_counter)
+        return hit
+
+    def add(self, txid: bytes, pubkey: bytes, sig: bytes):
+        with self._lock:
+            self._entries[(txid, pubkey, sig)] = None
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DuplicateFilter:
+    """
+    txids added in the last 'window' seconds. Thread safe
+    """
+
+    def __init__(
+        self,
+        window: float = 60.0,
+        metrics: Optional[NullMetrics] = None,
+        clock: Callable[[], float] = time.monotonic,
+        name: str = "duplicates",
+    ):
+        assert window > 0, "window must be positive"
+        self.window: float = window
+        self.metrics: NullMetrics = NullMetrics() if metrics is None else metrics
+        self.hits: int = 0
+        self.misses: int = 0
+        # txid => when it was added, and the same in the order they were added
+        self._seen: Dict[bytes, float] = {}
+        self._order: Deque[Tuple[float, bytes]] = deque()
+        self._clock = clock
+        self._hit_counter = name + ".hits"
+        self._miss_counter = name + ".misses"
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        order = self._order
+        while order and now - order[0][0] >= self.window:
+            added, txid = order.popleft()
+            if self._seen.get(txid) == added:
+                del self._seen[txid]
+
+    def seen(self, txid: bytes) -> bool:
+        """
+        Was 'txid' added in the last 'window' seconds?
+        """
+        with self._lock:
+            self._expire(self._clock())
+            hit = txid in self._seen
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self.metrics.count(self._hit_counter if hit else self._miss_counter)
+        return hit
+
+    def add(self, txid: bytes):
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            self._seen[txid] = now
+            self._order.append((now, txid))
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self._seen)
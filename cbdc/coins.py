@@ -0,0 +1,262 @@
+"""
+Coin selection. The wallet's spendable inputs are indexed by value so a
+strategy can pick the inputs for a transfer without walking all of them.
+
+Strategies:
+ - first_fit: oldest inputs first, until the amount is reached
+ - largest_first: biggest inputs first
+ - fewest_inputs: as few inputs as largest_first, but the last one is the smallest
+   input that covers what's left (less change)
+ - branch_and_bound: search for inputs that add up to exactly the amount (no change),
+   falls back to fewest_inputs
+"""
+from bisect import bisect_left, insort
+from itertools import chain, takewhile
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from cbdc.transaction import TxIn
+
+# (value, insertion sequence number)
+UtxoKey = Tuple[float, int]
+
+# stop the exact match search after this many steps
+BNB_MAX_TRIES = 100_000
+# keys per bucket of a SortedKeys (a bucket splits at twice this)
+BUCKET_SIZE = 512
+
+
+class SortedKeys:
+    """
+    Sorted UtxoKeys, kept in buckets (sorted lists of at most 2 * BUCKET_SIZE keys)
+    with the largest key of each bucket in 'maxes'.  'add' and 'remove' bisect to a
+    bucket and only shift that bucket, instead of the whole list: O(log n) plus a
+    bounded move, where a single sorted list is O(n)
+    """
+
+    def __init__(self, keys: Iterable[UtxoKey] = ()):
+        self._buckets: List[List[UtxoKey]] = []
+        self._maxes: List[UtxoKey] = []
+        self._len: int = 0
+        self.update(keys)
+
+    def update(self, keys: Iterable[UtxoKey]):
+        """
+        Add many keys: sorts once and rebuilds the buckets
+        """
+        keys = sorted(chain(self, keys))
+        self._buckets = [
+            keys[i : i + BUCKET_SIZE] for i in range(0, len(keys), BUCKET_SIZE)
+        ]
+        self._maxes = [b[-1] for b in self._buckets]
+        self._len = len(keys)
+
+    def add(self, key: UtxoKey):
+        buckets, maxes = self._buckets, self._maxes
+        self._len += 1
+        if not buckets:
+            buckets.append([key])
+            maxes.append(key)
+            return
+        b = bisect_left(maxes, key)
+        if b == len(maxes):
+            # new largest key
+            b -= 1
+            buckets[b].append(key)
+            maxes[b] = key
+        else:
+            insort(buckets[b], key)
+        bucket = buckets[b]
+        if len(bucket) > 2 * BUCKET_SIZE:
+            buckets.insert(b + 1, bucket[BUCKET_SIZE:])
+            del bucket[BUCKET_SIZE:]
+            maxes.insert(b, bucket[-1])
+
+    def remove(self, key: UtxoKey):
+        buckets, maxes = self._buckets, self._maxes
+        b = bisect_left(maxes, key)
+        bucket = buckets[b] if b < len(maxes) else []
+        i = bisect_left(bucket, key)
+        if i == len(bucket) or bucket[i] != key:
+            raise KeyError(key)
+        del bucket[i]
+        self._len -= 1
+        if not bucket:
+            del buckets[b]
+            del maxes[b]
+        elif i == len(bucket):
+            maxes[b] = bucket[-1]
+
+    def ceiling(self, key: UtxoKey) -> Optional[UtxoKey]:
+        """
+        Smallest key >= 'key'
+        """
+        b = bisect_left(self._maxes, key)
+        if b == len(self._maxes):
+            return None
+        bucket = self._buckets[b]
+        return bucket[bisect_left(bucket, key)]
+
+    def lower(self, key: UtxoKey) -> Optional[UtxoKey]:
+        """
+        Largest key < 'key'
+        """
+        b = bisect_left(self._maxes, key)
+        if b < len(self._maxes):
+            bucket = self._buckets[b]
+            i = bisect_left(bucket, key)
+            if i:
+                return bucket[i - 1]
+        return self._buckets[b - 1][-1] if b else None
+
+    def below(self, key: UtxoKey) -> Iterator[UtxoKey]:
+        """
+        Keys < 'key', smallest first
+        """
+        return takewhile(lambda k: k < key, self)
+
+    def __iter__(self) -> Iterator[UtxoKey]:
+        return chain.from_iterable(self._buckets)
+
+    def __reversed__(self) -> Iterator[UtxoKey]:
+        for bucket in reversed(self._buckets):
+            yield from reversed(bucket)
+
+    def __len__(self) -> int:
+        return self._len
+
+
+class UtxoStore:
+    """
+    Spendable inputs.  Iterates in the order they were added.
+    Keeps a sorted (value, seq) index for selection
+    """
+
+    def __init__(self):
+        self._inputs: Dict[int, TxIn] = {}
+        self._by_value: SortedKeys = SortedKeys()
+        self._seq: int = 0
+
+    def append(self, txin: TxIn):
+        self._inputs[self._seq] = txin
+        self._by_value.add((txin.prev_output_data.value, self._seq))
+        self._seq += 1
+
+    def remove(self, keys: Sequence[UtxoKey]) -> List[TxIn]:
+        """
+        Remove the inputs for the given keys. Returns them
+        """
+        removed = []
+        for key in keys:
+            self._by_value.remove(key)
+            removed.append(self._inputs.pop(key[1]))
+        return removed
+
+    def oldest(self) -> Iterator[UtxoKey]:
+        """
+        Keys in the order the inputs were added
+        """
+        for seq, txin in self._inputs.items():
+            yield txin.prev_output_data.value, seq
+
+    def total(self) -> float:
+        """
+        Sum of the values
+        """
+        return sum(txin.prev_output_data.value for txin in self._inputs.values())
+
+    def select(self, amount: float, strategy: str) -> List[UtxoKey]:
+        """
+        Pick inputs that add up to at least 'amount' (if possible) with the
+        given strategy.  Doesn't remove them
+        """
+        return STRATEGIES[strategy](self, amount)
+
+    def __len__(self) -> int:
+        return len(self._inputs)
+
+    def __iter__(self) -> Iterator[TxIn]:
+        return iter(self._inputs.values())
+
+
+### Strategies ###
+
+
+def first_fit(store: UtxoStore, amount: float) -> List[UtxoKey]:
+    selected = []
+    total = 0
+    for key in store.oldest():
+        selected.append(key)
+        total += key[0]
+        if total >= amount:
+            break
+    return selected
+
+
+def largest_first(store: UtxoStore, amount: float) -> List[UtxoKey]:
+    selected = []
+    total = 0
+    for key in reversed(store._by_value):
+        selected.append(key)
+        total += key[0]
+        if total >= amount:
+            break
+    return selected
+
+
+def fewest_inputs(store: UtxoStore, amount: float) -> List[UtxoKey]:
+    by_value = store._by_value
+    selected = []
+    remaining = amount
+    # inputs below 'top' haven't been taken
+    top = (float("inf"), 0)
+    while remaining > 0:
+        # smallest input that covers the rest
+        key = by_value.ceiling((remaining, -1))
+        if key is not None and key < top:
+            selected.append(key)
+            return selected
+        # none: take the largest and keep going
+        top = by_value.lower(top)
+        if top is None:
+            break
+        selected.append(top)
+        remaining -= top[0]
+    return selected
+
+
+def branch_and_bound(store: UtxoStore, amount: float) -> List[UtxoKey]:
+    # candidates no bigger than the amount, largest first
+    candidates = list(store._by_value.below((amount, 1 << 62)))
+    candidates.reverse()
+    # remaining[i] = sum of the candidates from i on
+    remaining = [0.0] * (len(candidates) + 1)
+    for i in range(len(candidates) - 1, -1, -1):
+        remaining[i] = remaining[i + 1] + candidates[i][0]
+
+    # depth first, trying to include each candidate before excluding it
+    included: List[int] = []
+    total = 0.0
+    i = 0
+    for _ in range(BNB_MAX_TRIES):
+        if total == amount:
+            return [candidates[j] for j in included]
+        if total > amount or total + remaining[i] < amount:
+            # dead end: drop the last included candidate and continue without it
+            if not included:
+                break
+            j = included.pop()
+            total -= candidates[j][0]
+            i = j + 1
+            continue
+        included.append(i)
+        total += candidates[i][0]
+        i += 1
+    return fewest_inputs(store, amount)
+
+
+STRATEGIES: Dict[str, Callable[[UtxoStore, float], List[UtxoKey]]] = {
+    "first_fit": first_fit,
+    "largest_first": largest_first,
+    "fewest_inputs": fewest_inputs,
+    "branch_and_bound": branch_and_bound,
+}
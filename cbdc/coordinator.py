@@ -0,0 +1,123 @@
+"""
+The coordinator collects validated (compact) transactions into batches and
+applies each batch to the UHS in one pass.  Batch size and deadline trade
+latency against throughput.
+"""
+import time
+from contextlib import nullcontext
+from typing import Callable, ContextManager, List, MutableSet, Optional, Tuple
+
+from cbdc.transaction import CompactTx
+from cbdc.utils.digest import MultisetDigest
+from cbdc.wal import WriteAheadLog
+
+# (tx_id, accepted?)
+BatchResult = Tuple[bytes, bool]
+
+
+class BatchCoordinator:
+    """
+    A batch is flushed when it holds 'batch_size' transactions, or when the oldest
+    transaction in it has waited 'batch_deadline' seconds (checked on 'submit' and 'poll').
+
+    Within a batch, transactions are accepted in submission order. A transaction is
+    rejected if it spends something that isn't in the UHS (or created earlier in
+    the batch), or that an earlier transaction in the batch already spends.
+
+    If 'digest' is given it's kept up to date with the UHS, e.g. pass the
+    'UhsController.digest' of the controller that owns 'uhs'.  Likewise, accepted
+    transactions are appended to 'wal' if it's given, after the UHS is updated,
+    and 'flush' returns once they are durable.  Pass the controller's 'store_lock'
+    as 'lock' so the batch is applied and logged in between its transactions
+    and snapshots.
+    """
+
+    def __init__(
+        self,
+        uhs: MutableSet[bytes],
+        batch_size: int = 1000,
+        batch_deadline: float = 0.05,
+        clock: Callable[[], float] = time.monotonic,
+        digest: Optional[MultisetDigest] = None,
+        wal: Optional[WriteAheadLog] = None,
+        lock: Optional[ContextManager] = None,
+    ):
+        assert batch_size > 0, "batch size must be positive"
+        self.uhs: MutableSet[bytes] = uhs
+        self.batch_size: int = batch_size
+        self.batch_deadline: float = batch_deadline
+        self.pending: List[CompactTx] = []
+        self.digest: Optional[MultisetDigest] = digest
+        self.wal: Optional[WriteAheadLog] = wal
+        self.lock: ContextManager = nullcontext() if lock is None else lock
+        self._clock = clock
+        self._opened: float = 0.0
+
+    def submit(self, cmptx: CompactTx) -> List[BatchResult]:
+        """
+        Add a transaction to the current batch.
+        Returns the results of the batch if this flushed it, otherwise an empty list
+        """
+        if not self.pending:
+            self._opened = self._clock()
+        self.pending.append(cmptx)
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return self.poll()
+
+    def poll(self) -> List[BatchResult]:
+        """
+        Flush the current batch if its deadline has passed
+        """
+        if self.pending and self._clock() - self._opened >= self.batch_deadline:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[BatchResult]:
+        """
+        Apply the current batch to the UHS.  With a 'wal', returns once the
+        accepted transactions are durable.
+        Returns (tx_id, accepted) for each transaction, in submission order
+        """
+        batch, self.pending = self.pending, []
+        with self.lock:
+            results = self._apply(batch)
+        if self.wal is not None:
+            self.wal.wait(self.wal.appended)
+        return results
+
+    def _apply(self, batch: List[CompactTx]) -> List[BatchResult]:
+        uhs = self.uhs
+        spent: MutableSet[bytes] = set()
+        created: MutableSet[bytes] = set()
+        accepted: List[CompactTx] = []
+        results: List[BatchResult] = []
+
+        for cmptx in batch:
+            spends = set(cmptx.spends)
+            ok = (
+                len(spends) == len(cmptx.spends)
+                and spent.isdisjoint(spends)
+                and all(s in created or s in uhs for s in spends)
+            )
+            if ok:
+                spent |= spends
+                created.update(cmptx.creates)
+                accepted.append(cmptx)
+            results.append((cmptx.tx_id, ok))
+
+        # one pass over the UHS for the whole batch. Outputs created and spent
+        # within the batch never reach the UHS
+        removed = spent - created
+        added = created - spent
+        if self.digest is not None:
+            # everything removed was checked to be in the UHS above
+            self.digest.remove(removed)
+            self.digest.add(a for a in added if a not in uhs)
+        uhs.difference_update(removed)
+        uhs.update(added)
+        # replaying the records one by one ends in the same UHS
+        if self.wal is not None:
+            for cmptx in accepted:
+                self.wal.append(cmptx)
+        return results
@@ -0,0 +1,109 @@
+"""
+Keypairs generated ahead of time.  A background thread keeps up to 'size' keypairs
+ready, so a wallet doesn't pay keygen latency inline when it mints, transfers or
+hands out an address.  Each keypair is numbered: with a seed (see 'derive_keypair')
+the wallet keeps the number instead of the secret key and re-derives it to sign.
+"""
+import threading
+from collections import deque
+from collections.abc import Mapping
+from typing import Callable, Deque, Iterator, MutableMapping, Tuple
+
+from cbdc.utils.keys import derive_keypair
+
+# (index, publickey, secretkey)
+PooledKey = Tuple[int, bytes, bytes]
+
+
+class KeyPool:
+    """
+    'generate(index)' returns a (publickey, secretkey).  Indices are handed out
+    from 'start', each one once.  With 'size' 0 there's no background thread and
+    keys are generated on demand
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[int], Tuple[bytes, bytes]],
+        start: int = 0,
+        size: int = 0,
+    ):
+        self.size: int = size
+        self._generate = generate
+        self._next: int = start
+        self._keys: Deque[PooledKey] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        if size > 0:
+            self._thread = threading.Thread(target=self._refill, daemon=True)
+            self._thread.start()
+
+    def _reserve(self) -> int:
+        with self._cond:
+            index = self._next
+            self._next += 1
+            return index
+
+    def _make(self) -> PooledKey:
+        index = self._reserve()
+        return (index,) + tuple(self._generate(index))
+
+    def _refill(self):
+        while True:
+            with self._cond:
+                # wait until the pool is half empty, then fill it back up
+                while not self._closed and len(self._keys) > self.size // 2:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                missing = self.size - len(self._keys)
+            for _ in range(missing):
+                key = self._make()
+                with self._cond:
+                    self._keys.append(key)
+                    self._cond.notify_all()
+
+    def take(self) -> PooledKey:
+        """
+        Next ready keypair, or a new one if the pool is empty
+        """
+        with self._cond:
+            if self._keys:
+                key = self._keys.popleft()
+                if len(self._keys) <= self.size // 2:
+                    self._cond.notify_all()
+                return key
+        return self._make()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class DerivedSecrets(Mapping):
+    """
+    pubkey => secret key, re-derived from the seed and the key's index
+    """
+
+    def __init__(self, seed: bytes, indices: MutableMapping[bytes, int]):
+        self._seed = seed
+        self._indices = indices
+
+    def __getitem__(self, pubkey: bytes) -> bytes:
+        return derive_keypair(self._seed, self._indices[pubkey])[1]
+
+    def __contains__(self, pubkey: bytes) -> bool:
+        return pubkey in self._indices
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self._indices)
+
+    def __len__(self) -> int:
+        return len(self._indices)
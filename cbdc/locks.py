@@ -0,0 +1,86 @@
+"""
+Lock table on UHS IDs.  A transaction locks all its spends (all or nothing) before
+it's validated and applied, so transactions touching disjoint outputs can run at
+the same time and a conflicting one fails fast instead of waiting.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Iterable, MutableSet, Sequence
+
+
+class LockTable:
+    def __init__(self):
+        self.locked: MutableSet[bytes] = set()
+        self._mutex = threading.Lock()
+
+    def try_lock(self, uhs_ids: Sequence[bytes]) -> bool:
+        """
+        Lock all of 'uhs_ids', or none of them if any is already locked.
+        Returns True if they're now locked by the caller
+        """
+        with self._mutex:
+            if not self.locked.isdisjoint(uhs_ids):
+                return False
+            self.locked.update(uhs_ids)
+            return True
+
+    def release(self, uhs_ids: Iterable[bytes]):
+        with self._mutex:
+            self.locked.difference_update(uhs_ids)
+
+    def __len__(self) -> int:
+        return len(self.locked)
+
+
+class SharedLock:
+    """
+    Held by many threads at once in 'shared' mode, or by one in 'exclusive' mode.
+    A thread waiting for 'exclusive' holds off new shared holders, and the
+    shared holders waiting when it releases go next, so neither side starves
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared: int = 0
+        self._exclusive = False
+        self._waiting_shared: int = 0
+        self._waiting_exclusive: int = 0
+        # the shared holders that waited on an exclusive one go first
+        self._shared_turn = False
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            self._waiting_shared += 1
+            while self._exclusive or (
+                self._waiting_exclusive and not self._shared_turn
+            ):
+                self._cond.wait()
+            self._waiting_shared -= 1
+            self._shared += 1
+            if not self._waiting_shared and self._shared_turn:
+                self._shared_turn = False
+                self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                if not self._shared:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._waiting_exclusive += 1
+            while self._exclusive or self._shared or self._shared_turn:
+                self._cond.wait()
+            self._waiting_exclusive -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._shared_turn = self._waiting_shared > 0
+                self._cond.notify_all()
@@ -0,0 +1,181 @@
+"""
+Opt-in instrumentation for the UHS execution path.
+
+Each stage is run through 'metrics.run(stage, fn, *args)'.  The default, 'NullMetrics',
+just calls 'fn', so instrumentation costs one extra call when it's disabled.
+'Metrics' records a call counter and a latency histogram per stage, and sends
+snapshots and transaction displays to pluggable exporters.
+"""
+import json
+import threading
+from collections import defaultdict
+from time import perf_counter
+from typing import Any, Callable, Dict, List, MutableMapping, Sequence
+
+from cbdc.transaction import CompactTx
+
+# latency buckets are powers of 2 in microseconds: [0, 1), [1, 2), [2, 4) ...
+NUM_BUCKETS = 40
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets: List[int] = [0] * NUM_BUCKETS
+        self.count: int = 0
+        self.total: float = 0.0
+        self.min: float = float("inf")
+        self.max: float = 0.0
+
+    def observe(self, seconds: float):
+        micros = int(seconds * 1e6)
+        self.buckets[min(micros.bit_length(), NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, pct: float) -> float:
+        """
+        Estimated percentile (in seconds): upper bound of the bucket it falls in
+        """
+        target = self.count * pct / 100
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min((1 << idx) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_us": self.total / self.count * 1e6 if self.count else 0.0,
+            "min_us": self.min * 1e6 if self.count else 0.0,
+            "max_us": self.max * 1e6,
+            "p50_us": self.percentile(50) * 1e6,
+            "p90_us": self.percentile(90) * 1e6,
+            "p99_us": self.percentile(99) * 1e6,
+            # bucket upper bound (us) => count
+            "buckets": {1 << i: n for i, n in enumerate(self.buckets) if n},
+        }
+
+
+class Exporter:
+    """
+    Base exporter. Override what you need
+    """
+
+    def export(self, snapshot: Dict[str, Any]):
+        pass
+
+    def display(self, cmptx: CompactTx, title: str):
+        pass
+
+
+class ConsoleExporter(Exporter):
+    """
+    Prints transaction displays and snapshots to stdout
+    """
+
+    def export(self, snapshot: Dict[str, Any]):
+        print(f"{'stage':<28} {'count':>8} {'mean us':>10} {'p99 us':>10}")
+        for stage, h in sorted(snapshot["stages"].items()):
+            print(
+                f"{stage:<28} {h['count']:>8} {h['mean_us']:>10.1f} {h['p99_us']:>10.1f}"
+            )
+        for name, value in sorted(snapshot["counters"].items()):
+            print(f"{name:<28} {value:>8}")
+
+    def display(self, cmptx: CompactTx, title: str):
+        if title:
+            print("\n *** {} ***".format(title))
+        cmptx.display()
+
+
+class JsonFileExporter(Exporter):
+    """
+    Writes each snapshot to 'path' as JSON (overwrites)
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+
+    def export(self, snapshot: Dict[str, Any]):
+        with open(self.path, "w") as f:
+            json.dump(snapshot, f, indent=2)
+
+
+class NullMetrics:
+    """
+    Instrumentation disabled.  'display' keeps the demo behaviour of printing to stdout
+    (only called when a display is asked for)
+    """
+
+    enabled = False
+
+    def run(self, stage: str, fn: Callable, *args):
+        return fn(*args)
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+    def display(self, cmptx: CompactTx, title: str = ""):
+        ConsoleExporter().display(cmptx, title)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"counters": {}, "stages": {}}
+
+    def export(self):
+        pass
+
+
+class Metrics(NullMetrics):
+    """
+    Records counters and per-stage latency histograms. Thread safe
+    """
+
+    enabled = True
+
+    def __init__(self, exporters: Sequence[Exporter] = ()):
+        self.exporters: List[Exporter] = list(exporters)
+        self.counters: MutableMapping[str, int] = defaultdict(int)
+        self.stages: MutableMapping[str, Histogram] = defaultdict(Histogram)
+        self._lock = threading.Lock()
+
+    def run(self, stage: str, fn: Callable, *args):
+        start = perf_counter()
+        try:
+            return fn(*args)
+        except Exception:
+            self.count(stage + ".errors")
+            raise
+        finally:
+            self.observe(stage, perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage].observe(seconds)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def display(self, cmptx: CompactTx, title: str = ""):
+        for e in self.exporters:
+            e.display(cmptx, title)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "stages": {k: h.snapshot() for k, h in self.stages.items()},
+            }
+
+    def export(self):
+        """
+        Send a snapshot to every exporter
+        """
+        snapshot = self.snapshot()
+        for e in self.exporters:
+            e.export(snapshot)
@@ -0,0 +1,193 @@
+"""
+Sentinel service.  Accepts serialized transactions over TCP or a Unix socket and
+executes them against a UhsController.
+
+Framing: every message is a 4 byte (big endian) length followed by the body.
+ - request body:  request id (8 bytes) + serialized transaction
+ - response body: request id (8 bytes) + status (1 byte, 1 = accepted) + utf8 message
+
+A client can pipeline many requests on one connection.  Responses carry the request
+id and come back in completion order.  Requests are decoded and checked against the
+UHS's duplicate filter on the event loop thread, then validated (the signature checks)
+on an executor.  The UHS is only updated from the event loop thread.
+"""
+import asyncio
+import struct
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Optional, Tuple
+
+from cbdc.transaction import Transaction
+from cbdc.uhs import UhsController, validate_transaction
+
+FRAME_HEADER = struct.Struct("!I")
+REQUEST_ID = struct.Struct("!Q")
+STATUS = struct.Struct("!QB")
+# refuse frames bigger than this
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """
+    Read one frame. Returns None if the connection closed cleanly
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    assert size <= MAX_FRAME_SIZE, "frame too large"
+    return await reader.readexactly(size)
+
+
+def write_frame(writer: asyncio.StreamWriter, body: bytes):
+    writer.write(FRAME_HEADER.pack(len(body)) + body)
+
+
+class SentinelServer:
+    """
+    Serves 'uhs' over a socket.  'executor' (thread or process pool) runs the
+    validation; the default is the event loop's thread pool
+    """
+
+    def __init__(self, uhs: UhsController, executor: Optional[Executor] = None):
+        self.uhs: UhsController = uhs
+        self.executor: Optional[Executor] = executor
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start_tcp(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    async def start_unix(self, path: str):
+        self.server = await asyncio.start_unix_server(self._handle, path)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # only one task can drain the writer at a time
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                body = await read_frame(reader)
+                if body is None:
+                    break
+                # don't wait for the result: keep reading pipelined requests
+                task = asyncio.create_task(self._execute(body, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except (asyncio.IncompleteReadError, ConnectionError, AssertionError):
+            pass
+        finally:
+            writer.close()
+
+    def _decode(self, raw: bytes) -> Tuple[Optional[Transaction], str]:
+        """
+        Runs on the event loop thread, whatever the executor, so the duplicate
+        filter is always checked (and before any signature is).
+        Returns (transaction, "") or (None, reason)
+        """
+        try:
+            tx = Transaction.deserialize(raw)
+        except (AssertionError, struct.error):
+            return None, "malformed transaction"
+        if self.uhs.is_duplicate(tx.tx_id()):
+            return None, "duplicate transaction"
+        return tx, ""
+
+    async def _execute(
+        self, body: bytes, writer: asyncio.StreamWriter, write_lock: asyncio.Lock
+    ):
+        request_id = body[: REQUEST_ID.size]
+        loop = asyncio.get_running_loop()
+        tx, reason = self._decode(body[REQUEST_ID.size :])
+        if tx is not None:
+            check = validate_transaction
+            if not isinstance(self.executor, ProcessPoolExecutor):
+                # threads share the signature cache
+                check = partial(validate_transaction, cache=self.uhs.sig_cache)
+            if not await loop.run_in_executor(self.executor, check, tx):
+                tx, reason = None, "invalid transaction"
+        # check-and-apply: rejects spends that are missing from the UHS
+        if tx is not None and not self.uhs.process(tx, False):
+            tx, reason = None, "inputs are missing or spent"
+        wal = self.uhs.wal
+        if tx is not None and wal is not None:
+            # acknowledge once it's durable. Requests in flight share an fsync
+            await loop.run_in_executor(None, wal.wait, wal.appended)
+
+        write_frame(writer, request_id + bytes([tx is not None]) + reason.encode())
+        async with write_lock:
+            await writer.drain()
+
+
+class SentinelClient:
+    """
+    Async client for the sentinel.  Many 'submit' calls can be in flight at once
+    on the same connection
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._next_id: int = 0
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._write_lock = asyncio.Lock()
+        self._reader_task = asyncio.create_task(self._read_responses())
+
+    @classmethod
+    async def connect_tcp(cls, host: str, port: int) -> "SentinelClient":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    @classmethod
+    async def connect_unix(cls, path: str) -> "SentinelClient":
+        reader, writer = await asyncio.open_unix_connection(path)
+        return cls(reader, writer)
+
+    async def submit(self, tx: Transaction) -> Tuple[bool, str]:
+        """
+        Send a transaction to the sentinel.
+        Returns (accepted, reason)
+        """
+        request_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+
+        write_frame(self.writer, REQUEST_ID.pack(request_id) + tx.serialize())
+        async with self._write_lock:
+            await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self._reader_task.cancel()
+
+    async def _read_responses(self):
+        try:
+            while True:
+                body = await read_frame(self.reader)
+                if body is None:
+                    break
+                request_id, status = STATUS.unpack_from(body)
+                future = self._pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result((status == 1, body[STATUS.size :].decode()))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        # fail anything still waiting
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("sentinel connection closed"))
+        self._pending.clear()
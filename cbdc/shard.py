@@ -0,0 +1,193 @@
+"""
+Locking shards.  The UHS is split into N shards, each owning a key range of the
+UHS IDs (by the first byte of the ID).  A CompactTx is applied with two-phase commit
+across the shards it touches:
+ - prepare: each shard checks the spends are unspent and locks them
+ - commit: each shard removes the spends, adds the creates and releases the locks
+ - abort: if any shard fails to prepare, the others release their locks
+"""
+import threading
+from collections.abc import MutableSet
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from cbdc.transaction import CompactTx
+from cbdc.utils.digest import MultisetDigest, combine_digests
+
+# UHS IDs are routed by their first byte
+KEY_RANGE = 256
+
+
+class LockingShard:
+    """
+    Owns the UHS IDs whose first byte is in [start, end)
+    """
+
+    def __init__(self, start: int, end: int):
+        assert 0 <= start < end <= KEY_RANGE, "invalid key range"
+        self.start: int = start
+        self.end: int = end
+        self.uhs: MutableSet[bytes] = set()
+        # UHS IDs locked by a prepared transaction
+        self.locked: MutableSet[bytes] = set()
+        # tx_id => the spends it has locked
+        self.pending: Dict[bytes, Sequence[bytes]] = {}
+        # digest of 'uhs', kept up to date with it
+        self.digest: MultisetDigest = MultisetDigest()
+        self._mutex = threading.Lock()
+
+    def owns(self, uhs_id: bytes) -> bool:
+        return self.start <= uhs_id[0] < self.end
+
+    def prepare(self, tx_id: bytes, spends: Sequence[bytes]) -> bool:
+        """
+        Phase 1: lock the spends.  Fails if any spend is missing or already locked
+        """
+        with self._mutex:
+            for s in spends:
+                if s in self.locked or s not in self.uhs:
+                    return False
+            self.locked.update(spends)
+            self.pending[tx_id] = spends
+            return True
+
+    def commit(self, tx_id: bytes, creates: Sequence[bytes]):
+        """
+        Phase 2: remove the locked spends, add the creates and release the locks
+        """
+        with self._mutex:
+            spends = self.pending.pop(tx_id, ())
+            # prepare checked the spends are there
+            self.uhs.difference_update(spends)
+            self.digest.remove(spends)
+            self.locked.difference_update(spends)
+            self._add(creates)
+
+    def _add(self, uhs_ids: Iterable[bytes]):
+        uhs = self.uhs
+        new = [u for u in uhs_ids if u not in uhs]
+        uhs.update(new)
+        self.digest.add(new)
+
+    def _discard(self, uhs_ids: Iterable[bytes]):
+        uhs = self.uhs
+        gone = [u for u in uhs_ids if u in uhs]
+        uhs.difference_update(gone)
+        self.digest.remove(gone)
+
+    def abort(self, tx_id: bytes):
+        """
+        Phase 2 (failure): release the locks without changing the UHS
+        """
+        with self._mutex:
+            spends = self.pending.pop(tx_id, ())
+            self.locked.difference_update(spends)
+
+
+class ShardedUhs(MutableSet):
+    """
+    The coordinator for a set of locking shards.
+    Can be used anywhere the UHS set is: membership, add and remove are routed
+    to the owning shard.  Use 'apply' to update the UHS with a CompactTx.
+    """
+
+    def __init__(self, num_shards: int):
+        assert 0 < num_shards <= KEY_RANGE, "number of shards must be in 1..256"
+        self.shards: MutableSequence[LockingShard] = []
+        # first byte of a UHS ID => index of the shard that owns it
+        self._route: List[int] = []
+        for i in range(num_shards):
+            start = i * KEY_RANGE // num_shards
+            end = (i + 1) * KEY_RANGE // num_shards
+            self.shards.append(LockingShard(start, end))
+            self._route.extend([i] * (end - start))
+
+    def shard_for(self, uhs_id: bytes) -> LockingShard:
+        return self.shards[self._route[uhs_id[0]]]
+
+    def apply(
+        self,
+        cmptx: CompactTx,
+        on_prepared: Optional[Callable[[CompactTx], None]] = None,
+    ) -> bool:
+        """
+        Two-phase commit of a CompactTx across the shards it touches.
+        Returns False (and changes nothing) if a spend is missing, locked
+        by another transaction, or spent twice in the same transaction.
+        'on_prepared' is called once every shard has prepared, before the commit
+        (e.g. to log the transaction): a transaction spending one of the creates
+        can't prepare until this commit, so it's called after this one
+        """
+        if len(set(cmptx.spends)) != len(cmptx.spends):
+            return False
+
+        # group the spends and creates by shard
+        touched: Dict[int, Tuple[List[bytes], List[bytes]]] = {}
+        for s in cmptx.spends:
+            touched.setdefault(self._route[s[0]], ([], []))[0].append(s)
+        for c in cmptx.creates:
+            touched.setdefault(self._route[c[0]], ([], []))[1].append(c)
+
+        # phase 1: prepare (in shard order)
+        prepared: List[int] = []
+        for idx in sorted(touched):
+            if not self.shards[idx].prepare(cmptx.tx_id, touched[idx][0]):
+                for p in prepared:
+                    self.shards[p].abort(cmptx.tx_id)
+                return False
+            prepared.append(idx)
+
+        if on_prepared is not None:
+            on_prepared(cmptx)
+
+        # phase 2: commit
+        for idx in prepared:
+            self.shards[idx].commit(cmptx.tx_id, touched[idx][1])
+        return True
+
+    def shard_digests(self) -> List[bytes]:
+        """
+        Digest of each shard's UHS IDs (see cbdc.utils.digest)
+        """
+        return [shard.digest.digest() for shard in self.shards]
+
+    def state_digest(self) -> bytes:
+        """
+        Digest of all the UHS IDs: the shard digests combined
+        """
+        return combine_digests(self.shard_digests())
+
+    ### set interface ###
+
+    def __contains__(self, uhs_id: bytes) -> bool:
+        return uhs_id in self.shard_for(uhs_id).uhs
+
+    def __iter__(self) -> Iterator[bytes]:
+        for shard in self.shards:
+            yield from shard.uhs
+
+    def __len__(self) -> int:
+        return sum(len(shard.uhs) for shard in self.shards)
+
+    def add(self, uhs_id: bytes):
+        self.shard_for(uhs_id)._add((uhs_id,))
+
+    def discard(self, uhs_id: bytes):
+        self.shard_for(uhs_id)._discard((uhs_id,))
+
+    def update(self, uhs_ids: Iterable[bytes]):
+        for u in uhs_ids:
+            self.add(u)
+
+    def difference_update(self, uhs_ids: Iterable[bytes]):
+        for u in uhs_ids:
+            self.discard(u)
@@ -0,0 +1,66 @@
+"""
+Compact in-memory UHS.  All the IDs live in one 'bytearray' of 32 byte slots instead
+of a Python 'set' of 'bytes' objects (~70-100 bytes of overhead each).
+Memory per entry is 32 / load factor.
+"""
+from typing import Iterable
+
+from cbdc.storage.table import KEY_SIZE, SlotTable
+from cbdc.utils.hash import ZeroHash
+
+
+class CompactUhsSet(SlotTable):
+    """
+    Growable hash set of 32 byte UHS IDs.  The table doubles when the load factor
+    goes over 'max_load'
+    """
+
+    def __init__(
+        self, keys: Iterable[bytes] = (), capacity: int = 1024, max_load: float = 0.85
+    ):
+        assert 0 < max_load < 1, "max_load must be between 0 and 1"
+        super().__init__(bytearray(capacity * KEY_SIZE), 0, capacity)
+        self._count: int = 0
+        self._max_load: float = max_load
+        self._limit: int = int(capacity * max_load)
+        self.update(keys)
+
+    def _get_count(self) -> int:
+        return self._count
+
+    def _set_count(self, count: int):
+        self._count = count
+
+    def _before_insert(self) -> bool:
+        if self._count < self._limit:
+            return False
+        self.reserve(self._count + 1)
+        return True
+
+    def reserve(self, count: int):
+        """
+        Grow the table so it can hold 'count' IDs without resizing
+        """
+        capacity = self._capacity
+        while int(capacity * self._max_load) < count:
+            capacity *= 2
+        if capacity == self._capacity:
+            return
+
+        old_buf = self._buf
+        old_capacity = self._capacity
+        super().__init__(bytearray(capacity * KEY_SIZE), 0, capacity)
+        self._limit = int(capacity * self._max_load)
+        for start in range(0, old_capacity * KEY_SIZE, KEY_SIZE):
+            key = bytes(old_buf[start : start + KEY_SIZE])
+            if key != ZeroHash:
+                slot, _ = self._find(key)
+                self._write(slot, key)
+
+    def update(self, keys: Iterable[bytes]):
+        """
+        Batch insert. Sizes the table once up front when the number of keys is known
+        """
+        if hasattr(keys, "__len__"):
+            self.reserve(self._count + len(keys))
+        super().update(keys)
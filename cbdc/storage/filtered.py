@@ -0,0 +1,95 @@
+"""
+Bloom filter in front of a UHS backend.  Lookups of IDs that were never added
+(most of them, when reconciling against a large UHS) are answered by the
+filter and never reach the backing store.
+"""
+from collections.abc import MutableSet
+from typing import Iterable, Iterator, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from cbdc.storage.table import SlotTable
+from cbdc.utils.bloom import BloomFilter
+
+
+class FilteredUhs(MutableSet):
+    """
+    Wraps any UHS backend (e.g. MmapUhsTable).  Removed IDs stay in the filter
+    until it's rebuilt, which happens when it fills up.
+    For a fixed-size backend the filter is sized for twice its 'max_count', so
+    it only fills after that many adds (the table full, then as many again
+    from churn), never from the UHS growing.  The keys of a SlotTable are
+    loaded into the filter with numpy, straight from the slots
+    """
+
+    def __init__(self, backend: MutableSet, fp_rate: float = 0.01):
+        self.backend: MutableSet = backend
+        self.fp_rate: float = fp_rate
+        self._rebuild()
+
+    def _rebuild(self):
+        size = self.max_count
+        if size is None:
+            size = len(self.backend)
+        self.filter = BloomFilter(max(1024, 2 * size), self.fp_rate)
+        if np is not None and isinstance(self.backend, SlotTable):
+            for keys in self.backend.key_words():
+                self.filter.update_words(keys)
+        else:
+            self.filter.update(self.backend)
+
+    def __contains__(self, uhs_id: bytes) -> bool:
+        return uhs_id in self.filter and uhs_id in self.backend
+
+    def contains_many(self, uhs_ids: Iterable[bytes]) -> List[bool]:
+        """
+        Batch membership test.  Only the filter hits are looked up in the backend
+        """
+        uhs_ids = list(uhs_ids)
+        f = self.filter
+        maybe = [i for i, u in enumerate(uhs_ids) if u in f]
+        results = [False] * len(uhs_ids)
+        candidates = [uhs_ids[i] for i in maybe]
+        contains_many = getattr(self.backend, "contains_many", None)
+        if contains_many is not None:
+            found = contains_many(candidates)
+        else:
+            found = [u in self.backend for u in candidates]
+        for i, hit in zip(maybe, found):
+            results[i] = hit
+        return results
+
+    @property
+    def max_count(self) -> Optional[int]:
+        """
+        How many IDs a fixed-size backend holds, None if it grows
+        """
+        return getattr(self.backend, "max_count", None)
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.backend)
+
+    def __len__(self) -> int:
+        return len(self.backend)
+
+    def add(self, uhs_id: bytes):
+        self.backend.add(uhs_id)
+        self.filter.add(uhs_id)
+        if self.filter.full:
+            self._rebuild()
+
+    def discard(self, uhs_id: bytes):
+        self.backend.discard(uhs_id)
+
+    def update(self, uhs_ids: Iterable[bytes]):
+        uhs_ids = list(uhs_ids)
+        self.backend.update(uhs_ids)
+        self.filter.update(uhs_ids)
+        if self.filter.full:
+            self._rebuild()
+
+    def difference_update(self, uhs_ids: Iterable[bytes]):
+        self.backend.difference_update(uhs_ids)
@@ -0,0 +1,91 @@
+"""
+UHS storage in a memory-mapped file.  The file is a fixed number of 32 byte slots
+after a small header, so it can hold more than fits in RAM (the OS pages it in
+and out) and reopening it is just a 'mmap' call, no reload.
+"""
+import mmap
+import os
+import struct
+
+from cbdc.storage.table import KEY_SIZE, SlotTable
+
+# magic, capacity, count
+HEADER = struct.Struct("=8sQQ")
+HEADER_SIZE = 64
+MAGIC = b"CBDCUHS1"
+# refuse inserts past this load factor. Linear probing degrades quickly above it
+MAX_LOAD = 0.9
+
+
+def capacity_for(count: int) -> int:
+    """
+    Smallest capacity (a power of 2) that holds 'count' IDs under MAX_LOAD
+    """
+    capacity = 1
+    while int(capacity * MAX_LOAD) < count:
+        capacity *= 2
+    return capacity
+
+
+class MmapUhsTable(SlotTable):
+    """
+    Fixed-slot hash table file of UHS IDs.
+    Opens 'path' if it exists, otherwise creates it with 'capacity' slots (a power of 2).
+    The file is created sparse, so unused slots don't take disk space.
+
+    The table never grows: size it for the largest UHS expected, with
+    'capacity_for(count)'.  It holds 'max_count' IDs (capacity * MAX_LOAD) and
+    32 * capacity bytes of file, e.g. 1 << 24 slots is 512MiB and ~15M IDs.
+    Inserting past 'max_count' raises, so UhsController rejects a transaction
+    that would overfill the table before it changes anything
+    """
+
+    def __init__(self, path: str, capacity: int = 1 << 20):
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.truncate(HEADER_SIZE + capacity * KEY_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+        if exists:
+            magic, capacity, _ = HEADER.unpack_from(self._map, 0)
+            assert magic == MAGIC, "not a uhs table file"
+            assert len(self._map) == HEADER_SIZE + capacity * KEY_SIZE, "truncated"
+        else:
+            HEADER.pack_into(self._map, 0, MAGIC, capacity, 0)
+
+        super().__init__(self._map, HEADER_SIZE, capacity)
+        self._count: int = HEADER.unpack_from(self._map, 0)[2]
+        self._limit: int = int(capacity * MAX_LOAD)
+
+    @property
+    def max_count(self) -> int:
+        return self._limit
+
+    def _get_count(self) -> int:
+        return self._count
+
+    def _set_count(self, count: int):
+        self._count = count
+        struct.pack_into("=Q", self._map, 16, count)
+
+    def _before_insert(self) -> bool:
+        assert self._count < self._limit, "uhs table is full"
+        return False
+
+    def flush(self):
+        """
+        Write dirty pages to disk
+        """
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
@@ -0,0 +1,245 @@
+"""
+Open addressing hash table of fixed width (32 byte) UHS IDs over a flat buffer.
+UHS IDs are already sha256 hashes, so the first 8 bytes are used directly as
+the slot hash.  An all zero slot is empty.  Removal uses backward shift
+deletion (no tombstones), so lookups stay short after heavy churn.
+"""
+from collections.abc import MutableSet
+from typing import Iterable, Iterator, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from cbdc.utils.hash import HashSize, ZeroHash
+
+KEY_SIZE = HashSize
+# 'contains_many' probes batches at least this big with numpy
+VECTOR_MIN_BATCH = 64
+
+
+class SlotTable(MutableSet):
+    """
+    Base class for the UHS tables.  Subclasses provide the buffer and keep the count.
+    'capacity' must be a power of 2
+    """
+
+    def __init__(self, buf, offset: int, capacity: int):
+        assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity: power of 2"
+        self._buf = buf
+        self._offset: int = offset
+        self._capacity: int = capacity
+        self._mask: int = capacity - 1
+        # compare a key against a slot in place, without slicing out a copy
+        if hasattr(buf, "startswith"):
+            self._startswith = buf.startswith
+        else:
+            self._startswith = lambda key, start: (
+                buf.find(key, start, start + KEY_SIZE) == start
+            )
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def _get_count(self) -> int:
+        raise NotImplementedError
+
+    def _set_count(self, count: int):
+        raise NotImplementedError
+
+    def _before_insert(self) -> bool:
+        """
+        Called before a new key is inserted. Grow or refuse here.
+        Returns True if the table was resized
+        """
+        return False
+
+    def _find(self, key: bytes):
+        """
+        Returns (slot, found). If not found, 'slot' is the empty slot the key would go in
+        """
+        assert len(key) == KEY_SIZE and key != ZeroHash, "invalid uhs id"
+        startswith = self._startswith
+        offset = self._offset
+        mask = self._mask
+        slot = int.from_bytes(key[:8], "little") & mask
+        while True:
+            start = offset + slot * KEY_SIZE
+            if startswith(key, start):
+                return slot, True
+            if startswith(ZeroHash, start):
+                return slot, False
+            slot = (slot + 1) & mask
+
+    def _write(self, slot: int, key: bytes):
+        start = self._offset + slot * KEY_SIZE
+        self._buf[start : start + KEY_SIZE] = key
+
+    ### set interface ###
+
+    def __contains__(self, key: bytes) -> bool:
+        return self._find(key)[1]
+
+    def __len__(self) -> int:
+        return self._get_count()
+
+    def __iter__(self) -> Iterator[bytes]:
+        buf = self._buf
+        start = self._offset
+        for _ in range(self._capacity):
+            current = bytes(buf[start : start + KEY_SIZE])
+            if current != ZeroHash:
+                yield current
+            start += KEY_SIZE
+
+    def add(self, key: bytes):
+        slot, found = self._find(key)
+        if found:
+            return
+        if self._before_insert():
+            slot, _ = self._find(key)
+        self._write(slot, key)
+        self._set_count(self._get_count() + 1)
+
+    def discard(self, key: bytes):
+        slot, found = self._find(key)
+        if not found:
+            return
+        buf = self._buf
+        offset = self._offset
+        mask = self._mask
+        hole = slot
+        nxt = slot
+        # shift back any entries that probed past the hole
+        while True:
+            nxt = (nxt + 1) & mask
+            start = offset + nxt * KEY_SIZE
+            current = bytes(buf[start : start + KEY_SIZE])
+            if current == ZeroHash:
+                break
+            home = int.from_bytes(current[:8], "little") & mask
+            if hole <= nxt:
+                stays = hole < home <= nxt
+            else:
+                stays = hole < home or home <= nxt
+            if not stays:
+                self._write(hole, current)
+                hole = nxt
+        self._write(hole, ZeroHash)
+        self._set_count(self._get_count() - 1)
+
+    def contains_many(self, keys: Iterable[bytes]) -> List[bool]:
+        """
+        Batch membership test. Same as '[k in table for k in keys]'.
+        Large batches are probed together with numpy: each round reads the first
+        word of every pending key's current slot, checks the full slot only where
+        that word matches the key or is zero (empty), and moves the rest to the
+        next slot.  The last few keys of a long probe chain finish one at a time.
+        About 7x faster than probing one key at a time, but still ~5x slower than
+        a Python 'set' (100k keys against 200k: 46ms against 10ms): the table
+        trades lookup speed for memory
+        """
+        keys = list(keys)
+        if np is None or len(keys) < VECTOR_MIN_BATCH:
+            return self._probe(keys)
+
+        joined = b"".join(keys)
+        assert len(joined) == len(keys) * KEY_SIZE, "invalid uhs id"
+        # keys and slots as 4 little endian words: word 0 is the slot hash
+        probes = np.frombuffer(joined, dtype="<u8").reshape(-1, 4)
+        table = np.frombuffer(
+            self._buf, dtype="<u8", count=self._capacity * 4, offset=self._offset
+        ).reshape(-1, 4)
+        try:
+            first = table[:, 0]
+            mask = np.uint64(self._mask)
+            one = np.uint64(1)
+            found = np.zeros(len(keys), dtype=bool)
+            pending = np.arange(len(keys))
+            hashes = probes[:, 0]
+            slots = hashes & mask
+            while pending.size >= VECTOR_MIN_BATCH:
+                word = first[slots]
+                stop = (word == hashes) | (word == 0)
+                checked = np.flatnonzero(stop)
+                slot_keys = table[slots[checked]]
+                owners = pending[checked]
+                hit = (slot_keys == probes[owners]).all(axis=1)
+                found[owners[hit]] = True
+                # a word match that isn't the key, or a non empty slot: keep going
+                stop[checked[~hit & slot_keys.any(axis=1)]] = False
+                more = ~stop
+                pending = pending[more]
+                hashes = hashes[more]
+                slots = (slots[more] + one) & mask
+        finally:
+            # release the buffer: an mmap can't be closed while it's exported
+            del table
+        results = found.tolist()
+        if pending.size:
+            tail = pending.tolist()
+            for i, hit in zip(
+                tail, self._probe([keys[i] for i in tail], slots.tolist())
+            ):
+                results[i] = hit
+        return results
+
+    def _probe(
+        self, keys: List[bytes], slots: Optional[List[int]] = None
+    ) -> List[bool]:
+        """
+        Probe loop for 'contains_many', one key at a time, from the key's home
+        slot or from 'slots'
+        """
+        startswith = self._startswith
+        offset = self._offset
+        mask = self._mask
+        end = offset + self._capacity * KEY_SIZE
+        from_bytes = int.from_bytes
+        results = []
+        append = results.append
+        for n, key in enumerate(keys):
+            if slots is None:
+                slot = from_bytes(key[:8], "little") & mask
+            else:
+                slot = slots[n]
+            start = offset + slot * KEY_SIZE
+            while True:
+                if startswith(key, start):
+                    append(True)
+                    break
+                if startswith(ZeroHash, start):
+                    append(False)
+                    break
+                start += KEY_SIZE
+                if start == end:
+                    start = offset
+        return results
+
+    def key_words(self, block: int = 1 << 16) -> Iterator:
+        """
+        The keys as numpy arrays of 4 little endian words per key, reading
+        'block' slots at a time (needs numpy).  Bulk reads, e.g. to build a filter
+        """
+        for first in range(0, self._capacity, block):
+            count = min(block, self._capacity - first)
+            slots = np.frombuffer(
+                self._buf,
+                dtype="<u8",
+                count=count * 4,
+                offset=self._offset + first * KEY_SIZE,
+            ).reshape(-1, 4)
+            # a copy: an mmap can't be closed while it's exported
+            keys = slots[slots.any(axis=1)].copy()
+            del slots
+            yield keys
+
+    def update(self, keys: Iterable[bytes]):
+        for k in keys:
+            self.add(k)
+
+    def difference_update(self, keys: Iterable[bytes]):
+        for k in keys:
+            self.discard(k)
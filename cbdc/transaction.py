@@ -1,9 +1,56 @@
 from __future__ import annotations
 
 import struct
-from typing import MutableSequence, Sequence
+from collections import OrderedDict
+from typing import (
+    BinaryIO,
+    Iterator,
+    List,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from cbdc.utils.hash import hash256, new_hasher
+from cbdc.utils.keys import PUBLIC_KEY_SIZE, SIGNATURE_SIZE
+
+# serialized layouts
+LENGTH_PREFIX = struct.Struct("=Q")
+# TxIn = Outpoint (txid, index) + TxOut (witness, value)
+TXIN_LAYOUT = struct.Struct("=32sQ32sd")
+TXOUT_LAYOUT = struct.Struct("=32sd")
+# a TxIn after its txid: outpoint index + TxOut
+OUTPOINT_INDEX_TXOUT_LAYOUT = struct.Struct("=Q32sd")
+# witness = public key + signature
+WITNESS_LAYOUT = struct.Struct("={}s".format(PUBLIC_KEY_SIZE + SIGNATURE_SIZE))
+
+
+class TxidInterner:
+    """
+    Shares one copy of each txid, so the Outpoints referencing the same
+    transaction hold one bytes object instead of one each.
+    Keeps at most 'max_size' txids, dropping the oldest ('bytes' can't be
+    weakly referenced).  Give each reader its own, so nothing holds txids
+    for longer than the objects using them
+    """
+
+    def __init__(self, max_size: int = 1 << 14):
+        assert max_size > 0, "max size must be positive"
+        self.max_size: int = max_size
+        self._txids: OrderedDict[bytes, bytes] = OrderedDict()
+
+    def __call__(self, txid: bytes) -> bytes:
+        shared = self._txids.get(txid)
+        if shared is not None:
+            return shared
+        if len(self._txids) >= self.max_size:
+            self._txids.popitem(last=False)
+        self._txids[txid] = txid
+        return txid
 
-from cbdc.utils.hash import hash256
+    def __len__(self) -> int:
+        return len(self._txids)
 
 
 def hash_tx_input(txin: TxIn) -> bytes:
@@ -13,6 +60,49 @@ def hash_tx_input(txin: TxIn) -> bytes:
     return hash256(txin.serialize())
 
 
+def hash_tx_inputs(txins: Sequence[TxIn]) -> List[bytes]:
+    """
+    Bulk version of 'hash_tx_input'. Packs all the TxIns into one preallocated
+    buffer and hashes them in place
+    """
+    size = TXIN_LAYOUT.size
+    buf = bytearray(size * len(txins))
+    view = memoryview(buf)
+    pack_into = TXIN_LAYOUT.pack_into
+    hashes = []
+    offset = 0
+    for i in txins:
+        point = i.prev_outpoint
+        out = i.prev_output_data
+        pack_into(buf, offset, point.txid, point.index, out.witness, out.value)
+        hashes.append(hash256(view[offset : offset + size]))
+        offset += size
+    return hashes
+
+
+def uhs_ids_from_outputs(txid: bytes, outputs: Sequence[TxOut]) -> List[bytes]:
+    """
+    Bulk version of 'uhs_id_from_output' for all the outputs of a transaction.
+    The txid prefix is hashed once, then each output continues from a copy of
+    that hash state (the midstate)
+    """
+    size = OUTPOINT_INDEX_TXOUT_LAYOUT.size
+    buf = bytearray(size * len(outputs))
+    view = memoryview(buf)
+    pack_into = OUTPOINT_INDEX_TXOUT_LAYOUT.pack_into
+    midstate = new_hasher()
+    midstate.update(txid)
+    hashes = []
+    offset = 0
+    for idx, o in enumerate(outputs):
+        pack_into(buf, offset, idx, o.witness, o.value)
+        sha = midstate.copy()
+        sha.update(view[offset : offset + size])
+        hashes.append(sha.digest())
+        offset += size
+    return hashes
+
+
 def uhs_id_from_output(txid: bytes, idx: int, output: TxOut) -> bytes:
     """
     Generate a UHS_ID given:
@@ -27,16 +117,36 @@ def uhs_id_from_output(txid: bytes, idx: int, output: TxOut) -> bytes:
     return hash_tx_input(txin)
 
 
-class Outpoint:
+class _Frozen:
+    """
+    Base of the immutable transaction parts: they're part of a tx_id and used as
+    dict keys.  Attributes are set once, in __init__, with the slot setters
+    """
+
+    __slots__ = ()
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
+
+    def __delattr__(self, name: str):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
+
+
+class Outpoint(_Frozen):
     """
     Provides a reference to the transaction id and the index
     number of the output that created it...
     """
 
+    __slots__ = ("index", "txid")
+
     def __init__(self, index: int, txid: bytes):
         assert len(txid) == 32, "txid should be a 32 byte hash"
-        self.index: int = index
-        self.txid: bytes = txid
+        _set_outpoint_index(self, index)
+        _set_outpoint_txid(self, txid)
+
+    def __reduce__(self):
+        return Outpoint, (self.index, self.txid)
 
     def serialize(self) -> bytes:
         return struct.pack("=32sQ", self.txid, self.index)
@@ -47,14 +157,21 @@ class Outpoint:
         return Outpoint(idx, txid)
 
     def __eq__(self, other: Outpoint) -> bool:
+        if not isinstance(other, Outpoint):
+            return NotImplemented
         return self.txid == other.txid and self.index == other.index
 
+    def __hash__(self) -> int:
+        return hash((self.txid, self.index))
+
 
-class TxOut:
+class TxOut(_Frozen):
     """
     Money you're spending
     """
 
+    __slots__ = ("value", "witness")
+
     def __init__(self, value: float, witness: bytes):
         """
         note: using float here for value to experiment with 'change'.
@@ -62,9 +179,12 @@ class TxOut:
         """
         assert len(witness) == 32, "witness should be a 32 byte hash"
         # value to spend
-        self.value: float = value
+        _set_txout_value(self, value)
         # hash(public key)
-        self.witness: bytes = witness
+        _set_txout_witness(self, witness)
+
+    def __reduce__(self):
+        return TxOut, (self.value, self.witness)
 
     def serialize(self) -> bytes:
         return struct.pack("=32sd", self.witness, self.value)
@@ -75,17 +195,27 @@ class TxOut:
         return TxOut(value, wit)
 
     def __eq__(self, other: TxOut) -> bool:
+        if not isinstance(other, TxOut):
+            return NotImplemented
         return self.value == other.value and self.witness == other.witness
 
+    def __hash__(self) -> int:
+        return hash((self.witness, self.value))
+
 
-class TxIn:
+class TxIn(_Frozen):
     """
     Money in your wallet
     """
 
+    __slots__ = ("prev_outpoint", "prev_output_data")
+
     def __init__(self, outpoint: Outpoint, output: TxOut):
-        self.prev_outpoint: Outpoint = outpoint
-        self.prev_output_data: TxOut = output
+        _set_txin_outpoint(self, outpoint)
+        _set_txin_output(self, output)
+
+    def __reduce__(self):
+        return TxIn, (self.prev_outpoint, self.prev_output_data)
 
     def serialize(self) -> bytes:
         # Should be 80 bytes
@@ -100,98 +230,119 @@ class TxIn:
         return TxIn(point, output)
 
     def __eq__(self, other: TxIn) -> bool:
+        if not isinstance(other, TxIn):
+            return NotImplemented
         return (
             self.prev_outpoint == other.prev_outpoint
             and self.prev_output_data == other.prev_output_data
         )
 
+    def __hash__(self) -> int:
+        return hash((self.prev_outpoint, self.prev_output_data))
+
+
+# slot setters, for the __init__ of the immutable parts
+_set_outpoint_index = Outpoint.index.__set__
+_set_outpoint_txid = Outpoint.txid.__set__
+_set_txout_value = TxOut.value.__set__
+_set_txout_witness = TxOut.witness.__set__
+_set_txin_outpoint = TxIn.prev_outpoint.__set__
+_set_txin_output = TxIn.prev_output_data.__set__
+
 
 class Transaction:
     """
-    Full transaction
+    Full transaction.
+
+    Once all the inputs and outputs are added, 'seal' the transaction to freeze them
+    (as tuples) and cache the tx_id.  Witnesses can still be added after sealing
+    (they're not part of the tx_id).  Outpoints, TxIns and TxOuts are immutable, and
+    the inputs and outputs of a sealed transaction can't be replaced, so the cached
+    tx_id always matches them.
     """
 
+    __slots__ = ("inputs", "outputs", "witnesses", "_tx_id")
+
     def __init__(self):
         self.inputs: MutableSequence[TxIn] = []
         self.outputs: MutableSequence[TxOut] = []
         self.witnesses: MutableSequence[bytes] = []
+        # cached tx_id, only set on a sealed transaction
+        self._tx_id: Optional[bytes] = None
 
-    def tx_id(self) -> bytes:
-        data = b""
-        # Prefix the length of each list
-        input_bytes = struct.pack("=Q", len(self.inputs))
-        output_bytes = struct.pack("=Q", len(self.outputs))
-        data += input_bytes
-        for i in self.inputs:
-            data += i.serialize()
+    def __setattr__(self, name: str, value):
+        if name != "witnesses" and getattr(self, "_tx_id", None) is not None:
+            raise AttributeError("can't change a sealed transaction")
+        object.__setattr__(self, name, value)
 
-        data += output_bytes
-        for i in self.outputs:
-            data += i.serialize()
+    def tx_id(self) -> bytes:
+        """
+        Hash of the inputs and outputs, each list prefixed with its length.
+        Fields are hashed as they're packed, no intermediate byte string
+        """
+        if self._tx_id is not None:
+            return self._tx_id
 
-        return hash256(data)
+        sha = new_hasher()
+        sha.update(LENGTH_PREFIX.pack(len(self.inputs)))
+        pack = TXIN_LAYOUT.pack
+        for i in self.inputs:
+            point = i.prev_outpoint
+            out = i.prev_output_data
+            sha.update(pack(point.txid, point.index, out.witness, out.value))
 
-    def serialize(self) -> bytes:
-        data = b""
-        input_bytes = struct.pack("=Q", len(self.inputs))
-        output_bytes = struct.pack("=Q", len(self.outputs))
-        wit_bytes = struct.pack("=Q", len(self.witnesses))
+        sha.update(LENGTH_PREFIX.pack(len(self.outputs)))
+        pack = TXOUT_LAYOUT.pack
+        for o in self.outputs:
+            sha.update(pack(o.witness, o.value))
 
-        data += input_bytes
-        for i in self.inputs:
-            data += i.serialize()
+        return sha.digest()
 
-        data += output_bytes
-        for i in self.outputs:
-            data += i.serialize()
+    def seal(self) -> Transaction:
+        """
+        Freeze the inputs and outputs (as tuples) and cache the tx_id.
+        Returns the transaction (a no-op if it's already sealed)
+        """
+        if self._tx_id is not None:
+            return self
+        self.inputs = tuple(self.inputs)
+        self.outputs = tuple(self.outputs)
+        self._tx_id = self.tx_id()
+        return self
 
-        data += wit_bytes
-        for i in self.witnesses:
-            data += i
+    @property
+    def sealed(self) -> bool:
+        return self._tx_id is not None
 
-        return data
+    def serialize(self) -> bytes:
+        data = [LENGTH_PREFIX.pack(len(self.inputs))]
+        data.extend(i.serialize() for i in self.inputs)
+        data.append(LENGTH_PREFIX.pack(len(self.outputs)))
+        data.extend(o.serialize() for o in self.outputs)
+        data.append(LENGTH_PREFIX.pack(len(self.witnesses)))
+        data.extend(self.witnesses)
+        return b"".join(data)
 
     def deserialize(raw: bytes) -> Transaction:
         """
-        TODO: the plot thickens...
-
-        tx = Transaction()
-
-        # serialized size = 80
-        (input_len,) = struct.unpack("=Q", raw[:8])
-        in_raw = raw[8 : input_len * 80 + 8]
-        for i in range(input_len):
-            start = i * 80
-            end = start + 80
-            bits = in_raw[start:end]
-            tin = TxIn.deserialize(bits)
-            tx.inputs.append(tin)
-
-        # serialized size = 40
-        (output_len,) = struct.unpack("=Q", raw[(input_len + 8) : (input_len + 16)])
-        outraw = raw[(input_len + 16) : (input_len + 16) + (output_len * 40)]
-        for i in range(output_len):
-            start = i * 40
-            end = start + 40
-            bits = outraw[start:end]
-            too = TxOut.deserialize(bits)
-            tx.outputs.append(too)
-
-        # serialized size = 96
-        wit_len = struct.unpack(
-            "=Q", raw[(input_len + output_len + 16) : input_len + output_len + 24]
-        )
-        wit_raw = raw[(input_len + output_len + 24) :]
-        for i in range(wit_len):
-            start = i * 96
-            end = start + 96
-            bits = wit_raw[start:end]
-            tx.witnesses.append(bits)
+        Decode a serialized transaction.
+        Throws an exception if 'raw' is truncated or has trailing bytes
         """
-        pass
+        view = memoryview(raw)
+        decoded = decode_transaction(view, 0)
+        assert decoded is not None, "truncated transaction"
+        tx, end = decoded
+        assert end == len(view), "wrong number of bytes"
+        return tx
 
     def __eq__(self, other: Transaction) -> bool:
-        return self.tx_id == other.tx_id
+        if not isinstance(other, Transaction):
+            return NotImplemented
+        return self.tx_id() == other.tx_id()
+
+    def __hash__(self) -> int:
+        # only seal()ed transactions should be used as keys
+        return hash(self.tx_id())
 
 
 class CompactTx:
@@ -199,6 +350,8 @@ class CompactTx:
     Format of the transaction once validated by the sentinel. Used to update the UHS
     """
 
+    __slots__ = ("tx_id", "spends", "creates")
+
     def __init__(self):
         self.tx_id: bytes = None
         self.spends: MutableSequence[bytes] = []
@@ -211,13 +364,22 @@ class CompactTx:
         """
         ctx = CompactTx()
         ctx.tx_id = tx.tx_id()
-        for i in tx.inputs:
-            ctx.spends.append(hash_tx_input(i))
-        for idx, o in enumerate(tx.outputs):
-            hashed = uhs_id_from_output(ctx.tx_id, idx, o)
-            ctx.creates.append(hashed)
+        ctx.spends = hash_tx_inputs(tx.inputs)
+        ctx.creates = uhs_ids_from_outputs(ctx.tx_id, tx.outputs)
         return ctx
 
+    def __eq__(self, other: CompactTx) -> bool:
+        if not isinstance(other, CompactTx):
+            return NotImplemented
+        return (
+            self.tx_id == other.tx_id
+            and self.spends == other.spends
+            and self.creates == other.creates
+        )
+
+    def __hash__(self) -> int:
+        return hash(self.tx_id)
+
     def display(self):
         print("\n[ txid: {} ]".format(self.tx_id.hex()))
         print(" spending:")
@@ -227,3 +389,93 @@ class CompactTx:
         print(" creating:")
         for i in self.creates:
             print("  -> {}".format(i.hex()))
+
+
+def decode_transaction(
+    view: memoryview, offset: int, intern: Optional[TxidInterner] = None
+) -> Optional[Tuple[Transaction, int]]:
+    """
+    Decode the transaction starting at 'offset' in 'view' without copying the buffer.
+    Returns (transaction, offset of the next byte) or None if 'view' ends before
+    the transaction does.
+    With 'intern', the txids of the inputs are shared through it (see 'TxidInterner')
+    """
+    size = len(view)
+    tx = Transaction()
+
+    # inputs
+    if offset + LENGTH_PREFIX.size > size:
+        return None
+    (count,) = LENGTH_PREFIX.unpack_from(view, offset)
+    offset += LENGTH_PREFIX.size
+    end = offset + count * TXIN_LAYOUT.size
+    if end > size:
+        return None
+    tx.inputs = [
+        TxIn(
+            Outpoint(index, txid if intern is None else intern(txid)),
+            TxOut(value, witness),
+        )
+        for txid, index, witness, value in TXIN_LAYOUT.iter_unpack(view[offset:end])
+    ]
+    offset = end
+
+    # outputs
+    if offset + LENGTH_PREFIX.size > size:
+        return None
+    (count,) = LENGTH_PREFIX.unpack_from(view, offset)
+    offset += LENGTH_PREFIX.size
+    end = offset + count * TXOUT_LAYOUT.size
+    if end > size:
+        return None
+    tx.outputs = [
+        TxOut(value, witness)
+        for witness, value in TXOUT_LAYOUT.iter_unpack(view[offset:end])
+    ]
+    offset = end
+
+    # witnesses
+    if offset + LENGTH_PREFIX.size > size:
+        return None
+    (count,) = LENGTH_PREFIX.unpack_from(view, offset)
+    offset += LENGTH_PREFIX.size
+    end = offset + count * WITNESS_LAYOUT.size
+    if end > size:
+        return None
+    tx.witnesses = [w for (w,) in WITNESS_LAYOUT.iter_unpack(view[offset:end])]
+
+    return tx.seal(), end
+
+
+def iter_transactions(
+    stream: BinaryIO, chunk_size: int = 1 << 20, intern: bool = False
+) -> Iterator[Transaction]:
+    """
+    Yield the transactions from a stream of concatenated serialized transactions,
+    e.g. a file opened with 'rb' or 'socket.makefile("rb")'.
+    Throws an exception if the stream ends in the middle of a transaction.
+    With 'intern', input txids are shared between the transactions decoded
+    from this stream (see 'TxidInterner')
+    """
+    interner = TxidInterner() if intern else None
+    # read1 returns what's available instead of blocking for a full chunk
+    read = getattr(stream, "read1", stream.read)
+    buf = b""
+    while True:
+        chunk = read(chunk_size)
+        if chunk:
+            buf += chunk
+        view = memoryview(buf)
+        offset = 0
+        while True:
+            decoded = decode_transaction(view, offset, interner)
+            if decoded is None:
+                break
+            tx, offset = decoded
+            yield tx
+        view.release()
+        # keep the partial transaction at the end for the next chunk
+        buf = buf[offset:]
+        if not chunk:
+            assert not buf, "truncated transaction stream"
+            return
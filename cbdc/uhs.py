@@ -1,8 +1,26 @@
-from typing import MutableSet
+import threading
+from contextlib import nullcontext
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, List, MutableSet, Optional, Sequence, Union
 
+from nacl.exceptions import BadSignatureError
+
+from cbdc.utils.digest import MASK, MultisetDigest
 from cbdc.utils.hash import hash256
 from cbdc.utils.keys import verify_signature
-from cbdc.transaction import CompactTx, Transaction, TxIn, hash_tx_input
+from cbdc.transaction import (
+    CompactTx,
+    Transaction,
+    TxIn,
+    hash_tx_input,
+    hash_tx_inputs,
+)
+from cbdc.shard import ShardedUhs
+from cbdc.metrics import NullMetrics
+from cbdc.cache import DuplicateFilter, SignatureCache
+from cbdc.wal import WriteAheadLog
+from cbdc.locks import LockTable, SharedLock
 
 
 class UhsController:
@@ -14,51 +32,394 @@ class UhsController:
     These are condensed down (removes all the hard distributed computing)
     to the minimal logic for experimentation and demo purposes.
     Storage is a simple set of the hashed spendable outputs (via CompactTx)
+    by default.  Pass a 'ShardedUhs' as 'uhs' to split storage across locking shards
+    updated with two-phase commit, or a table from 'cbdc.storage': the memory-mapped
+    'MmapUhsTable' for sets larger than RAM, or 'CompactUhsSet' for ~32 bytes per entry.
+    Wrap a backend in 'FilteredUhs' to answer lookups of absent IDs from a Bloom
+    filter (see 'check_unspent_many').
+
+    Batch validation is spread across 'executor' (a thread or process pool).
+    If none is given, a thread pool is created on first use.
+
+    Pass 'metrics' (cbdc.metrics.Metrics) to record per-stage counters and latencies.
+
+    With 'sig_cache_size', signatures that verified are remembered so a resubmitted
+    transaction isn't verified again.  With 'duplicate_window' (seconds), a
+    transaction applied in the last window is rejected before any validation
+    (see cbdc.cache).  Both are off by default.
+
+    With a 'wal' (cbdc.wal.WriteAheadLog), the UHS is recovered from it on startup
+    and every applied transaction is logged, in the order it was applied.
+    'execute_transaction', 'execute_batch' and 'execute_concurrent' return once their
+    transactions are durable (a batch shares its fsyncs).  'process', 'mint' and
+    'execute_locked' only log: call 'wal.wait(wal.appended)' before acknowledging.
+    Call 'snapshot' now and then to keep recovery short.
+
+    'execute_locked' and 'execute_concurrent' are the locking-shard mode: a lock table
+    on UHS IDs lets transactions with disjoint spends be validated and applied in
+    parallel threads (signature checks release the GIL).
     """
 
-    def __init__(self):
-        self.uhs: MutableSet[bytes] = set()
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        uhs: Optional[MutableSet[bytes]] = None,
+        metrics: Optional[NullMetrics] = None,
+        sig_cache_size: int = 0,
+        duplicate_window: float = 0.0,
+        wal: Optional[WriteAheadLog] = None,
+    ):
+        self.uhs: MutableSet[bytes] = set() if uhs is None else uhs
+        self.wal: Optional[WriteAheadLog] = wal
+        if wal is not None:
+            wal.recover(self.uhs)
+        self.executor: Optional[Executor] = executor
+        self.metrics: NullMetrics = NullMetrics() if metrics is None else metrics
+        # known-good signatures, and txids applied recently
+        self.sig_cache: Optional[SignatureCache] = None
+        if sig_cache_size:
+            self.sig_cache = SignatureCache(sig_cache_size, self.metrics)
+        self.recent: Optional[DuplicateFilter] = None
+        if duplicate_window:
+            self.recent = DuplicateFilter(duplicate_window, self.metrics)
+        # spends locked by in-flight transactions (locking-shard mode)
+        self.locks: LockTable = LockTable()
+        # serializes the check-and-apply on the storage
+        self._store_lock = threading.Lock()
+        # a ShardedUhs applies in parallel: shared by the two-phase commits
+        # (with a write-ahead log), exclusive for 'snapshot'
+        self._shard_gate = SharedLock()
+        # used by 'execute_concurrent' if 'executor' isn't a thread pool
+        self._threads: Optional[ThreadPoolExecutor] = None
+        # rolling digest of the UHS IDs (a ShardedUhs keeps its own). Computed on
+        # first use, so opening a large existing UHS doesn't read all of it
+        self._digest: Optional[MultisetDigest] = None
 
     def execute_transaction(self, tx: Transaction, maybe_display=False) -> Transaction:
         # happens on the sentinel
         self.validate(tx)
-        self.process(tx, maybe_display)
+        # apply outside the assert: it must run under 'python -O' too
+        applied = self.process(tx, maybe_display)
+        assert applied, "uhs: inputs are spent or locked"
+        self._wait_durable()
         return tx
 
     def validate(self, tx: Transaction) -> bool:
-        check_structure(tx)
-        check_inputs_outputs(tx)
-        check_witness_and_signature(tx)
+        m = self.metrics
+        assert not self.is_duplicate(tx.tx_id()), "validation: duplicate transaction"
+        m.run("check_structure", check_structure, tx)
+        m.run("check_inputs_outputs", check_inputs_outputs, tx)
+        m.run(
+            "check_witness_and_signature",
+            check_witness_and_signature,
+            tx,
+            self.sig_cache,
+        )
         return True
 
-    def mint(self, tx: Transaction):
+    def is_duplicate(self, txid: bytes) -> bool:
+        """
+        Was this transaction applied in the last 'duplicate_window' seconds?
+        """
+        return self.recent is not None and self.recent.seen(txid)
+
+    def _applied(self, cmptx: CompactTx):
+        """
+        Called with the store lock held when there's a write-ahead log, so the
+        log has the same order as the updates.  For a ShardedUhs it's called
+        between the prepare and commit phases instead: a transaction spending
+        the creates is logged after this one
+        """
+        if self.recent is not None:
+            self.recent.add(cmptx.tx_id)
+        if self.wal is not None:
+            self.wal.append(cmptx)
+
+    def _wait_durable(self):
+        if self.wal is not None:
+            self.wal.wait(self.wal.appended)
+
+    def _shard_apply(self, cmptx: CompactTx) -> bool:
+        """
+        Two-phase commit on the ShardedUhs.  The shards lock the spends, so
+        transactions are applied in parallel.  They are logged once prepared,
+        under the shared gate that keeps 'snapshot' out
+        """
+        with self._shard_gate.shared() if self.wal is not None else nullcontext():
+            return self.metrics.run("shard_apply", self.uhs.apply, cmptx, self._applied)
+
+    @property
+    def store_lock(self) -> threading.Lock:
+        """
+        Held while the UHS is checked and updated.  Share it with anything else
+        updating 'uhs', e.g. a BatchCoordinator
+        """
+        return self._store_lock
+
+    def snapshot(self):
+        """
+        Snapshot the UHS to the write-ahead log (see 'WriteAheadLog.snapshot').
+        Holds the store lock: transactions are applied before or after it
+        """
+        assert self.wal is not None, "no write-ahead log"
+        with self._store_lock, self._shard_gate.exclusive():
+            self.wal.snapshot(self.uhs)
+
+    def validate_batch(
+        self, txs: Iterable[Transaction], prefilter: bool = False
+    ) -> List[bool]:
+        """
+        Validate many transactions in parallel on the executor.
+        Returns accept (True) / reject (False) for each transaction, in input order.
+        A bad transaction only rejects itself, not the batch.
+
+        With 'prefilter', the structure and balance checks first run over the whole
+        batch at once (vectorized with numpy, see cbdc.batch), so malformed or
+        unbalanced transactions are rejected before any signature is checked
+        """
+        txs = list(txs)
+        if not txs:
+            return []
+        results = [True] * len(txs)
+        if prefilter:
+            # numpy is only needed for this mode
+            from cbdc.batch import TxBatch
+
+            mask = self.metrics.run(
+                "prefilter", lambda: TxBatch.from_transactions(txs).valid_mask()
+            )
+            results = mask.tolist()
+        todo = [idx for idx, ok in enumerate(results) if ok]
+        if self.recent is not None:
+            todo = [idx for idx in todo if not self.is_duplicate(txs[idx].tx_id())]
+            results = [False] * len(txs)
+            for idx in todo:
+                results[idx] = True
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor()
+        check = validate_transaction
+        if self.sig_cache is not None and isinstance(self.executor, ThreadPoolExecutor):
+            # the cache can't be shared with other processes
+            check = partial(validate_transaction, cache=self.sig_cache)
+        # larger chunks amortize the pickling cost when using a process pool
+        workers = getattr(self.executor, "_max_workers", 1)
+        chunksize = max(1, len(todo) // (workers * 4))
+        checked = self.metrics.run(
+            "validate_batch",
+            lambda: list(
+                self.executor.map(check, [txs[i] for i in todo], chunksize=chunksize)
+            ),
+        )
+        for idx, ok in zip(todo, checked):
+            results[idx] = ok
+        return results
+
+    def execute_batch(
+        self, txs: Iterable[Transaction], maybe_display=False
+    ) -> List[bool]:
+        """
+        Validate the batch in parallel, then apply the accepted transactions
+        to the UHS in input order.  Spends are claimed in input order: a transaction
+        spending something missing from the UHS, or already spent by an earlier
+        transaction in the batch, is rejected.
+        Returns accept (True) / reject (False) for each transaction, in input order.
+        """
+        txs = list(txs)
+        results = self.validate_batch(txs)
+        for idx, tx in enumerate(txs):
+            if results[idx]:
+                results[idx] = self.process(tx, maybe_display)
+        self._wait_durable()
+        return results
+
+    def execute_locked(self, tx: Transaction) -> bool:
+        """
+        Thread safe execution.  Locks the spends, validates, checks the spends are in
+        the UHS, applies the creates and releases the locks.
+        Returns False if the transaction is invalid, or a spend is missing or locked
+        by another transaction in flight
+        """
+        return self._execute_locked(tx, True)
+
+    def _execute_locked(self, tx: Transaction, validate: bool) -> bool:
+        m = self.metrics
+        cmptx = m.run("compact_tx_create", CompactTx.create, tx)
+        if self.is_duplicate(cmptx.tx_id):
+            return False
+        spends = cmptx.spends
+        if len(set(spends)) != len(spends) or not self.locks.try_lock(spends):
+            m.count("lock_conflicts")
+            return False
+        try:
+            if validate and not validate_transaction(tx, self.sig_cache):
+                return False
+            if isinstance(self.uhs, ShardedUhs):
+                return self._shard_apply(cmptx)
+            with self._store_lock:
+                if not all(s in self.uhs for s in spends):
+                    return False
+                if not self._has_room(spends, cmptx.creates):
+                    return False
+                self._apply(spends, cmptx.creates)
+                self._applied(cmptx)
+            return True
+        finally:
+            self.locks.release(spends)
+
+    def execute_concurrent(self, txs: Iterable[Transaction]) -> List[bool]:
+        """
+        Execute many transactions on a thread pool in locking-shard mode.
+        The transactions are validated in parallel first.  Double spends among the
+        valid ones are then resolved deterministically: spends are claimed in input
+        order, and a transaction spending something claimed by an earlier valid one
+        is rejected (an invalid transaction claims nothing, as in 'execute_batch').
+        The rest are applied in parallel, locking their spends.
+        Returns accept (True) / reject (False) for each transaction, in input order.
+        """
+        txs = list(txs)
+        # needs threads: the workers share this controller
+        if isinstance(self.executor, ThreadPoolExecutor):
+            threads = self.executor
+        else:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor()
+            threads = self._threads
+
+        check = partial(validate_transaction, cache=self.sig_cache)
+        valid = self.metrics.run(
+            "validate_batch", lambda: list(threads.map(check, txs))
+        )
+
+        claimed: MutableSet[bytes] = set()
+        runnable = []
+        for tx, ok in zip(txs, valid):
+            spends = set(hash_tx_inputs(tx.inputs)) if ok else set()
+            runnable.append(ok and claimed.isdisjoint(spends))
+            claimed |= spends
+
+        futures = [
+            threads.submit(self._execute_locked, tx, False) if ok else None
+            for tx, ok in zip(txs, runnable)
+        ]
+        results = [f.result() if f is not None else False for f in futures]
+        self._wait_durable()
+        return results
+
+    def mint(self, tx: Transaction, maybe_display=True):
         """
         Special method just for demo. Bypasses validation to bootstrap the bank
         """
-        print("\n *** MINT ***")
-        self.process(tx, True)
+        self.process(tx, maybe_display, "MINT")
         return tx
 
-    def process(self, tx: Transaction, maybe_display: bool) -> bool:
+    def process(self, tx: Transaction, maybe_display: bool, title: str = "") -> bool:
+        """
+        Apply a (validated) transaction to the UHS.
+        Returns False, and changes nothing, if a spend is missing from the UHS
+        (never created, or already spent) or spent twice in the transaction, or
+        if a fixed-size UHS table has no room for the creates.
+        With a write-ahead log the transaction is logged, but this doesn't wait
+        for it to be durable
+        """
+        m = self.metrics
         # note: this is actually done on the sentinel
-        cmptx = CompactTx.create(tx)
+        cmptx = m.run("compact_tx_create", CompactTx.create, tx)
         if maybe_display:
-            cmptx.display()
+            m.display(cmptx, title)
+
+        if isinstance(self.uhs, ShardedUhs):
+            # two-phase commit across the locking shards. Rejects missing or locked spends
+            applied = self._shard_apply(cmptx)
+            if not applied:
+                m.count("shard_apply.rejected")
+            return applied
 
         #
         # Simplified version of what happens in each shard.
-        # A shard uses an additional set (not used here) to 'lock' on the inputs
-        # until the transaction has completed.  The locks are cleared after the 'creates' below
+        # A shard uses an additional set (see ShardedUhs) to 'lock' on the inputs
+        # until the transaction has completed.  Here the store lock covers the
+        # check of the spends and the 'creates' below
         #
 
+        spends = cmptx.spends
+        with self._store_lock:
+            if len(set(spends)) != len(spends) or not all(
+                s in self.uhs for s in spends
+            ):
+                m.count("apply.rejected")
+                return False
+            if not self._has_room(spends, cmptx.creates):
+                return False
+            self._apply(spends, cmptx.creates)
+            self._applied(cmptx)
+        return True
+
+    def _has_room(self, spends: Sequence[bytes], creates: Sequence[bytes]) -> bool:
+        """
+        Will a fixed-size backend (MmapUhsTable) still fit the UHS once the spends
+        are removed and the creates added?  Checked before changing anything, so a
+        full table rejects the transaction instead of applying part of it.
+        Call with the store lock held and the spends known to be in the UHS
+        """
+        limit = getattr(self.uhs, "max_count", None)
+        if limit is None:
+            return True
+        uhs = self.uhs
+        new = sum(1 for c in set(creates) if c not in uhs)
+        if len(uhs) - len(spends) + new <= limit:
+            return True
+        self.metrics.count("apply.uhs_full")
+        return False
+
+    def _apply(self, spends: Sequence[bytes], creates: Sequence[bytes]):
+        m = self.metrics
+        uhs = self.uhs
+        digest = self._digest
+        if digest is None:
+            # not computed yet: nothing to keep up to date
+            m.run("apply_spends", uhs.difference_update, spends)
+            m.run("apply_creates", uhs.update, creates)
+            return
+
+        # the digest only changes for IDs that actually leave or join the uhs
+        from_bytes = int.from_bytes
+        delta = 0
+        for s in set(spends):
+            if s in uhs:
+                delta -= from_bytes(s, "big")
+
         # remove what we're spending from the uhs
-        for s in cmptx.spends:
-            if s in self.uhs:
-                self.uhs.remove(s)
+        m.run("apply_spends", uhs.difference_update, spends)
+
+        for c in set(creates):
+            if c not in uhs:
+                delta += from_bytes(c, "big")
 
         # add all the new ouputs created as the result of the transaction
-        for c in cmptx.creates:
-            self.uhs.add(c)
+        m.run("apply_creates", uhs.update, creates)
+        digest.value = (digest.value + delta) & MASK
+
+    @property
+    def digest(self) -> MultisetDigest:
+        """
+        Rolling digest of the UHS IDs.  The first use reads the whole UHS, after
+        that it's updated as transactions are applied
+        """
+        if self._digest is None:
+            with self._store_lock:
+                if self._digest is None:
+                    self._digest = MultisetDigest(self.uhs)
+        return self._digest
+
+    def state_digest(self) -> bytes:
+        """
+        Digest of all the UHS IDs, updated as transactions are applied
+        (see cbdc.utils.digest).  Two UHSs with the same IDs have the same digest
+        """
+        if isinstance(self.uhs, ShardedUhs):
+            return self.uhs.state_digest()
+        return self.digest.digest()
 
     def check_unspent(self, spendable: TxIn) -> bool:
         """
@@ -67,10 +428,58 @@ class UhsController:
         hashed = hash_tx_input(spendable)
         return hashed in self.uhs
 
+    def check_unspent_many(self, spendables: Sequence[Union[TxIn, bytes]]) -> bytearray:
+        """
+        Bulk 'check_unspent' for 'TxIn's and/or UHS IDs, in one pass over the UHS.
+        Returns a bitmap: bit 'i' (byte i // 8, bit i % 8) is set if spendables[i]
+        is unspent (see 'is_set')
+        """
+        ids = list(spendables)
+        txins = [i for i, s in enumerate(ids) if not isinstance(s, bytes)]
+        if txins:
+            hashed = hash_tx_inputs([ids[i] for i in txins])
+            for i, uhs_id in zip(txins, hashed):
+                ids[i] = uhs_id
+
+        contains_many = getattr(self.uhs, "contains_many", None)
+        if contains_many is not None:
+            found = contains_many(ids)
+        else:
+            found = map(self.uhs.__contains__, ids)
+
+        bitmap = bytearray((len(ids) + 7) // 8)
+        for i, hit in enumerate(found):
+            if hit:
+                bitmap[i >> 3] |= 1 << (i & 7)
+        return bitmap
+
+
+def is_set(bitmap: bytearray, i: int) -> bool:
+    """
+    Bit 'i' of a bitmap from 'check_unspent_many'
+    """
+    return bool(bitmap[i >> 3] & (1 << (i & 7)))
+
 
 ### Validation Helpers ###
 
 
+def validate_transaction(
+    tx: Transaction, cache: Optional[SignatureCache] = None
+) -> bool:
+    """
+    Run all the validation checks on a transaction.
+    Returns False instead of raising, so it can be used with an executor (thread or process)
+    """
+    try:
+        check_structure(tx)
+        check_inputs_outputs(tx)
+        check_witness_and_signature(tx, cache)
+    except (AssertionError, BadSignatureError, ValueError):
+        return False
+    return True
+
+
 def check_structure(tx: Transaction):
     assert len(tx.inputs) > 0, "validation: missing inputs"
     assert len(tx.outputs) > 0, "validation: missing outputs"
@@ -89,7 +498,9 @@ def check_inputs_outputs(tx: Transaction):
     assert in_value == out_value, "validation: input and output values don't match"
 
 
-def check_witness_and_signature(tx: Transaction):
+def check_witness_and_signature(
+    tx: Transaction, cache: Optional[SignatureCache] = None
+):
     txid = tx.tx_id()
     for idx, full_committment in enumerate(tx.witnesses):
         # get the pubkey (first 32 bytes)
@@ -103,5 +514,9 @@ def check_witness_and_signature(tx: Transaction):
             wit_hash == tx.inputs[idx].prev_output_data.witness
         ), "witness committments don't match!"
 
-        # check the signature
+        # check the signature, unless it's known to be good
+        if cache is not None and cache.verified(txid, pk, sig):
+            continue
         assert verify_signature(txid, sig, pk), "bad signature!"
+        if cache is not None:
+            cache.add(txid, pk, sig)
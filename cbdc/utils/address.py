@@ -2,13 +2,22 @@
 Encode and decode a wallet address. Separated to swap different approaches.
 
 Default implementation is Bech32. The same one used by opencdbc
+
+The pure Python codec is slow, so results are kept in a bounded LRU cache:
+payments tend to go to the same counterparties again and again.
 """
+from functools import lru_cache
+from typing import Iterable, List
+
 import bech32
 
 
 BECH_32_HRP = "usd"
+# addresses (and public keys) remembered by each cache
+ADDRESS_CACHE_SIZE = 4096
 
 
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
 def encode_address(public_key: bytes) -> str:
     """
     Create a bech32 encoded address from a public key.
@@ -19,10 +28,43 @@ def encode_address(public_key: bytes) -> str:
     return bech32.encode(BECH_32_HRP, 1, public_key)
 
 
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
 def decode_address(addr: str) -> bytes:
     """
     Decode an address
     Return the undelying public key as bytes
+    Throws an exception if the address is invalid
     """
     _, i = bech32.decode(BECH_32_HRP, addr)
+    assert i is not None and len(i) == 32, "validation: invalid address"
     return bytes(i)
+
+
+def encode_addresses(public_keys: Iterable[bytes]) -> List[str]:
+    """
+    Batch 'encode_address'.  Each distinct key is encoded once
+    """
+    public_keys = list(public_keys)
+    encoded = {pk: encode_address(pk) for pk in set(public_keys)}
+    return [encoded[pk] for pk in public_keys]
+
+
+def decode_addresses(addrs: Iterable[str]) -> List[bytes]:
+    """
+    Batch 'decode_address', e.g. to validate a payout list before paying anyone.
+    Each distinct address is decoded once.
+    Throws an exception naming the first invalid address
+    """
+    addrs = list(addrs)
+    decoded = {}
+    for addr in dict.fromkeys(addrs):
+        try:
+            decoded[addr] = decode_address(addr)
+        except AssertionError:
+            raise AssertionError(f"validation: invalid address {addr!r}") from None
+    return [decoded[addr] for addr in addrs]
+
+
+def clear_address_cache():
+    encode_address.cache_clear()
+    decode_address.cache_clear()
@@ -0,0 +1,115 @@
+"""
+Bloom filter for hashes (commitments, UHS IDs).  A miss means the key was never
+added, a hit means it probably was.
+
+It's a blocked filter: a key maps to one 64 bit word, and sets a pattern of
+'num_hashes' bits in it picked from a precomputed table.  A lookup is one unpack
+of the key and one compare instead of a loop over bit positions.  The keys are
+already uniformly distributed, so the word and the pattern are read from the key
+itself instead of hashing it again.
+"""
+import math
+import random
+import struct
+from array import array
+from typing import Dict, Iterable, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from cbdc.utils.hash import hash256
+
+MAX_HASHES = 8
+PATTERN_BITS = 10
+WORD_BITS = 64
+
+# word selector, pattern selector
+_KEY = struct.Struct("<QH")
+_patterns: Dict[int, Sequence[int]] = {}
+
+
+def _pattern_table(num_hashes: int) -> Sequence[int]:
+    """
+    2^PATTERN_BITS masks of 'num_hashes' distinct bits each (built once)
+    """
+    table = _patterns.get(num_hashes)
+    if table is None:
+        # seeded: the same table in every process
+        rng = random.Random(num_hashes)
+        table = [
+            sum(1 << b for b in rng.sample(range(WORD_BITS), num_hashes))
+            for _ in range(1 << PATTERN_BITS)
+        ]
+        _patterns[num_hashes] = table
+    return table
+
+
+class BloomFilter:
+    """
+    Sized for 'capacity' keys at a false positive rate of about 'fp_rate'.
+    Past capacity it keeps working, with a rising false positive rate
+    (see 'full')
+    """
+
+    def __init__(self, capacity: int = 1024, fp_rate: float = 0.01):
+        assert capacity > 0 and 0 < fp_rate < 1, "bad bloom filter parameters"
+        self.capacity: int = capacity
+        self.fp_rate: float = fp_rate
+        # blocking costs some accuracy: give it ~20% more bits than a plain filter
+        bits = -1.2 * capacity * math.log(fp_rate) / math.log(2) ** 2
+        # a power of 2, so picking the word is a mask instead of a modulo
+        num_words = 1 << max(0, math.ceil(math.log2(bits / WORD_BITS)))
+        self.num_hashes: int = min(
+            MAX_HASHES,
+            max(1, round(num_words * WORD_BITS / capacity * math.log(2))),
+        )
+        self.words = array("Q", bytes(8 * num_words))
+        self.count: int = 0
+        self._word_mask = num_words - 1
+        self._patterns = _pattern_table(self.num_hashes)
+
+    def _locate(self, key: bytes):
+        if len(key) < _KEY.size:
+            key = hash256(key)
+        word, pattern = _KEY.unpack_from(key)
+        return word & self._word_mask, self._patterns[pattern >> (16 - PATTERN_BITS)]
+
+    def add(self, key: bytes):
+        idx, mask = self._locate(key)
+        self.words[idx] |= mask
+        self.count += 1
+
+    def update(self, keys: Iterable[bytes]):
+        for k in keys:
+            self.add(k)
+
+    def update_words(self, keys):
+        """
+        Add 32 byte keys given as a numpy array of little endian words, one row
+        per key (e.g. from 'SlotTable.key_words').  Same as 'update', vectorized
+        """
+        word_idx = keys[:, 0] & np.uint64(self._word_mask)
+        pattern = (keys[:, 1] & np.uint64(0xFFFF)) >> np.uint64(16 - PATTERN_BITS)
+        masks = np.array(self._patterns, dtype=np.uint64)[pattern]
+        np.bitwise_or.at(np.frombuffer(self.words, dtype=np.uint64), word_idx, masks)
+        self.count += len(keys)
+
+    def __contains__(self, key: bytes) -> bool:
+        # '_locate' inlined: this is the hot path
+        if len(key) < _KEY.size:
+            key = hash256(key)
+        word, pattern = _KEY.unpack_from(key)
+        mask = self._patterns[pattern >> (16 - PATTERN_BITS)]
+        return self.words[word & self._word_mask] & mask == mask
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def full(self) -> bool:
+        """
+        True once more than 'capacity' keys were added: rebuild it bigger
+        """
+        return self.count > self.capacity
@@ -0,0 +1,42 @@
+"""
+Incremental multiset digest of UHS IDs.  The digest is the sum of the IDs
+(as 256 bit integers) modulo 2^256, so it's updated in constant time per ID
+added or removed.  It doesn't depend on the order of the updates, and the
+digests of disjoint sets (e.g. shards) add up to the digest of their union.
+
+UHS IDs are already sha256 hashes, so they're summed directly.  An additive
+digest is a consistency check between replicas, not a cryptographic commitment:
+sums of hashes can be made to collide with enough work (generalized birthday).
+"""
+from typing import Iterable
+
+from cbdc.utils.hash import HashSize
+
+MASK = (1 << (8 * HashSize)) - 1
+
+
+class MultisetDigest:
+    __slots__ = ("value",)
+
+    def __init__(self, ids: Iterable[bytes] = ()):
+        self.value: int = 0
+        self.add(ids)
+
+    def add(self, ids: Iterable[bytes]):
+        from_bytes = int.from_bytes
+        self.value = (self.value + sum(from_bytes(i, "big") for i in ids)) & MASK
+
+    def remove(self, ids: Iterable[bytes]):
+        from_bytes = int.from_bytes
+        self.value = (self.value - sum(from_bytes(i, "big") for i in ids)) & MASK
+
+    def digest(self) -> bytes:
+        return self.value.to_bytes(HashSize, "big")
+
+
+def combine_digests(digests: Iterable[bytes]) -> bytes:
+    """
+    Digest of the union of disjoint sets, from their digests
+    """
+    total = sum(int.from_bytes(d, "big") for d in digests) & MASK
+    return total.to_bytes(HashSize, "big")
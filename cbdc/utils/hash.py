@@ -17,3 +17,11 @@ def hash256(*args: bytes) -> bytes:
     for value in args:
         sha.update(value)
     return sha.digest()
+
+
+def new_hasher():
+    """
+    Incremental version of hash256. Call 'update' with each piece (in order),
+    then 'digest' for the 32 byte hash
+    """
+    return sha256()
@@ -0,0 +1,315 @@
+"""
+Write-ahead log of the UHS updates, with group commit.
+
+Every applied CompactTx is appended as a record (txid, spends, creates).  Records
+are buffered and written with one fsync per group by a background thread: when
+'batch_size' records are pending, or 'flush_interval' seconds after the first one.
+'append' never writes, so it's cheap to call under the UHS lock.  It returns the
+record's sequence number; 'wait' blocks until it's durable, e.g. before
+acknowledging the transaction.
+
+'snapshot' writes the whole UHS to '<path>.snap' and starts an empty log.
+'recover' loads the snapshot and replays the log on top of it.  A record torn
+by a crash is detected by its checksum and dropped, with everything after it.
+
+Log file:      header (magic, epoch), then records
+Record:        crc32 of the body, body length, body
+Record body:   txid, number of spends, number of creates, spends, creates
+Snapshot file: header (magic, epoch, count), then the UHS IDs
+The snapshot's epoch is one more than the log's it replaced: a log with an
+older epoch is already in the snapshot.  A log with a newer epoch needs a
+snapshot that's gone, so 'recover' fails rather than lose it.
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Iterator, MutableSet, Optional, Tuple
+
+from cbdc.transaction import CompactTx
+from cbdc.utils.hash import HashSize
+
+LOG_HEADER = struct.Struct("=8sQ")
+LOG_MAGIC = b"CBDCWAL1"
+SNAPSHOT_HEADER = struct.Struct("=8sQQ")
+SNAPSHOT_MAGIC = b"CBDCSNP1"
+# crc32, body length
+RECORD_HEADER = struct.Struct("=II")
+# txid, number of spends, number of creates
+RECORD_BODY = struct.Struct("=32sII")
+
+
+def encode_record(cmptx: CompactTx) -> bytes:
+    body = b"".join(
+        [
+            RECORD_BODY.pack(cmptx.tx_id, len(cmptx.spends), len(cmptx.creates)),
+            *cmptx.spends,
+            *cmptx.creates,
+        ]
+    )
+    return RECORD_HEADER.pack(zlib.crc32(body), len(body)) + body
+
+
+def decode_records(buf: bytes, offset: int) -> Iterator[Tuple[CompactTx, int]]:
+    """
+    Yield (CompactTx, offset of the next record) from 'offset' up to the end of
+    'buf', or up to the first torn or corrupt record
+    """
+    view = memoryview(buf)
+    size = len(buf)
+    while offset + RECORD_HEADER.size <= size:
+        crc, length = RECORD_HEADER.unpack_from(view, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + length
+        if length < RECORD_BODY.size or end > size:
+            return
+        if zlib.crc32(view[start:end]) != crc:
+            return
+        cmptx = CompactTx()
+        cmptx.tx_id, n_spends, n_creates = RECORD_BODY.unpack_from(view, start)
+        ids = start + RECORD_BODY.size
+        if ids + (n_spends + n_creates) * HashSize != end:
+            return
+        cmptx.spends = [
+            bytes(view[i : i + HashSize])
+            for i in range(ids, ids + n_spends * HashSize, HashSize)
+        ]
+        ids += n_spends * HashSize
+        cmptx.creates = [
+            bytes(view[i : i + HashSize]) for i in range(ids, end, HashSize)
+        ]
+        yield cmptx, end
+        offset = end
+
+
+def _fsync_dir(path: str):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """
+    Log at 'path', snapshot at 'path' + '.snap'.  Call 'recover' before appending.
+    With 'flush_interval' 0 the background thread only writes full groups: the
+    rest is written by 'flush', or by 'wait' on the waiting thread
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 1000,
+        flush_interval: float = 0.01,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        assert batch_size > 0, "batch size must be positive"
+        self.path: str = path
+        self.snapshot_path: str = path + ".snap"
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.epoch: int = 0
+        # number of fsyncs (groups) so far
+        self.syncs: int = 0
+        self._clock = clock
+        self._file = None
+        self._buffer = bytearray()
+        self._pending: int = 0
+        self._first_pending: float = 0.0
+        # sequence numbers: appended / durable
+        self._appended: int = 0
+        self._durable: int = 0
+        # a plain lock: '_flush_locked' releases it while it writes
+        self._cond = threading.Condition(threading.Lock())
+        self._writing = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    ### recovery ###
+
+    def recover(self, uhs: MutableSet[bytes]) -> int:
+        """
+        Rebuild 'uhs' (expected empty) from the snapshot and the log, and open
+        the log for appending.
+        Returns the number of log records replayed
+        """
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+            magic, self.epoch, count = SNAPSHOT_HEADER.unpack_from(data)
+            assert magic == SNAPSHOT_MAGIC, "not a UHS snapshot"
+            start = SNAPSHOT_HEADER.size
+            assert len(data) == start + count * HashSize, "truncated UHS snapshot"
+            uhs.update(
+                data[i : i + HashSize] for i in range(start, len(data), HashSize)
+            )
+
+        replayed = 0
+        good = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                data = f.read()
+            if len(data) >= LOG_HEADER.size:
+                magic, epoch = LOG_HEADER.unpack_from(data)
+                assert magic == LOG_MAGIC, "not a UHS log"
+                # the log starts from a snapshot we don't have: don't wipe it
+                assert (
+                    epoch <= self.epoch
+                ), f"UHS log is newer than the snapshot: {self.snapshot_path} is missing"
+                if epoch == self.epoch:
+                    good = LOG_HEADER.size
+                    for cmptx, good in decode_records(data, good):
+                        uhs.difference_update(cmptx.spends)
+                        uhs.update(cmptx.creates)
+                        replayed += 1
+                # else: an older log, already in the snapshot
+
+        if good:
+            # drop a torn tail
+            self._file = open(self.path, "r+b")
+            self._file.truncate(good)
+            self._file.seek(good)
+        else:
+            self._reset_log()
+        self._thread = threading.Thread(target=self._flusher, daemon=True)
+        self._thread.start()
+        return replayed
+
+    def _reset_log(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "wb")
+        self._file.write(LOG_HEADER.pack(LOG_MAGIC, self.epoch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        _fsync_dir(self.path)
+
+    ### appending ###
+
+    def append(self, cmptx: CompactTx) -> int:
+        """
+        Add a record to the current group.  A full group is handed to the
+        background thread: this doesn't wait for the write.
+        Returns the record's sequence number (see 'wait')
+        """
+        record = encode_record(cmptx)
+        with self._cond:
+            if not self._pending:
+                self._first_pending = self._clock()
+            self._buffer += record
+            self._pending += 1
+            self._appended += 1
+            seq = self._appended
+            if self._pending == 1 or self._pending == self.batch_size:
+                self._cond.notify_all()
+        return seq
+
+    def _flush_locked(self):
+        """
+        Called with the lock held.  The lock is released during the write and
+        fsync, so the next group fills up meanwhile.  One group is written at a
+        time, in order
+        """
+        while self._writing:
+            self._cond.wait()
+        if not self._pending:
+            return
+        group, self._buffer = self._buffer, bytearray()
+        last = self._appended
+        self._pending = 0
+        self._writing = True
+        self._cond.release()
+        try:
+            self._file.write(group)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        finally:
+            self._cond.acquire()
+            self._writing = False
+        self.syncs += 1
+        self._durable = last
+        self._cond.notify_all()
+
+    def flush(self):
+        """
+        Write and fsync the current group
+        """
+        with self._cond:
+            self._flush_locked()
+
+    def wait(self, seq: int):
+        """
+        Block until record 'seq' is durable.  Flushes now if the background
+        thread has no 'flush_interval' to do it
+        """
+        with self._cond:
+            if self.flush_interval <= 0 and self._durable < seq:
+                self._flush_locked()
+            while self._durable < seq and not self._closed:
+                self._cond.wait()
+
+    def _flusher(self):
+        with self._cond:
+            while not self._closed:
+                if self._pending >= self.batch_size:
+                    self._flush_locked()
+                    continue
+                if not self._pending or self.flush_interval <= 0:
+                    self._cond.wait()
+                    continue
+                remaining = self._first_pending + self.flush_interval - self._clock()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                else:
+                    self._flush_locked()
+
+    @property
+    def appended(self) -> int:
+        """
+        Sequence number of the last record appended
+        """
+        return self._appended
+
+    @property
+    def durable(self) -> int:
+        """
+        Sequence number of the last durable record
+        """
+        return self._durable
+
+    ### snapshots ###
+
+    def snapshot(self, uhs: MutableSet[bytes]):
+        """
+        Write all of 'uhs' to the snapshot file and start an empty log.
+        'uhs' must include every record appended so far, and not change until
+        this returns
+        """
+        with self._cond:
+            self._flush_locked()
+            tmp = self.snapshot_path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.epoch + 1, len(uhs)))
+                for uhs_id in uhs:
+                    f.write(uhs_id)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+            _fsync_dir(self.snapshot_path)
+            # a crash here leaves the old log, with an older epoch: it's ignored
+            self.epoch += 1
+            self._reset_log()
+
+    def close(self):
+        with self._cond:
+            if self._file is not None:
+                self._flush_locked()
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,27 +1,124 @@
-from typing import NoReturn, Sequence, MutableSequence, Tuple, Union, MutableMapping
-
+from functools import partial
+from itertools import chain
+from typing import (
+    Iterable,
+    List,
+    NoReturn,
+    Optional,
+    Sequence,
+    MutableSequence,
+    Tuple,
+    Union,
+    MutableMapping,
+)
+
+from cbdc.utils.bloom import BloomFilter
 from cbdc.utils.hash import hash256
-from cbdc.utils.keys import generate_keypair, sign_message
+from cbdc.utils.keys import derive_keypair, generate_keypair, sign_message
 from cbdc.utils.address import encode_address, decode_address
-from cbdc.transaction import Transaction, TxOut, TxIn, Outpoint
+from cbdc.transaction import (
+    CompactTx,
+    Transaction,
+    TxOut,
+    TxIn,
+    Outpoint,
+    hash_tx_inputs,
+)
+from cbdc.coins import STRATEGIES, UtxoStore
+from cbdc.keypool import DerivedSecrets, KeyPool
+from cbdc.wallet_store import (
+    PersistentUtxoStore,
+    SqliteWalletStore,
+    _CommittmentIndex,
+    _KeyColumn,
+    _PubkeyList,
+)
 
 
 class Wallet:
     """
-    In-memory wallet
+    In-memory wallet, unless a 'store' is given (see 'Wallet.open').
+    'coin_selection' is the strategy used to pick inputs for a transfer (see cbdc.coins)
+    With a 'seed', keys are derived from it and secret keys are re-derived to sign
+    instead of being stored.
+    'key_pool_size' keypairs are generated ahead of time by a background thread
+    (0: generate them on demand)
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        coin_selection: str = "fewest_inputs",
+        store: Optional[SqliteWalletStore] = None,
+        seed: Optional[bytes] = None,
+        key_pool_size: int = 0,
+    ):
+        assert coin_selection in STRATEGIES, "unknown coin selection strategy"
+        self.coin_selection: str = coin_selection
+        self.store: Optional[SqliteWalletStore] = store
+        if store is not None:
+            stored_seed = store.get_meta("seed")
+            assert seed is None or stored_seed in (None, seed), "wrong wallet seed"
+            seed = seed or stored_seed
+            if seed is not None:
+                store.set_meta("seed", seed)
+        self.seed: Optional[bytes] = seed
+        if store is None:
+            # list of my public keys (NOT USED)
+            self.pubkeys: Sequence[bytes] = []
+            # inputs I can spend, indexed by value
+            self.spendable_inputs: UtxoStore = UtxoStore()
+            # map of keypairs pubkey => secret key
+            self.pubkey_to_secretkey: MutableMapping[bytes, bytes] = {}
+            # map of witness commitments: pubkey => hash(pubkey)
+            self.witness_committments: MutableMapping[bytes, bytes] = {}
+            # reverse index of the above: hash(pubkey) => pubkey
+            self.committment_to_pubkey: MutableMapping[bytes, bytes] = {}
+            # map of derived keys pubkey => index (seeded wallets)
+            self.key_indices: MutableMapping[bytes, int] = {}
+        else:
+            # same as above, read from and written through to the store
+            self.pubkeys = _PubkeyList(store)
+            self.spendable_inputs = PersistentUtxoStore(store)
+            self.pubkey_to_secretkey = _KeyColumn(store, "secret")
+            self.witness_committments = _KeyColumn(store, "committment")
+            self.committment_to_pubkey = _CommittmentIndex(store)
+            self.key_indices = _KeyColumn(store, "key_index")
+        if seed is None:
+            self.keys = KeyPool(lambda _index: generate_keypair(), 0, key_pool_size)
+        else:
+            self.pubkey_to_secretkey = DerivedSecrets(seed, self.key_indices)
+            next_index = 0 if store is None else store.next_key_index()
+            self.keys = KeyPool(
+                partial(derive_keypair, seed), next_index, key_pool_size
+            )
+        # filter over my committments for 'scan', built when first needed
+        self._committment_filter: Optional[BloomFilter] = None
         # wallet balance
-        self.balance: int = 0
-        # list of my public keys (NOT USED)
-        self.pubkeys: Sequence[bytes] = []
-        # inputs I can spend
-        self.spendable_inputs: MutableSequence[TxIn] = []
-        # map of keypairs pubkey => secret key
-        self.pubkey_to_secretkey: MutableMapping[bytes, bytes] = {}
-        # map of witness commitments: pubkey => hash(pubkey)
-        self.witness_committments: MutableMapping[bytes, bytes] = {}
+        self.balance: int = self.spendable_inputs.total()
+
+    def open(
+        path: str,
+        coin_selection: str = "fewest_inputs",
+        seed: Optional[bytes] = None,
+        key_pool_size: int = 0,
+    ) -> "Wallet":
+        """
+        Open (or create) a wallet stored in the SQLite file at 'path'.
+        The seed of a seeded wallet is stored with it
+        """
+        return Wallet(coin_selection, SqliteWalletStore(path), seed, key_pool_size)
+
+    def close(self):
+        self.keys.close()
+        if self.store is not None:
+            self.store.close()
+
+    def _commit(self):
+        """
+        Make the changes durable. Called at the end of each operation
+        """
+        if self.store is not None:
+            self.store.commit()
 
     def mint_new_coins(self, num_output: int, value: int) -> Transaction:
         """
@@ -30,12 +127,11 @@ class Wallet:
         """
         tx1 = Transaction()
         for _i in range(num_output):
+            # adds the key and its committment to wallet state
             payee = self._generate_key()
-            committment = self._get_witness_committment(payee)
-            tx1.outputs.append(TxOut(value, committment))
-            # add to wallet state
-            self.witness_committments[payee] = committment
-        return tx1
+            tx1.outputs.append(TxOut(value, self._get_witness_committment(payee)))
+        self._commit()
+        return tx1.seal()
 
     @property
     def address(self) -> str:
@@ -43,6 +139,7 @@ class Wallet:
         Returns an address for this wallet.  Note: a wallet can have many addresses
         """
         pubkey = self._generate_key()
+        self._commit()
         return encode_address(pubkey)
 
     def is_my_address(self, address: str) -> bool:
@@ -57,6 +154,52 @@ class Wallet:
         Load the wallet from a transaction to update my balance and money
         """
         self._update_balance(tx)
+        self._commit()
+
+    def scan(
+        self, stream: Iterable[Union[Transaction, CompactTx]]
+    ) -> List[Union[Transaction, CompactTx]]:
+        """
+        Follow a stream of transactions and/or compact transactions.
+        Transactions paying me are received (see 'receive_transfer').  A compact
+        transaction only has UHS IDs, so it can't pay me: it's reported when it
+        spends or creates one of my spendable inputs.
+        Returns the transactions that concern me
+        """
+        # in memory, the committment index is cheaper to check than any filter
+        mine = self.committment_to_pubkey
+        if self.store is not None:
+            mine = self.committment_filter()
+        my_ids = None
+        found = []
+        for tx in stream:
+            if isinstance(tx, CompactTx):
+                if my_ids is None:
+                    my_ids = set(hash_tx_inputs(list(self.spendable_inputs)))
+                if not my_ids.isdisjoint(chain(tx.spends, tx.creates)):
+                    found.append(tx)
+            elif any(o.witness in mine for o in tx.outputs):
+                # a filter hit: check it for real
+                received = self._update_balance(tx)
+                if received:
+                    found.append(tx)
+                    if my_ids is not None:
+                        my_ids.update(hash_tx_inputs(received))
+        if found:
+            self._commit()
+        return found
+
+    def committment_filter(self) -> BloomFilter:
+        """
+        Bloom filter over my witness committments, so 'scan' only looks up the
+        store for likely hits.  Rebuilt bigger when it fills up
+        """
+        f = self._committment_filter
+        if f is None or f.full:
+            f = BloomFilter(max(1024, 2 * len(self.committment_to_pubkey)))
+            f.update(self.committment_to_pubkey)
+            self._committment_filter = f
+        return f
 
     ### helpers ###
 
@@ -69,6 +212,7 @@ class Wallet:
         # TODO: Call UHS for validation...then update
 
         self._update_balance(tx)
+        self._commit()
         return tx
 
     ### helpers ###
@@ -88,7 +232,8 @@ class Wallet:
             committment = self.witness_committments[change_address]
             tx.outputs.append(TxOut(change, committment))
 
-        txid = tx.tx_id()
+        # inputs and outputs are final: freeze them and cache the tx_id we sign
+        txid = tx.seal().tx_id()
         for ip in tx.inputs:
             comm = ip.prev_output_data.witness
             # this is an extra check
@@ -108,14 +253,27 @@ class Wallet:
         Your wallet will have many of these...
         Returns the public key
         """
-        p, s = generate_keypair()
+        index, p, s = self.keys.take()
         # add to wallet state
         self.pubkeys.append(p)
-        self.pubkey_to_secretkey[p] = s
+        if self.seed is None:
+            self.pubkey_to_secretkey[p] = s
+        else:
+            # the secret is re-derived from the seed when it's needed
+            self.key_indices[p] = index
         # seed committments
-        self.witness_committments[p] = self._get_witness_committment(p)
+        self._add_witness_committment(p, self._get_witness_committment(p))
         return p
 
+    def _add_witness_committment(self, pubkey: bytes, committment: bytes):
+        """
+        Add a committment to the wallet, keeping the reverse index in sync
+        """
+        self.witness_committments[pubkey] = committment
+        self.committment_to_pubkey[committment] = pubkey
+        if self._committment_filter is not None:
+            self._committment_filter.add(committment)
+
     def _get_witness_committment(self, pubkey: bytes) -> bytes:
         """
         Return a hash of the public key.  Note: opencbdc prefixes the pubkey with 0x0
@@ -128,10 +286,7 @@ class Wallet:
         Check if this is a committment from this wallet.
         A committment is a hash of a public key.
         """
-        for value in self.witness_committments.values():
-            if value == committment:
-                return True
-        return False
+        return committment in self.committment_to_pubkey
 
     def _get_pubkey_for_witness_committment(
         self, witness_committment
@@ -139,37 +294,33 @@ class Wallet:
         """
         Get the publickey associated with a witness committment
         """
-        for pubkey, committment in self.witness_committments.items():
-            if committment == witness_committment:
-                return pubkey
-        return None
+        return self.committment_to_pubkey.get(witness_committment)
 
     def _from_outputs(self, tx: Transaction) -> Sequence[TxIn]:
         """
         Convert the outputs in the given transaction to the wallet inputs (what I can spend)
         """
-        total = len(tx.outputs)
-        if total == 0:
+        mine = [
+            (i, txo)
+            for i, txo in enumerate(tx.outputs)
+            if self._has_witness_committment(txo.witness)
+        ]
+        if not mine:
             return []
-        results = []
+        # it's for me...add to my wallet. Only then is the tx_id needed
         txid = tx.tx_id()
-        for i in range(total):
-            txo = tx.outputs[i]
-            if self._has_witness_committment(txo.witness):
-                # it's for me...add to my wallet
-                tin = TxIn(Outpoint(i, txid), txo)
-                results.append(tin)
-        return results
+        return [TxIn(Outpoint(i, txid), txo) for i, txo in mine]
 
-    def _update_balance(self, tx: Transaction):
+    def _update_balance(self, tx: Transaction) -> Sequence[TxIn]:
         """
         Update the balance of the wallet IFF, the TxOut is for me
+        Returns the inputs added to the wallet
         """
         inputs = self._from_outputs(tx)
         for v in inputs:
-            if self._has_witness_committment(v.prev_output_data.witness):
-                self.balance += v.prev_output_data.value
-                self.spendable_inputs.append(v)
+            self.balance += v.prev_output_data.value
+            self.spendable_inputs.append(v)
+        return inputs
 
     def _accumulate_inputs(self, amount: int) -> Tuple[int, Transaction]:
         """
@@ -178,25 +329,15 @@ class Wallet:
         """
         assert len(self.spendable_inputs) > 0, "you're broke!"
 
-        tx = Transaction()
-        total = 0
-        idx = 0
-
-        # consume spendables (money in my wallet) till I reach 'amount'
-        for inp in self.spendable_inputs:
-            total += inp.prev_output_data.value
-            tx.inputs.append(inp)
-            idx += 1
-            if total >= amount:
-                break
-
+        selected = self.spendable_inputs.select(amount, self.coin_selection)
+        total = sum(value for value, _ in selected)
         assert total >= amount, "insufficient funds!"
 
-        # reduce my balance
-        for i in range(idx):
-            self.balance -= self.spendable_inputs[i].prev_output_data.value
+        # take the spendables (money in my wallet) I used for the tx
+        tx = Transaction()
+        tx.inputs.extend(self.spendable_inputs.remove(selected))
 
-        # delete the spendables I used for the tx
-        del self.spendable_inputs[:idx]
+        # reduce my balance
+        self.balance -= total
 
         return (total, tx)
@@ -0,0 +1,339 @@
+"""
+Durable wallet storage in SQLite.  Keys, commitments and spendable inputs are written
+through as the wallet changes.  Opening a wallet doesn't read them: secret keys,
+commitments and public keys are looked up when they're needed (e.g. a secret key
+when '_transfer' signs), and coin selection runs on an index on the value of the
+spendable inputs.
+"""
+import sqlite3
+from collections.abc import MutableMapping, Sequence
+from typing import Iterator, List, Optional
+
+from cbdc.coins import UtxoKey, UtxoStore
+from cbdc.transaction import Outpoint, TxidInterner, TxIn, TxOut
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    pubkey BLOB PRIMARY KEY,
+    secret BLOB,
+    key_index INTEGER,
+    committment BLOB
+);
+CREATE INDEX IF NOT EXISTS keys_committment ON keys (committment);
+-- only derived keys have an index: empty for wallets without a seed
+CREATE INDEX IF NOT EXISTS keys_key_index ON keys (key_index)
+    WHERE key_index IS NOT NULL;
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value BLOB
+);
+CREATE TABLE IF NOT EXISTS utxos (
+    txid BLOB NOT NULL,
+    idx INTEGER NOT NULL,
+    value REAL NOT NULL,
+    witness BLOB NOT NULL,
+    UNIQUE (txid, idx)
+);
+CREATE INDEX IF NOT EXISTS utxos_value ON utxos (value);
+"""
+
+
+class SqliteWalletStore:
+    """
+    Call 'commit' to make the changes since the last commit durable
+    (the wallet does it at the end of each operation)
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        # one fsync per commit, readers don't block the writer
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+        # txids shared by the loaded UTXOs
+        self._txids: TxidInterner = TxidInterner()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def _one(self, sql: str, *args) -> Optional[bytes]:
+        row = self.db.execute(sql, args).fetchone()
+        return row[0] if row else None
+
+    ### wallet settings ###
+
+    def get_meta(self, name: str) -> Optional[bytes]:
+        return self._one("SELECT value FROM meta WHERE name = ?", name)
+
+    def set_meta(self, name: str, value: bytes):
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value)
+        )
+
+    ### keys ###
+
+    def set_secret(self, pubkey: bytes, secret: bytes):
+        self.db.execute(
+            "INSERT INTO keys (pubkey, secret) VALUES (?, ?) "
+            "ON CONFLICT (pubkey) DO UPDATE SET secret = excluded.secret",
+            (pubkey, secret),
+        )
+
+    def set_key_index(self, pubkey: bytes, index: int):
+        self.db.execute(
+            "INSERT INTO keys (pubkey, key_index) VALUES (?, ?) "
+            "ON CONFLICT (pubkey) DO UPDATE SET key_index = excluded.key_index",
+            (pubkey, index),
+        )
+
+    def set_committment(self, pubkey: bytes, committment: bytes):
+        self.db.execute(
+            "INSERT INTO keys (pubkey, committment) VALUES (?, ?) "
+            "ON CONFLICT (pubkey) DO UPDATE SET committment = excluded.committment",
+            (pubkey, committment),
+        )
+
+    def secret(self, pubkey: bytes) -> Optional[bytes]:
+        return self._one("SELECT secret FROM keys WHERE pubkey = ?", pubkey)
+
+    def key_index(self, pubkey: bytes) -> Optional[int]:
+        return self._one("SELECT key_index FROM keys WHERE pubkey = ?", pubkey)
+
+    def next_key_index(self) -> int:
+        """
+        Index after the highest derived key
+        """
+        return self._one(
+            "SELECT COALESCE(MAX(key_index) + 1, 0) FROM keys "
+            "WHERE key_index IS NOT NULL"
+        )
+
+    def committment(self, pubkey: bytes) -> Optional[bytes]:
+        return self._one("SELECT committment FROM keys WHERE pubkey = ?", pubkey)
+
+    def pubkey_for_committment(self, committment: bytes) -> Optional[bytes]:
+        return self._one("SELECT pubkey FROM keys WHERE committment = ?", committment)
+
+    def key_count(self) -> int:
+        return self._one("SELECT COUNT(*) FROM keys")
+
+    ### spendable inputs ###
+
+    def add_utxo(self, txin: TxIn):
+        point = txin.prev_outpoint
+        out = txin.prev_output_data
+        self.db.execute(
+            "INSERT OR REPLACE INTO utxos (txid, idx, value, witness) VALUES (?, ?, ?, ?)",
+            (point.txid, point.index, out.value, out.witness),
+        )
+
+    def take_utxos(self, rowids: List[int]) -> List[TxIn]:
+        """
+        Remove the spendable inputs with the given rowids.
+        Returns them, in the same order
+        """
+        found = {}
+        # one query per chunk, under SQLite's limit on the number of parameters
+        for i in range(0, len(rowids), 500):
+            chunk = rowids[i : i + 500]
+            marks = ",".join("?" * len(chunk))
+            for rowid, txid, idx, value, witness in self.db.execute(
+                "SELECT rowid, txid, idx, value, witness FROM utxos "
+                f"WHERE rowid IN ({marks})",
+                chunk,
+            ):
+                found[rowid] = TxIn(Outpoint(idx, txid), TxOut(value, witness))
+        self.db.executemany(
+            "DELETE FROM utxos WHERE rowid = ?", [(rowid,) for rowid in rowids]
+        )
+        return [found[rowid] for rowid in rowids]
+
+    def load_utxos(self) -> Iterator[TxIn]:
+        """
+        All the spendable inputs.  UTXOs of the same transaction share its txid
+        """
+        intern = self._txids
+        for txid, idx, value, witness in self.db.execute(
+            "SELECT txid, idx, value, witness FROM utxos ORDER BY rowid"
+        ):
+            yield TxIn(Outpoint(idx, intern(txid)), TxOut(value, witness))
+
+    def utxo_count(self) -> int:
+        return self._one("SELECT COUNT(*) FROM utxos")
+
+    def utxo_total(self) -> float:
+        return self._one("SELECT TOTAL(value) FROM utxos")
+
+
+class _KeyColumn(MutableMapping):
+    """
+    pubkey => secret key, key index or committment, read from the store on demand
+    """
+
+    def __init__(self, store: SqliteWalletStore, column: str):
+        self._store = store
+        self._get = getattr(store, column)
+        self._set = getattr(store, "set_" + column)
+        self._column = column
+
+    def __getitem__(self, pubkey: bytes):
+        value = self._get(pubkey)
+        if value is None:
+            raise KeyError(pubkey)
+        return value
+
+    def __setitem__(self, pubkey: bytes, value):
+        self._set(pubkey, value)
+
+    def __delitem__(self, pubkey: bytes):
+        raise NotImplementedError("keys are never removed from a wallet")
+
+    def __iter__(self) -> Iterator[bytes]:
+        for (pubkey,) in self._store.db.execute(
+            f"SELECT pubkey FROM keys WHERE {self._column} IS NOT NULL ORDER BY rowid"
+        ):
+            yield pubkey
+
+    def __len__(self) -> int:
+        return self._store._one(
+            f"SELECT COUNT(*) FROM keys WHERE {self._column} IS NOT NULL"
+        )
+
+
+class _CommittmentIndex(MutableMapping):
+    """
+    committment => pubkey, using the index on the keys table
+    """
+
+    def __init__(self, store: SqliteWalletStore):
+        self._store = store
+
+    def __getitem__(self, committment: bytes) -> bytes:
+        pubkey = self._store.pubkey_for_committment(committment)
+        if pubkey is None:
+            raise KeyError(committment)
+        return pubkey
+
+    def __setitem__(self, committment: bytes, pubkey: bytes):
+        self._store.set_committment(pubkey, committment)
+
+    def __delitem__(self, committment: bytes):
+        raise NotImplementedError("keys are never removed from a wallet")
+
+    def __iter__(self) -> Iterator[bytes]:
+        for (committment,) in self._store.db.execute(
+            "SELECT committment FROM keys WHERE committment IS NOT NULL ORDER BY rowid"
+        ):
+            yield committment
+
+    def __len__(self) -> int:
+        return self._store._one(
+            "SELECT COUNT(*) FROM keys WHERE committment IS NOT NULL"
+        )
+
+
+class _PubkeyList(Sequence):
+    """
+    The wallet's public keys, in the order they were generated.
+    'append' is a no-op: the key is stored with its secret (or index)
+    """
+
+    def __init__(self, store: SqliteWalletStore):
+        self._store = store
+
+    def __getitem__(self, idx: int) -> bytes:
+        if idx < 0:
+            idx += len(self)
+        pubkey = self._store._one(
+            "SELECT pubkey FROM keys ORDER BY rowid LIMIT 1 OFFSET ?", idx
+        )
+        if pubkey is None:
+            raise IndexError(idx)
+        return pubkey
+
+    def __len__(self) -> int:
+        return self._store.key_count()
+
+    def append(self, pubkey: bytes):
+        pass
+
+
+class _ValueIndex:
+    """
+    The SortedKeys API (see cbdc.coins) over the index on utxos (value).
+    Keys are (value, rowid)
+    """
+
+    def __init__(self, store: SqliteWalletStore):
+        self._db = store.db
+
+    def _first(self, sql: str, key: UtxoKey) -> Optional[UtxoKey]:
+        row = self._db.execute(sql, key).fetchone()
+        return tuple(row) if row else None
+
+    def _keys(self, sql: str, *args) -> Iterator[UtxoKey]:
+        for value, rowid in self._db.execute(sql, args):
+            yield value, rowid
+
+    def ceiling(self, key: UtxoKey) -> Optional[UtxoKey]:
+        return self._first(
+            "SELECT value, rowid FROM utxos WHERE (value, rowid) >= (?, ?) "
+            "ORDER BY value, rowid LIMIT 1",
+            key,
+        )
+
+    def lower(self, key: UtxoKey) -> Optional[UtxoKey]:
+        return self._first(
+            "SELECT value, rowid FROM utxos WHERE (value, rowid) < (?, ?) "
+            "ORDER BY value DESC, rowid DESC LIMIT 1",
+            key,
+        )
+
+    def below(self, key: UtxoKey) -> Iterator[UtxoKey]:
+        return self._keys(
+            "SELECT value, rowid FROM utxos WHERE (value, rowid) < (?, ?) "
+            "ORDER BY value, rowid",
+            *key,
+        )
+
+    def __iter__(self) -> Iterator[UtxoKey]:
+        return self._keys("SELECT value, rowid FROM utxos ORDER BY value, rowid")
+
+    def __reversed__(self) -> Iterator[UtxoKey]:
+        return self._keys(
+            "SELECT value, rowid FROM utxos ORDER BY value DESC, rowid DESC"
+        )
+
+
+class PersistentUtxoStore(UtxoStore):
+    """
+    UtxoStore kept in the wallet store.  Nothing is loaded when the wallet opens:
+    coin selection queries the value index, and only the selected inputs are read
+    """
+
+    def __init__(self, store: SqliteWalletStore):
+        self._store: SqliteWalletStore = store
+        self._by_value = _ValueIndex(store)
+
+    def append(self, txin: TxIn):
+        self._store.add_utxo(txin)
+
+    def remove(self, keys: List[UtxoKey]) -> List[TxIn]:
+        return self._store.take_utxos([rowid for _, rowid in keys])
+
+    def oldest(self) -> Iterator[UtxoKey]:
+        return self._by_value._keys("SELECT value, rowid FROM utxos ORDER BY rowid")
+
+    def total(self) -> float:
+        return self._store.utxo_total()
+
+    def __len__(self) -> int:
+        return self._store.utxo_count()
+
+    def __iter__(self) -> Iterator[TxIn]:
+        return self._store.load_utxos()
@@ -0,0 +1,279 @@
+"""
+Workload generator: signed transaction streams for load testing the UHS.
+
+Generation is split into independent parts, each with its own population of
+accounts, built in parallel on a process pool.  The stream is written as
+concatenated serialized transactions (see 'iter_transactions'): every part's
+mint first, then the transfers of all the parts interleaved, so it replays in
+order against an empty UHS.  Keys are derived from '--seed', so the same options
+produce the same file.
+
+    python -m cbdc.workload generate -o load.bin --txs 100000 --fan-in 1:4 --skew 1.2
+    python -m cbdc.workload replay load.bin --shards 4
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, zip_longest
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple
+
+from cbdc.shard import ShardedUhs
+from cbdc.transaction import Outpoint, Transaction, TxIn, TxOut, iter_transactions
+from cbdc.uhs import UhsController
+from cbdc.utils.hash import hash256
+from cbdc.utils.keys import derive_keypair, sign_message
+
+
+class WorkloadConfig(NamedTuple):
+    # transfers to generate (not counting the mints)
+    txs: int = 10_000
+    accounts: int = 1_000
+    # coins minted to each account, and their value
+    coins: int = 10
+    value: int = 100
+    # (min, max) inputs and outputs per transfer
+    fan_in: Tuple[int, int] = (1, 2)
+    fan_out: Tuple[int, int] = (1, 2)
+    # zipf exponent for picking senders and receivers. 0: uniform
+    skew: float = 0.0
+    # fraction of transfers that re-spend an already spent input
+    double_spend_rate: float = 0.0
+    seed: int = 0
+    # independent parts, each with 'accounts / parts' accounts
+    parts: int = 1
+
+
+class Account:
+    __slots__ = ("pubkey", "secret", "committment", "coins")
+
+    def __init__(self, seed: bytes, index: int):
+        self.pubkey, self.secret = derive_keypair(seed, index)
+        self.committment: bytes = hash256(self.pubkey)
+        self.coins: List[TxIn] = []
+
+
+def _sign(tx: Transaction, owners: List[Account]) -> Transaction:
+    txid = tx.seal().tx_id()
+    for owner in owners:
+        tx.witnesses.append(owner.pubkey + sign_message(txid, owner.secret))
+    return tx
+
+
+def _received(tx: Transaction, accounts: List[Account], receivers: List[int]):
+    txid = tx.tx_id()
+    for i, (out, r) in enumerate(zip(tx.outputs, receivers)):
+        accounts[r].coins.append(TxIn(Outpoint(i, txid), out))
+
+
+def _split(total: int, parts: int) -> List[int]:
+    base, extra = divmod(total, parts)
+    return [base + (i < extra) for i in range(parts)]
+
+
+def generate_part(config: WorkloadConfig, part: int) -> Tuple[List[bytes], List[bytes]]:
+    """
+    One part of the workload.
+    Returns (serialized mint transactions, serialized transfers)
+    """
+    rng = random.Random(f"{config.seed}:{part}")
+    key_seed = hash256(
+        b"workload", config.seed.to_bytes(8, "big"), part.to_bytes(4, "big")
+    )
+    n_accounts = _split(config.accounts, config.parts)[part]
+    n_txs = _split(config.txs, config.parts)[part]
+    accounts = [Account(key_seed, i) for i in range(n_accounts)]
+    weights = list(accumulate(1 / (i + 1) ** config.skew for i in range(n_accounts)))
+
+    mints = []
+    for idx, acct in enumerate(accounts):
+        mint = Transaction()
+        mint.outputs.extend(
+            TxOut(config.value, acct.committment) for _ in range(config.coins)
+        )
+        mint.seal()
+        _received(mint, accounts, [idx] * config.coins)
+        mints.append(mint.serialize())
+
+    # (spent input, owner) for double spends
+    spent: List[Tuple[TxIn, Account]] = []
+    transfers = []
+    while len(transfers) < n_txs:
+        if spent and rng.random() < config.double_spend_rate:
+            txin, owner = rng.choice(spent)
+            receiver = rng.choices(range(n_accounts), cum_weights=weights)[0]
+            tx = Transaction()
+            tx.inputs.append(txin)
+            tx.outputs.append(
+                TxOut(txin.prev_output_data.value, accounts[receiver].committment)
+            )
+            # never credited: the UHS rejects it
+            transfers.append(_sign(tx, [owner]).serialize())
+            continue
+
+        sender = accounts[rng.choices(range(n_accounts), cum_weights=weights)[0]]
+        if not sender.coins:
+            sender = rng.choice([a for a in accounts if a.coins])
+        n_in = min(rng.randint(*config.fan_in), len(sender.coins))
+        inputs = [
+            sender.coins.pop(rng.randrange(len(sender.coins))) for _ in range(n_in)
+        ]
+        total = sum(int(i.prev_output_data.value) for i in inputs)
+        n_out = min(rng.randint(*config.fan_out), total)
+        receivers = rng.choices(range(n_accounts), cum_weights=weights, k=n_out)
+
+        tx = Transaction()
+        tx.inputs.extend(inputs)
+        tx.outputs.extend(
+            TxOut(v, accounts[r].committment)
+            for v, r in zip(_split(total, n_out), receivers)
+        )
+        _sign(tx, [sender] * n_in)
+        _received(tx, accounts, receivers)
+        spent.extend((i, sender) for i in inputs)
+        transfers.append(tx.serialize())
+    return mints, transfers
+
+
+def _generate_part(args: Tuple[WorkloadConfig, int]):
+    return generate_part(*args)
+
+
+def generate(
+    config: WorkloadConfig, out: BinaryIO, workers: Optional[int] = None
+) -> int:
+    """
+    Generate the workload on a process pool of 'workers' processes
+    (default: one per CPU) and write it to 'out'.
+    Returns the number of transactions written
+    """
+    assert config.parts <= config.accounts, "need at least one account per part"
+    assert 1 <= config.fan_in[0] <= config.fan_in[1], "bad fan-in range"
+    assert 1 <= config.fan_out[0] <= config.fan_out[1], "bad fan-out range"
+    jobs = [(config, part) for part in range(config.parts)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(_generate_part, jobs))
+
+    written = 0
+    for mints, _ in parts:
+        out.writelines(mints)
+        written += len(mints)
+    # round robin: keeps the order within each part
+    for batch in zip_longest(*(transfers for _, transfers in parts)):
+        txs = [tx for tx in batch if tx is not None]
+        out.writelines(txs)
+        written += len(txs)
+    return written
+
+
+def replay(stream: BinaryIO, uhs: UhsController) -> Tuple[int, int]:
+    """
+    Apply a workload to 'uhs'.  Mints are applied as is, transfers with
+    'execute_locked' (validated, rejected if an input is spent).
+    Returns (accepted, rejected)
+    """
+    accepted = rejected = 0
+    for tx in iter_transactions(stream):
+        if not tx.inputs:
+            uhs.mint(tx, False)
+            accepted += 1
+        elif uhs.execute_locked(tx):
+            accepted += 1
+        else:
+            rejected += 1
+    return accepted, rejected
+
+
+def _range(value: str) -> Tuple[int, int]:
+    """
+    'N' or 'MIN:MAX'
+    """
+    low, _, high = value.partition(":")
+    return int(low), int(high or low)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m cbdc.workload")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="write a workload file")
+    gen.add_argument("-o", "--output", required=True, help="workload file to write")
+    defaults = WorkloadConfig()
+    gen.add_argument("--txs", type=int, default=defaults.txs, help="transfers")
+    gen.add_argument("--accounts", type=int, default=defaults.accounts)
+    gen.add_argument(
+        "--coins", type=int, default=defaults.coins, help="coins minted per account"
+    )
+    gen.add_argument("--value", type=int, default=defaults.value, help="coin value")
+    gen.add_argument(
+        "--fan-in", type=_range, default="1:2", help="inputs per transfer: N or MIN:MAX"
+    )
+    gen.add_argument(
+        "--fan-out",
+        type=_range,
+        default="1:2",
+        help="outputs per transfer: N or MIN:MAX",
+    )
+    gen.add_argument(
+        "--skew",
+        type=float,
+        default=defaults.skew,
+        help="zipf exponent of account activity (0: uniform, >1: a few hot accounts)",
+    )
+    gen.add_argument(
+        "--double-spend-rate",
+        type=float,
+        default=defaults.double_spend_rate,
+        help="fraction of transfers that re-spend a spent input",
+    )
+    gen.add_argument("--seed", type=int, default=defaults.seed)
+    gen.add_argument(
+        "--parts",
+        type=int,
+        help="independent parts generated in parallel (default: one per worker)",
+    )
+    gen.add_argument("-j", "--workers", type=int, help="processes (default: CPUs)")
+
+    rep = commands.add_parser("replay", help="apply a workload file to a UHS")
+    rep.add_argument("input", help="workload file")
+    rep.add_argument(
+        "--shards", type=int, default=0, help="use a ShardedUhs with N shards"
+    )
+
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    if args.command == "generate":
+        workers = args.workers or os.cpu_count() or 1
+        config = WorkloadConfig(
+            txs=args.txs,
+            accounts=args.accounts,
+            coins=args.coins,
+            value=args.value,
+            fan_in=args.fan_in,
+            fan_out=args.fan_out,
+            skew=args.skew,
+            double_spend_rate=args.double_spend_rate,
+            seed=args.seed,
+            parts=args.parts or workers,
+        )
+        with open(args.output, "wb") as f:
+            written = generate(config, f, workers)
+        elapsed = time.perf_counter() - start
+        print(f"wrote {written} transactions to {args.output} in {elapsed:.1f}s")
+    else:
+        uhs = UhsController(uhs=ShardedUhs(args.shards) if args.shards else None)
+        with open(args.input, "rb") as f:
+            accepted, rejected = replay(f, uhs)
+        elapsed = time.perf_counter() - start
+        total = accepted + rejected
+        print(
+            f"{total} transactions in {elapsed:.1f}s ({total / elapsed:.0f} tx/s): "
+            f"{accepted} accepted, {rejected} rejected, {len(uhs.uhs)} unspent"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
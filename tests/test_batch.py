@@ -0,0 +1,56 @@
+from cbdc.transaction import Transaction, TxOut
+from cbdc.wallet import Wallet
+from cbdc.uhs import UhsController
+from cbdc.batch import TxBatch
+
+
+def test_tx_batch():
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController()
+    minted = dave.mint_new_coins(10, 3)
+    dave.receive_transfer(minted)
+    uhs.mint(minted, False)
+
+    good = [dave.transfer(3, bob.address), dave.transfer(4.5, bob.address)]
+    spent = dave.transfer(3, bob.address)
+    unbalanced = Transaction()
+    unbalanced.inputs.extend(spent.inputs)
+    unbalanced.outputs.append(TxOut(2, spent.outputs[0].witness))
+    unbalanced.witnesses.extend(spent.witnesses)
+    unbalanced.seal()
+    missing_witness = dave.transfer(3, bob.address)
+    missing_witness.witnesses.pop()
+    txs = good + [unbalanced, missing_witness, minted]
+
+    batch = TxBatch.from_transactions(txs)
+    assert batch.size == 5
+    assert batch.input_offsets.tolist() == [0, 1, 3, 4, 5, 5]
+    assert batch.check_structure().tolist() == [True, True, True, False, False]
+    assert batch.check_inputs_outputs().tolist() == [True, True, False, True, False]
+    assert batch.valid_mask().tolist() == [True, True, False, False, False]
+
+    # round trip
+    back = batch.to_transactions()
+    assert [t.serialize() for t in back] == [t.serialize() for t in txs]
+
+    assert uhs.validate_batch(txs, prefilter=True) == [True, True, False, False, False]
+    assert TxBatch.from_transactions([]).valid_mask().tolist() == []
+
+
+def test_tx_batch_short_witness():
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController()
+    minted = dave.mint_new_coins(2, 3)
+    dave.receive_transfer(minted)
+    uhs.mint(minted, False)
+
+    good = dave.transfer(3, bob.address)
+    short = dave.transfer(3, bob.address)
+    short.witnesses[0] = short.witnesses[0][:-1]
+
+    batch = TxBatch.from_transactions([good, short])
+    assert batch.malformed.tolist() == [False, True]
+    assert uhs.validate_batch([good, short], prefilter=True) == [True, False]
+    assert uhs.validate_batch([good, short]) == [True, False]
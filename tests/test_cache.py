@@ -0,0 +1,98 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from nacl.exceptions import BadSignatureError
+
+from cbdc.cache import DuplicateFilter, SignatureCache
+from cbdc.metrics import Metrics
+from cbdc.sentinel import SentinelClient, SentinelServer
+from cbdc.uhs import UhsController, check_witness_and_signature
+from cbdc.wallet import Wallet
+
+
+def test_signature_cache_evicts():
+    cache = SignatureCache(max_entries=2)
+    a, b, c = (bytes([i]) * 32 for i in range(3))
+    cache.add(a, a, a)
+    cache.add(b, b, b)
+    # touch 'a': 'b' is now the least recently used
+    assert cache.verified(a, a, a)
+    cache.add(c, c, c)
+    assert len(cache) == 2
+    assert not cache.verified(b, b, b)
+    assert cache.verified(c, c, c)
+    assert cache.hits == 2 and cache.misses == 1
+
+
+def test_duplicate_filter_window():
+    now = [0.0]
+    recent = DuplicateFilter(window=10.0, clock=lambda: now[0])
+    recent.add(b"\x01" * 32)
+    now[0] = 5.0
+    recent.add(b"\x02" * 32)
+    assert recent.seen(b"\x01" * 32)
+    now[0] = 12.0
+    assert not recent.seen(b"\x01" * 32)
+    assert recent.seen(b"\x02" * 32)
+    assert len(recent) == 1
+    assert recent.hit_rate == 2 / 3
+
+
+def test_uhs_caches():
+    bob = Wallet()
+    dave = Wallet()
+    metrics = Metrics()
+    uhs = UhsController(metrics=metrics, sig_cache_size=100, duplicate_window=60)
+    minted = dave.mint_new_coins(4, 10)
+    dave.receive_transfer(minted)
+    uhs.mint(minted, False)
+
+    tx = dave.transfer(20, bob.address)
+    # verified once, then served from the cache
+    assert uhs.validate(tx)
+    assert uhs.validate(tx)
+    assert uhs.sig_cache.hits == 2 and uhs.sig_cache.misses == 2
+
+    uhs.execute_transaction(tx)
+    # resubmitted: rejected before validation
+    with pytest.raises(AssertionError, match="duplicate"):
+        uhs.execute_transaction(tx)
+    assert not uhs.execute_locked(tx)
+    assert uhs.validate_batch([tx]) == [False]
+    counters = metrics.snapshot()["counters"]
+    assert counters["duplicates.hits"] == 3
+    assert counters["sig_cache.hits"] == uhs.sig_cache.hits == 4
+
+    # a forged signature is never a cache hit
+    other = dave.transfer(20, bob.address)
+    check_witness_and_signature(other, uhs.sig_cache)
+    wit = other.witnesses[0]
+    other.witnesses[0] = wit[:-1] + bytes([wit[-1] ^ 1])
+    with pytest.raises(BadSignatureError):
+        check_witness_and_signature(other, uhs.sig_cache)
+
+
+def test_sentinel_duplicates_with_process_pool(tmp_path):
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController(duplicate_window=60)
+    minted = dave.mint_new_coins(2, 10)
+    dave.receive_transfer(minted)
+    uhs.mint(minted, False)
+    tx = dave.transfer(10, bob.address)
+
+    async def run(executor):
+        server = SentinelServer(uhs, executor)
+        await server.start_unix(str(tmp_path / "sentinel.sock"))
+        client = await SentinelClient.connect_unix(str(tmp_path / "sentinel.sock"))
+        results = [await client.submit(tx) for _ in range(2)]
+        await client.close()
+        await server.close()
+        return results
+
+    # the filter lives in this process: checked on the event loop thread
+    with ProcessPoolExecutor(1) as executor:
+        results = asyncio.run(run(executor))
+    assert results == [(True, ""), (False, "duplicate transaction")]
+    assert uhs.recent.hits == 1
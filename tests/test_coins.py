@@ -0,0 +1,99 @@
+import random
+
+from cbdc import coins
+from cbdc.coins import SortedKeys, UtxoStore
+from cbdc.transaction import Outpoint, TxIn, TxOut
+from cbdc.wallet import Wallet
+from cbdc.wallet_store import PersistentUtxoStore, SqliteWalletStore
+
+
+def make_store(values):
+    store = UtxoStore()
+    for i, v in enumerate(values):
+        store.append(TxIn(Outpoint(i, b"\x01" * 32), TxOut(v, b"\x02" * 32)))
+    return store
+
+
+def selected_values(store, amount, strategy):
+    return sorted(v for v, _ in store.select(amount, strategy))
+
+
+def test_strategies():
+    store = make_store([1, 1, 1, 1, 2, 5, 7, 20])
+    assert selected_values(store, 4, "first_fit") == [1, 1, 1, 1]
+    assert selected_values(store, 4, "largest_first") == [20]
+    # smallest single input that covers it
+    assert selected_values(store, 4, "fewest_inputs") == [5]
+    assert selected_values(store, 23, "fewest_inputs") == [5, 20]
+    # exact match, no change
+    assert sum(selected_values(store, 10, "branch_and_bound")) == 10
+    assert selected_values(store, 9, "branch_and_bound") == [2, 7]
+    # no exact match: falls back to fewest inputs
+    assert selected_values(store, 31.5, "branch_and_bound") == [5, 7, 20]
+
+    # removal keeps the index in sync
+    removed = store.remove(store.select(4, "fewest_inputs"))
+    assert [t.prev_output_data.value for t in removed] == [5]
+    assert len(store) == 7
+    assert selected_values(store, 4, "fewest_inputs") == [7]
+
+
+def test_persistent_strategies(tmp_path):
+    values = [1, 1, 1, 1, 2, 5, 7, 20]
+    memory = make_store(values)
+    persistent = PersistentUtxoStore(SqliteWalletStore(str(tmp_path / "w.db")))
+    for txin in memory:
+        persistent.append(txin)
+    assert len(persistent) == 8 and persistent.total() == 38
+
+    # same selections from the SQL index
+    for amount in (4, 9, 10, 23, 31.5, 100):
+        for strategy in coins.STRATEGIES:
+            assert selected_values(persistent, amount, strategy) == selected_values(
+                memory, amount, strategy
+            )
+    removed = persistent.remove(persistent.select(23, "fewest_inputs"))
+    assert [t.prev_output_data.value for t in removed] == [20, 5]
+    assert len(persistent) == 6
+    assert selected_values(persistent, 4, "fewest_inputs") == [7]
+
+
+def test_wallet_coin_selection():
+    bob = Wallet()
+    dave = Wallet(coin_selection="branch_and_bound")
+    minted = dave.mint_new_coins(10, 1)
+    dave.receive_transfer(minted)
+    minted = dave.mint_new_coins(1, 6)
+    dave.receive_transfer(minted)
+
+    tx = dave.transfer(6, bob.address)
+    assert len(tx.inputs) == 1
+    assert len(tx.outputs) == 1
+    assert dave.balance == 10
+    assert len(dave.spendable_inputs) == 10
+
+
+def test_sorted_keys(monkeypatch):
+    # small buckets, so they split and empty
+    monkeypatch.setattr(coins, "BUCKET_SIZE", 4)
+    rng = random.Random(7)
+    keys = SortedKeys([(rng.randrange(50), seq) for seq in range(20)])
+    expected = sorted(keys)
+    for seq in range(20, 400):
+        if expected and rng.random() < 0.4:
+            key = expected.pop(rng.randrange(len(expected)))
+            keys.remove(key)
+        else:
+            key = (rng.randrange(50), seq)
+            keys.add(key)
+            expected.append(key)
+            expected.sort()
+        probe = (rng.randrange(52), -1)
+        assert keys.ceiling(probe) == next((k for k in expected if k >= probe), None)
+        assert keys.lower(probe) == next(
+            (k for k in reversed(expected) if k < probe), None
+        )
+    assert list(keys) == expected
+    assert list(reversed(keys)) == expected[::-1]
+    assert list(keys.below((25, -1))) == [k for k in expected if k[0] < 25]
+    assert len(keys) == len(expected)
@@ -0,0 +1,92 @@
+from cbdc.wallet import Wallet
+from cbdc.uhs import UhsController
+from cbdc.coordinator import BatchCoordinator
+from cbdc.transaction import CompactTx
+from cbdc.utils.digest import MultisetDigest
+from cbdc.wal import WriteAheadLog
+
+
+def test_batch_coordinator():
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController()
+
+    minted = dave.mint_new_coins(2, 10)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+
+    tx1 = CompactTx.create(dave.transfer(10, bob.address))
+    # a double spend of tx1's input
+    double = CompactTx()
+    double.tx_id = b"\x02" * 32
+    double.spends = list(tx1.spends)
+    double.creates.append(b"\x03" * 32)
+    # spends the output of tx1 (in the same batch)
+    chained = CompactTx()
+    chained.tx_id = b"\x04" * 32
+    chained.spends = list(tx1.creates)
+    chained.creates.append(b"\x05" * 32)
+    # spends something that doesn't exist
+    missing = CompactTx()
+    missing.tx_id = b"\x06" * 32
+    missing.spends.append(b"\x07" * 32)
+
+    now = [0.0]
+    coord = BatchCoordinator(
+        uhs.uhs,
+        batch_size=4,
+        batch_deadline=1.0,
+        clock=lambda: now[0],
+        digest=uhs.digest,
+    )
+    assert coord.submit(tx1) == []
+    assert coord.submit(double) == []
+    assert coord.submit(chained) == []
+    results = coord.submit(missing)
+    assert results == [
+        (tx1.tx_id, True),
+        (double.tx_id, False),
+        (chained.tx_id, True),
+        (missing.tx_id, False),
+    ]
+    # 1 minted left + output of 'chained'
+    assert len(uhs.uhs) == 2
+    assert b"\x05" * 32 in uhs.uhs
+    assert tx1.creates[0] not in uhs.uhs
+
+    # deadline flush
+    last = CompactTx()
+    last.tx_id = b"\x08" * 32
+    last.creates.append(b"\x09" * 32)
+    assert coord.submit(last) == []
+    now[0] = 2.0
+    assert coord.poll() == [(last.tx_id, True)]
+    assert b"\x09" * 32 in uhs.uhs
+    assert uhs.state_digest() == MultisetDigest(uhs.uhs).digest()
+
+
+def test_batch_coordinator_wal(tmp_path):
+    bob = Wallet()
+    dave = Wallet()
+    path = str(tmp_path / "uhs.wal")
+    wal = WriteAheadLog(path, batch_size=1000, flush_interval=0)
+    uhs = UhsController(wal=wal)
+    minted = dave.mint_new_coins(2, 10)
+    dave.receive_transfer(minted)
+    uhs.mint(minted, False)
+
+    tx1 = CompactTx.create(dave.transfer(10, bob.address))
+    chained = CompactTx()
+    chained.tx_id = b"\x04" * 32
+    chained.spends = list(tx1.creates)
+    chained.creates.append(b"\x05" * 32)
+
+    coord = BatchCoordinator(uhs.uhs, batch_size=2, wal=wal, lock=uhs.store_lock)
+    coord.submit(tx1)
+    assert coord.submit(chained) == [(tx1.tx_id, True), (chained.tx_id, True)]
+    # durable once the results are returned
+    assert wal.durable == wal.appended == 3
+    wal.close()
+    recovered = UhsController(wal=WriteAheadLog(path, flush_interval=0))
+    assert recovered.uhs == uhs.uhs
+    recovered.wal.close()
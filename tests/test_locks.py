@@ -0,0 +1,78 @@
+import threading
+
+from cbdc.wallet import Wallet
+from cbdc.uhs import UhsController
+from cbdc.locks import LockTable, SharedLock
+from cbdc.transaction import CompactTx, Transaction
+
+
+def test_lock_table():
+    locks = LockTable()
+    a, b, c = b"\x01" * 32, b"\x02" * 32, b"\x03" * 32
+    assert locks.try_lock([a, b])
+    # all or nothing
+    assert not locks.try_lock([b, c])
+    assert locks.try_lock([c])
+    locks.release([a, b])
+    assert locks.try_lock([a, b])
+    assert len(locks) == 3
+
+
+def test_shared_lock():
+    lock = SharedLock()
+    entered = threading.Event()
+
+    def exclusive():
+        with lock.exclusive():
+            entered.set()
+
+    with lock.shared(), lock.shared():
+        writer = threading.Thread(target=exclusive)
+        writer.start()
+        assert not entered.wait(0.05)
+    writer.join()
+    assert entered.is_set()
+
+
+def test_execute_concurrent():
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController()
+
+    minted = dave.mint_new_coins(50, 1)
+    dave.receive_transfer(minted)
+    uhs.mint(minted, False)
+
+    txs = [dave.transfer(1, bob.address) for _ in range(50)]
+    # the replay double spends the first transaction's input: the later one loses
+    replay = txs[0]
+
+    results = uhs.execute_concurrent(txs + [replay])
+    assert results == [True] * 50 + [False]
+    assert len(uhs.uhs) == 50
+    for tx in txs:
+        for c in CompactTx.create(tx).creates:
+            assert c in uhs.uhs
+    assert len(uhs.locks) == 0
+
+    # already spent
+    assert not uhs.execute_locked(txs[1])
+
+
+def test_execute_concurrent_forged_first():
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController()
+
+    minted = dave.mint_new_coins(1, 5)
+    dave.receive_transfer(minted)
+    uhs.mint(minted, False)
+
+    good = dave.transfer(5, bob.address)
+    # same spend, bad signature: must not claim the input ahead of the good one
+    forged = Transaction.deserialize(good.serialize())
+    wit = forged.witnesses[0]
+    forged.witnesses[0] = wit[:-1] + bytes([wit[-1] ^ 1])
+
+    assert uhs.execute_concurrent([forged, good]) == [False, True]
+    assert len(uhs.locks) == 0
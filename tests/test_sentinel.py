@@ -0,0 +1,90 @@
+import asyncio
+
+from cbdc.wallet import Wallet
+from cbdc.uhs import UhsController
+from cbdc.sentinel import SentinelClient, SentinelServer
+
+
+def test_sentinel(tmp_path):
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController()
+
+    minted = dave.mint_new_coins(10, 1)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+
+    txs = [dave.transfer(1, bob.address) for _ in range(9)]
+    forged = dave.transfer(1, bob.address)
+    wit = forged.witnesses[0]
+    forged.witnesses[0] = wit[:-1] + bytes([wit[-1] ^ 1])
+
+    async def run():
+        server = SentinelServer(uhs)
+        await server.start_unix(str(tmp_path / "sentinel.sock"))
+        client = await SentinelClient.connect_unix(str(tmp_path / "sentinel.sock"))
+        # pipelined on one connection
+        results = await asyncio.gather(*[client.submit(tx) for tx in txs + [forged]])
+        await client.close()
+        await server.close()
+        return results
+
+    results = asyncio.run(run())
+    assert results[:-1] == [(True, "")] * 9
+    assert results[-1] == (False, "invalid transaction")
+    assert len(uhs.uhs) == 10
+    for tx in txs:
+        bob.receive_transfer(tx)
+    assert all(uhs.check_unspent(v) for v in bob.spendable_inputs)
+
+
+def test_sentinel_rejects_unknown_inputs():
+    bob = Wallet()
+    dave = Wallet()
+    eve = Wallet()
+    uhs = UhsController()
+
+    minted = dave.mint_new_coins(2, 5)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+    tx = dave.transfer(5, bob.address)
+    # eve signs a spend of a coin the UHS never minted
+    fake = eve.mint_new_coins(1, 1_000_000)
+    eve.receive_transfer(fake)
+    forged = eve.transfer(1_000_000, bob.address)
+
+    async def run():
+        server = SentinelServer(uhs)
+        tcp = await server.start_tcp()
+        port = tcp.sockets[0].getsockname()[1]
+        client = await SentinelClient.connect_tcp("127.0.0.1", port)
+        results = [await client.submit(t) for t in (forged, tx, tx)]
+        await client.close()
+        await server.close()
+        return results
+
+    before = len(uhs.uhs)
+    assert asyncio.run(run()) == [
+        (False, "inputs are missing or spent"),
+        (True, ""),
+        # resubmitted
+        (False, "inputs are missing or spent"),
+    ]
+    assert len(uhs.uhs) == before
+    bob.receive_transfer(tx)
+    assert all(uhs.check_unspent(v) for v in bob.spendable_inputs)
+
+
+def test_sentinel_tcp():
+    async def run():
+        server = SentinelServer(UhsController())
+        tcp = await server.start_tcp()
+        port = tcp.sockets[0].getsockname()[1]
+        client = await SentinelClient.connect_tcp("127.0.0.1", port)
+        # no inputs
+        result = await client.submit(Wallet().mint_new_coins(1, 1))
+        await client.close()
+        await server.close()
+        return result
+
+    assert asyncio.run(run()) == (False, "invalid transaction")
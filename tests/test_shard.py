@@ -0,0 +1,103 @@
+from cbdc.wallet import Wallet
+from cbdc.uhs import UhsController
+from cbdc.shard import ShardedUhs
+from cbdc.transaction import CompactTx
+from cbdc.utils.digest import MultisetDigest, combine_digests
+
+
+def test_sharded_uhs():
+    sharded = ShardedUhs(4)
+    assert [(s.start, s.end) for s in sharded.shards] == [
+        (0, 64),
+        (64, 128),
+        (128, 192),
+        (192, 256),
+    ]
+
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController(uhs=sharded)
+
+    minted = dave.mint_new_coins(20, 5)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+    assert len(uhs.uhs) == 20
+    for v in dave.spendable_inputs:
+        assert uhs.check_unspent(v)
+    for shard in sharded.shards:
+        assert all(shard.owns(u) for u in shard.uhs)
+
+    tx = dave.transfer(12, bob.address)
+    uhs.execute_transaction(tx)
+    bob.receive_transfer(tx)
+    for v in bob.spendable_inputs:
+        assert uhs.check_unspent(v)
+
+    # spending the same inputs again is rejected and changes nothing
+    before = set(uhs.uhs)
+    assert not uhs.process(tx, False)
+    assert set(uhs.uhs) == before
+    assert all(len(s.locked) == 0 for s in sharded.shards)
+
+
+def test_prepare_locks_spends():
+    sharded = ShardedUhs(2)
+    spend = b"\x01" * 32
+    create = b"\xf0" * 32
+    sharded.add(spend)
+
+    first = CompactTx()
+    first.tx_id = b"\x0a" * 32
+    first.spends.append(spend)
+    first.creates.append(create)
+
+    shard = sharded.shard_for(spend)
+    # a prepared transaction holds the lock: a conflicting one is rejected
+    assert shard.prepare(first.tx_id, first.spends)
+    assert not sharded.apply(first)
+    shard.abort(first.tx_id)
+
+    assert sharded.apply(first)
+    assert spend not in sharded
+    assert create in sharded
+    assert sharded.shard_for(create) is sharded.shards[1]
+
+
+def test_state_digest():
+    bob = Wallet()
+    dave = Wallet()
+    plain = UhsController()
+    sharded = UhsController(uhs=ShardedUhs(4))
+    assert plain.state_digest() == sharded.state_digest() == bytes(32)
+
+    minted = dave.mint_new_coins(10, 5)
+    dave.receive_transfer(minted)
+    txs = [minted, dave.transfer(12, bob.address), dave.transfer(20, bob.address)]
+    for uhs in (plain, sharded):
+        uhs.mint(txs[0], False)
+        for tx in txs[1:]:
+            uhs.execute_transaction(tx)
+    # a rejected double spend changes nothing
+    before = sharded.state_digest()
+    assert not sharded.process(txs[1], False)
+    assert sharded.state_digest() == before
+
+    # same UHS IDs, same digest, however they're stored
+    assert set(plain.uhs) == set(sharded.uhs)
+    assert plain.state_digest() == sharded.state_digest()
+    assert plain.state_digest() == MultisetDigest(plain.uhs).digest()
+    shards = sharded.uhs.shards
+    assert sharded.uhs.shard_digests() == [
+        MultisetDigest(s.uhs).digest() for s in shards
+    ]
+    assert combine_digests(sharded.uhs.shard_digests()) == sharded.state_digest()
+
+    # a controller over an existing UHS starts from its digest, computed on
+    # first use
+    assert UhsController(uhs=set(plain.uhs)).state_digest() == plain.state_digest()
+    lazy = UhsController(uhs=set(plain.uhs))
+    tx = dave.transfer(5, bob.address)
+    lazy.execute_transaction(tx)
+    plain.execute_transaction(tx)
+    assert lazy._digest is None
+    assert lazy.state_digest() == plain.state_digest()
@@ -0,0 +1,150 @@
+import os
+
+from cbdc.wallet import Wallet
+from cbdc.uhs import UhsController, is_set
+from cbdc.storage.mmap_table import MmapUhsTable, capacity_for
+from cbdc.storage.compact import CompactUhsSet
+from cbdc.storage.filtered import FilteredUhs
+
+
+def test_mmap_table(tmp_path):
+    path = str(tmp_path / "uhs.tbl")
+    ids = [os.urandom(32) for _ in range(2000)]
+    with MmapUhsTable(path, capacity=4096) as table:
+        table.update(ids)
+        assert len(table) == 2000
+        table.difference_update(ids[::2])
+        assert len(table) == 1000
+        assert all(i not in table for i in ids[::2])
+        assert all(i in table for i in ids[1::2])
+        # the vectorized probe releases the mmap, so it can be closed
+        assert table.contains_many(ids) == [False, True] * 1000
+
+    # reopen without a reload
+    with MmapUhsTable(path) as table:
+        assert table.capacity == 4096
+        assert len(table) == 1000
+        assert set(table) == set(ids[1::2])
+
+
+def test_uhs_with_mmap_table(tmp_path):
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController(uhs=MmapUhsTable(str(tmp_path / "uhs.tbl"), capacity=64))
+
+    minted = dave.mint_new_coins(3, 5)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+    spent = list(dave.spendable_inputs)
+
+    tx = dave.transfer(12, bob.address)
+    uhs.execute_transaction(tx)
+    bob.receive_transfer(tx)
+
+    assert len(uhs.uhs) == 2
+    assert not any(uhs.check_unspent(v) for v in spent)
+    assert all(uhs.check_unspent(v) for v in bob.spendable_inputs)
+    assert all(uhs.check_unspent(v) for v in dave.spendable_inputs)
+
+
+def test_uhs_with_full_mmap_table(tmp_path):
+    bob = Wallet()
+    dave = Wallet()
+    table = MmapUhsTable(str(tmp_path / "uhs.tbl"), capacity=8)
+    assert table.max_count == 7 and capacity_for(7) == 8 and capacity_for(8) == 16
+    uhs = UhsController(uhs=table)
+
+    minted = dave.mint_new_coins(6, 10)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+
+    # spends 1, creates 2: fills the table
+    tx = dave.transfer(3, bob.address)
+    assert uhs.execute_batch([tx]) == [True]
+    assert len(table) == 7
+
+    # no room for one more: rejected before anything is removed
+    before = set(table)
+    tx = dave.transfer(3, bob.address)
+    assert uhs.execute_batch([tx]) == [False]
+    assert set(table) == before
+
+
+def test_compact_set():
+    ids = [os.urandom(32) for _ in range(5000)]
+    compact = CompactUhsSet(capacity=16)
+    compact.update(ids)
+    assert len(compact) == 5000
+    # one 32 byte slot per entry, at most 'max_load' full
+    assert compact.capacity * 32 <= 5000 * 32 / 0.85 * 2
+
+    compact.difference_update(ids[:2500])
+    assert compact.contains_many(ids) == [False] * 2500 + [True] * 2500
+    assert set(compact) == set(ids[2500:])
+
+    # grows one at a time too
+    more = [os.urandom(32) for _ in range(10000)]
+    for m in more:
+        compact.add(m)
+    assert len(compact) == 12500
+    assert all(compact.contains_many(more))
+
+
+def test_filtered_fixed_table(tmp_path):
+    ids = [os.urandom(32) for _ in range(500)]
+    with MmapUhsTable(str(tmp_path / "uhs.tbl"), capacity=1024) as table:
+        table.update(ids[:100])
+        filtered = FilteredUhs(table)
+        # sized for the whole table: growing to it doesn't rebuild the filter
+        bloom = filtered.filter
+        assert bloom.capacity == 2 * table.max_count
+        filtered.update(ids[100:])
+        assert filtered.filter is bloom
+        assert all(filtered.contains_many(ids))
+        assert not any(filtered.contains_many(os.urandom(32) for _ in range(500)))
+
+
+def test_check_unspent_many(tmp_path):
+    table = MmapUhsTable(str(tmp_path / "uhs.tbl"), capacity=64)
+    for backend in (set(), FilteredUhs(table)):
+        bob = Wallet()
+        dave = Wallet()
+        uhs = UhsController(uhs=backend)
+        minted = dave.mint_new_coins(3, 5)
+        dave.receive_transfer(minted)
+        uhs.mint(minted, False)
+        spent = list(dave.spendable_inputs)
+        tx = dave.transfer(12, bob.address)
+        uhs.execute_transaction(tx)
+        bob.receive_transfer(tx)
+
+        # TxIns and UHS IDs can be mixed
+        unspent = list(dave.spendable_inputs) + list(bob.spendable_inputs)
+        query = spent + unspent + [next(iter(uhs.uhs)), os.urandom(32)]
+        bitmap = uhs.check_unspent_many(query)
+        assert len(bitmap) == 1
+        assert [is_set(bitmap, i) for i in range(len(query))] == [
+            False,
+            False,
+            False,
+            True,
+            True,
+            True,
+            False,
+        ]
+    table.close()
+
+
+def test_filtered_uhs():
+    ids = [os.urandom(32) for _ in range(3000)]
+    uhs = FilteredUhs(CompactUhsSet())
+    uhs.update(ids[:1000])
+    for i in ids[1000:2000]:
+        uhs.add(i)
+    uhs.difference_update(ids[:500])
+    assert len(uhs) == 1500
+    assert uhs.contains_many(ids) == [False] * 500 + [True] * 1500 + [False] * 1000
+    assert all(i in uhs for i in ids[500:2000])
+    assert not any(i in uhs for i in ids[2000:])
+    # filled up past its capacity and was rebuilt
+    assert uhs.filter.capacity > 1024
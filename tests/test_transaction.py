@@ -1,12 +1,24 @@
+import io
+import struct
 from re import T
+
+import pytest
+
 from cbdc.transaction import (
+    CompactTx,
     Outpoint,
     TxIn,
     TxOut,
     Transaction,
+    TxidInterner,
     hash_tx_input,
+    hash_tx_inputs,
+    iter_transactions,
     uhs_id_from_output,
+    uhs_ids_from_outputs,
 )
+from cbdc.wallet import Wallet
+from cbdc.utils.hash import hash256
 from cbdc.utils.keys import PUBLIC_KEY_SIZE, SIGNATURE_SIZE
 
 
@@ -56,3 +68,136 @@ def test_structure():
     input_hash = hash_tx_input(txi)
     uhs_hash = uhs_id_from_output(fake_txid, 1, txo)
     assert input_hash == uhs_hash
+
+
+def test_deserialize():
+    bob = Wallet()
+    dave = Wallet()
+    minted = dave.mint_new_coins(5, 3)
+    dave.receive_transfer(minted)
+    tx = dave.transfer(7, bob.address)
+
+    for original in (minted, tx):
+        raw = original.serialize()
+        back = Transaction.deserialize(raw)
+        assert back.serialize() == raw
+        assert back.tx_id() == original.tx_id()
+        assert back.inputs == original.inputs
+        assert back.outputs == original.outputs
+        assert back.witnesses == original.witnesses
+
+    with pytest.raises(AssertionError):
+        Transaction.deserialize(tx.serialize()[:-1])
+    with pytest.raises(AssertionError):
+        Transaction.deserialize(tx.serialize() + b"\x00")
+
+    # stream of concatenated transactions, read in small chunks
+    stream = io.BytesIO((minted.serialize() + tx.serialize()) * 10)
+    replayed = list(iter_transactions(stream, chunk_size=64))
+    assert [t.serialize() for t in replayed] == [
+        minted.serialize(),
+        tx.serialize(),
+    ] * 10
+
+    with pytest.raises(AssertionError):
+        list(iter_transactions(io.BytesIO(tx.serialize()[:-5])))
+
+
+def test_tx_id_sealing():
+    txi = TxIn(Outpoint(0, b"\x01" * 32), TxOut(10, b"\x02" * 32))
+    tx = Transaction()
+    tx.inputs.append(txi)
+    tx.outputs.append(TxOut(4, b"\x03" * 32))
+    tx.outputs.append(TxOut(6, b"\x04" * 32))
+
+    # the length prefixed inputs and outputs
+    expected = hash256(
+        struct.pack("=Q", 1),
+        txi.serialize(),
+        struct.pack("=Q", 2),
+        tx.outputs[0].serialize(),
+        tx.outputs[1].serialize(),
+    )
+    assert tx.tx_id() == expected
+    assert not tx.sealed
+
+    # unsealed: tracks changes
+    tx.outputs[1] = TxOut(5, b"\x04" * 32)
+    assert tx.tx_id() != expected
+    tx.outputs[1] = TxOut(6, b"\x04" * 32)
+
+    assert tx.seal().tx_id() == expected
+    assert tx.sealed
+    with pytest.raises(AttributeError):
+        tx.outputs.append(TxOut(1, b"\x05" * 32))
+    with pytest.raises(AttributeError):
+        tx.outputs = [TxOut(10, b"\x05" * 32)]
+    # the parts are immutable
+    with pytest.raises(AttributeError):
+        tx.outputs[0].witness = b"\x05" * 32
+    with pytest.raises(AttributeError):
+        txi.prev_output_data = TxOut(100, b"\x02" * 32)
+    with pytest.raises(AttributeError):
+        txi.prev_outpoint.index = 1
+    assert tx.seal().tx_id() == expected
+    # witnesses aren't part of the tx_id
+    tx.witnesses.append(b"\x06" * 96)
+    assert tx.tx_id() == expected
+
+    other = Transaction()
+    other.inputs.append(txi)
+    assert other != tx
+    other.outputs.extend(tx.outputs)
+    assert other == tx
+
+
+def test_compact_tx_bulk_ids():
+    bob = Wallet()
+    dave = Wallet()
+    minted = dave.mint_new_coins(20, 1)
+    dave.receive_transfer(minted)
+    tx = dave.transfer(15.5, bob.address)
+
+    ctx = CompactTx.create(tx)
+    assert ctx.tx_id == tx.tx_id()
+    assert ctx.spends == [hash_tx_input(i) for i in tx.inputs]
+    assert ctx.creates == [
+        uhs_id_from_output(ctx.tx_id, idx, o) for idx, o in enumerate(tx.outputs)
+    ]
+    assert hash_tx_inputs([]) == []
+    assert uhs_ids_from_outputs(ctx.tx_id, []) == []
+
+
+def test_hashable_primitives():
+    txid = b"\x01" * 32
+    a = TxIn(Outpoint(0, txid), TxOut(5, b"\x02" * 32))
+    b = TxIn(Outpoint(0, bytes(bytearray(txid))), TxOut(5, b"\x02" * 32))
+    c = TxIn(Outpoint(1, txid), TxOut(5, b"\x02" * 32))
+    assert a == b and hash(a) == hash(b)
+    assert len({a, b, c}) == 2
+    assert {a.prev_outpoint: 1}[b.prev_outpoint] == 1
+    assert a != "not a txin"
+    with pytest.raises(AttributeError):
+        a.extra = 1
+
+    dave = Wallet()
+    minted = dave.mint_new_coins(2, 1)
+    ctx = CompactTx.create(minted)
+    assert {minted: ctx}[Transaction.deserialize(minted.serialize())] == ctx
+
+    # interned txids are shared by every decoded input
+    dave.receive_transfer(minted)
+    tx = dave.transfer(2, Wallet().address)
+    raw = tx.serialize()
+    decoded = next(iter_transactions(io.BytesIO(raw + raw), intern=True))
+    again = Transaction.deserialize(raw)
+    assert decoded.inputs[0].prev_outpoint.txid is decoded.inputs[1].prev_outpoint.txid
+    assert again.inputs[0].prev_outpoint.txid is not again.inputs[1].prev_outpoint.txid
+
+    # bounded: the oldest txid is dropped first
+    intern = TxidInterner(max_size=2)
+    a, b, c = (bytes([i]) * 32 for i in range(3))
+    assert intern(a) is a and intern(b) is b and intern(c) is c
+    assert len(intern) == 2
+    assert intern(bytes(bytearray(c))) is c
+    assert intern(bytes(bytearray(a))) is not a
@@ -1,5 +1,11 @@
+import json
+import subprocess
+import sys
+
+from cbdc.transaction import Transaction, TxOut
 from cbdc.wallet import Wallet
 from cbdc.uhs import UhsController
+from cbdc.metrics import JsonFileExporter, Metrics
 
 
 def test_processing():
@@ -17,3 +23,96 @@ def test_processing():
     uhs.mint(minted)
     for v in dave.spendable_inputs:
         assert uhs.check_unspent(v)
+
+
+def test_batch_validation():
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController()
+
+    minted = dave.mint_new_coins(4, 10)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+
+    good = dave.transfer(10, bob.address)
+    spent = dave.transfer(10, bob.address)
+    unbalanced = Transaction()
+    unbalanced.inputs.extend(spent.inputs)
+    unbalanced.outputs.append(TxOut(1000, spent.outputs[0].witness))
+    unbalanced.witnesses.extend(spent.witnesses)
+    forged = dave.transfer(10, bob.address)
+    wit = forged.witnesses[0]
+    forged.witnesses[0] = wit[:-1] + bytes([wit[-1] ^ 1])
+
+    results = uhs.execute_batch([good, unbalanced, forged])
+    assert results == [True, False, False]
+
+    # only the good transaction was applied
+    bob.receive_transfer(good)
+    for v in bob.spendable_inputs:
+        assert uhs.check_unspent(v)
+    assert len(uhs.uhs) == 4
+
+
+def test_batch_double_spend():
+    bob = Wallet()
+    dave = Wallet()
+    uhs = UhsController()
+
+    minted = dave.mint_new_coins(2, 10)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+
+    first = dave.transfer(10, bob.address)
+    second = dave.transfer(10, bob.address)
+    # the same transaction twice in a batch, then again in a later batch
+    assert uhs.execute_batch([first, first, second]) == [True, False, True]
+    assert uhs.execute_batch([first]) == [False]
+    assert len(uhs.uhs) == 2
+
+
+def test_metrics(tmp_path, capsys):
+    bob = Wallet()
+    dave = Wallet()
+    exported = tmp_path / "metrics.json"
+    metrics = Metrics([JsonFileExporter(str(exported))])
+    uhs = UhsController(metrics=metrics)
+
+    minted = dave.mint_new_coins(3, 5)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+    uhs.execute_transaction(dave.transfer(12, bob.address), True)
+    # displays go to the exporters, not stdout
+    assert capsys.readouterr().out == ""
+
+    snapshot = metrics.snapshot()
+    assert snapshot["stages"]["compact_tx_create"]["count"] == 2
+    assert snapshot["stages"]["apply_spends"]["count"] == 2
+    for stage in (
+        "check_structure",
+        "check_inputs_outputs",
+        "check_witness_and_signature",
+    ):
+        assert snapshot["stages"][stage]["count"] == 1
+
+    metrics.export()
+    assert json.loads(exported.read_text())["stages"]["apply_creates"]["count"] == 2
+
+
+def test_execute_without_asserts():
+    # 'python -O' strips asserts: the transaction must still be applied
+    script = """
+from cbdc.wallet import Wallet
+from cbdc.uhs import UhsController
+bob, dave, uhs = Wallet(), Wallet(), UhsController()
+minted = dave.mint_new_coins(2, 5)
+dave.receive_transfer(minted)
+uhs.mint(minted, False)
+before = set(uhs.uhs)
+uhs.execute_transaction(dave.transfer(5, bob.address))
+print(set(uhs.uhs) != before)
+"""
+    out = subprocess.run(
+        [sys.executable, "-O", "-c", script], capture_output=True, text=True, check=True
+    )
+    assert out.stdout.strip() == "True"
@@ -2,9 +2,21 @@ import pytest
 
 from nacl.exceptions import BadSignatureError
 
+from cbdc.utils.bloom import BloomFilter
 from cbdc.utils.hash import hash256
-from cbdc.utils.address import encode_address, decode_address
-from cbdc.utils.keys import generate_keypair, sign_message, verify_signature
+from cbdc.utils.address import (
+    decode_address,
+    decode_addresses,
+    encode_address,
+    encode_addresses,
+)
+from cbdc.utils.keys import (
+    derive_keypair,
+    generate_keypair,
+    generate_seed,
+    sign_message,
+    verify_signature,
+)
 
 
 def test_keys():
@@ -19,6 +31,17 @@ def test_keys():
         verify_signature(msg, forged, p)
 
 
+def test_derived_keys():
+    seed = generate_seed()
+    p, s = derive_keypair(seed, 7)
+    assert (p, s) == derive_keypair(seed, 7)
+    assert p != derive_keypair(seed, 8)[0]
+    assert p != derive_keypair(generate_seed(), 7)[0]
+
+    msg = hash256(b"dave")
+    assert verify_signature(msg, sign_message(msg, s), p)
+
+
 def test_addresses():
     p, _ = generate_keypair()
     addr = encode_address(p)
@@ -27,3 +50,42 @@ def test_addresses():
     assert p == decode_address(addr)
     with pytest.raises(AssertionError):
         encode_address(b"bob")
+
+
+def test_batch_addresses():
+    keys = [generate_keypair()[0] for _ in range(3)]
+    payouts = keys * 2
+    addrs = encode_addresses(payouts)
+    assert addrs == [encode_address(p) for p in payouts]
+    assert decode_addresses(addrs) == payouts
+
+    # a bad address (wrong checksum) fails the whole list
+    last = "q" if addrs[0][-1] != "q" else "p"
+    with pytest.raises(AssertionError, match="invalid address"):
+        decode_addresses(addrs + [addrs[0][:-1] + last])
+    with pytest.raises(AssertionError):
+        decode_address("usd1bob")
+
+
+def test_bloom_filter():
+    f = BloomFilter(1000, 0.01)
+    keys = [hash256(i.to_bytes(4, "big")) for i in range(1000)]
+    f.update(keys)
+    # no false negatives
+    assert all(k in f for k in keys)
+    assert not f.full
+    others = [hash256(b"x", i.to_bytes(4, "big")) for i in range(10000)]
+    assert sum(k in f for k in others) < 200
+    # short keys are hashed first
+    f.add(b"dave")
+    assert b"dave" in f
+    assert f.full
+
+    # vectorized: the same bits as one key at a time
+    import numpy as np
+
+    v = BloomFilter(1000, 0.01)
+    v.update_words(np.frombuffer(b"".join(keys), dtype="<u8").reshape(-1, 4))
+    g = BloomFilter(1000, 0.01)
+    g.update(keys)
+    assert v.words == g.words and len(v) == 1000
@@ -0,0 +1,195 @@
+import os
+import threading
+
+import pytest
+
+from cbdc.shard import ShardedUhs
+from cbdc.uhs import UhsController
+from cbdc.wal import LOG_HEADER, WriteAheadLog
+from cbdc.wallet import Wallet
+
+
+def _wal(path):
+    return WriteAheadLog(path, batch_size=3, flush_interval=0)
+
+
+def _transfers(uhs, rounds):
+    bob = Wallet()
+    dave = Wallet()
+    minted = dave.mint_new_coins(4, 10)
+    dave.receive_transfer(minted)
+    uhs.mint(minted)
+    for _ in range(rounds):
+        tx = dave.transfer(3, bob.address)
+        assert uhs.process(tx, True)
+        bob.receive_transfer(tx)
+
+
+def test_wal_recovery(tmp_path):
+    path = str(tmp_path / "uhs.wal")
+    wal = _wal(path)
+    uhs = UhsController(wal=wal)
+    _transfers(uhs, 5)
+    wal.wait(wal.appended)
+    # 6 records in groups of (at least) 3
+    assert wal.appended == 6 and wal.durable == 6
+    assert 1 <= wal.syncs <= 2
+    wal.close()
+
+    recovered = UhsController(wal=_wal(path))
+    assert recovered.uhs == uhs.uhs
+    assert recovered.state_digest() == uhs.state_digest()
+
+    # the last record is torn: it's dropped and the log truncated
+    recovered.wal.close()
+    size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        f.truncate(size - 5)
+    wal = _wal(path)
+    torn = UhsController(wal=wal)
+    assert torn.uhs != uhs.uhs
+    assert os.path.getsize(path) < size - 5
+    # appending after the truncation works
+    _transfers(torn, 1)
+    wal.close()
+    assert UhsController(wal=_wal(path)).uhs == torn.uhs
+
+
+def test_wal_snapshot(tmp_path):
+    path = str(tmp_path / "uhs.wal")
+    wal = _wal(path)
+    uhs = UhsController(wal=wal)
+    _transfers(uhs, 2)
+    uhs.snapshot()
+    at_snapshot = set(uhs.uhs)
+    assert wal.epoch == 1
+    assert os.path.getsize(path) == LOG_HEADER.size
+    _transfers(uhs, 1)
+    wal.close()
+
+    # snapshot + log
+    recovered = UhsController(wal=_wal(path))
+    assert recovered.uhs == uhs.uhs
+    recovered.wal.close()
+
+    # crash after the snapshot was written but before the log was reset:
+    # the old log is ignored
+    with open(path, "wb") as f:
+        f.write(LOG_HEADER.pack(b"CBDCWAL1", 0))
+        f.write(os.urandom(100))
+    snap = UhsController(wal=_wal(path))
+    snap.wal.close()
+    assert snap.uhs == at_snapshot
+
+
+def test_wal_missing_snapshot(tmp_path):
+    path = str(tmp_path / "uhs.wal")
+    uhs = UhsController(wal=_wal(path))
+    _transfers(uhs, 2)
+    uhs.snapshot()
+    _transfers(uhs, 1)
+    uhs.wal.close()
+    size = os.path.getsize(path)
+
+    # the log is from epoch 1: without the snapshot it can't be replayed
+    os.remove(path + ".snap")
+    with pytest.raises(AssertionError, match="newer than the snapshot"):
+        UhsController(wal=_wal(path))
+    # and it's left as it was
+    assert os.path.getsize(path) == size
+
+
+def test_wal_background_flush(tmp_path):
+    wal = WriteAheadLog(
+        str(tmp_path / "uhs.wal"), batch_size=1000, flush_interval=0.001
+    )
+    uhs = UhsController(wal=wal)
+    _transfers(uhs, 3)
+    # the group isn't full: the flusher thread writes it
+    wal.wait(wal.appended)
+    assert wal.durable == 4
+    wal.close()
+
+
+def test_wal_append_doesnt_write(tmp_path, monkeypatch):
+    wal = _wal(str(tmp_path / "uhs.wal"))
+    uhs = UhsController(wal=wal)
+    # the background thread is stuck in its fsync
+    release = threading.Event()
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: release.wait(5) and fsync(fd))
+    _transfers(uhs, 5)
+    assert wal.appended == 6 and wal.durable == 0
+    release.set()
+    wal.wait(wal.appended)
+    assert wal.durable == 6
+    wal.close()
+
+
+def test_wal_durable_execute(tmp_path):
+    bob = Wallet()
+    dave = Wallet()
+    wal = WriteAheadLog(str(tmp_path / "uhs.wal"), batch_size=1000, flush_interval=0)
+    uhs = UhsController(wal=wal)
+    minted = dave.mint_new_coins(4, 10)
+    dave.receive_transfer(minted)
+    # logged, not waited for
+    uhs.mint(minted, False)
+    assert wal.durable == 0
+
+    uhs.execute_transaction(dave.transfer(10, bob.address))
+    assert wal.durable == wal.appended == 2
+    txs = [dave.transfer(10, bob.address) for _ in range(2)]
+    assert uhs.execute_batch(txs) == [True, True]
+    assert wal.durable == 4
+    assert uhs.execute_concurrent([dave.transfer(10, bob.address)]) == [True]
+    assert wal.durable == 5
+    wal.close()
+
+
+def _snapshot_while_applying(path, make_uhs):
+    bob = Wallet()
+    dave = Wallet()
+    wal = WriteAheadLog(path, batch_size=16, flush_interval=0)
+    uhs = UhsController(uhs=make_uhs(), wal=wal)
+    minted = dave.mint_new_coins(300, 1)
+    dave.receive_transfer(minted)
+    uhs.mint(minted, False)
+    txs = [dave.transfer(1, bob.address) for _ in range(300)]
+
+    applied = []
+
+    def apply(txs):
+        applied.extend(uhs.process(tx, False) for tx in txs)
+
+    workers = [threading.Thread(target=apply, args=(txs[i::2],)) for i in range(2)]
+    for w in workers:
+        w.start()
+    snapshots = 0
+    while any(w.is_alive() for w in workers) or not snapshots:
+        uhs.snapshot()
+        snapshots += 1
+    for w in workers:
+        w.join()
+    wal.close()
+    assert applied == [True] * 300
+    assert set(UhsController(uhs=make_uhs(), wal=_wal(path)).uhs) == set(uhs.uhs)
+
+
+def test_wal_snapshot_while_applying(tmp_path):
+    _snapshot_while_applying(str(tmp_path / "uhs.wal"), set)
+    _snapshot_while_applying(str(tmp_path / "sharded.wal"), lambda: ShardedUhs(4))
+
+
+def test_wal_sharded(tmp_path):
+    path = str(tmp_path / "uhs.wal")
+    uhs = UhsController(uhs=ShardedUhs(4), wal=_wal(path))
+    # the two-phase commits don't take the store lock
+    with uhs.store_lock:
+        _transfers(uhs, 3)
+    uhs.snapshot()
+    _transfers(uhs, 2)
+    uhs.wal.close()
+    recovered = UhsController(uhs=ShardedUhs(4), wal=_wal(path))
+    assert set(recovered.uhs) == set(uhs.uhs)
+    assert recovered.state_digest() == uhs.state_digest()
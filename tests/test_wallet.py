@@ -1,4 +1,6 @@
 from cbdc.wallet import Wallet
+from cbdc.transaction import CompactTx
+from cbdc.utils.keys import derive_keypair, generate_seed
 
 
 def test_wallet():
@@ -29,3 +31,88 @@ def test_wallet():
     alice.receive_transfer(tx2)
     assert bob.balance == 1.50
     assert alice.balance == 10.50
+
+
+def test_persistent_wallet(tmp_path):
+    path = str(tmp_path / "dave.db")
+    dave = Wallet.open(path)
+    bob = Wallet()
+    dave.receive_transfer(dave.mint_new_coins(3, 5))
+    address = dave.address
+    tx1 = dave.transfer(12, bob.address)
+    bob.receive_transfer(tx1)
+    dave.close()
+
+    # keys and spendable inputs survive a restart
+    dave = Wallet.open(path)
+    assert dave.balance == 3
+    assert len(dave.spendable_inputs) == 1
+    assert dave.is_my_address(address)
+    assert not dave.is_my_address(bob.address)
+    # 3 minted, 1 address, 1 change
+    assert len(dave.pubkeys) == 5
+
+    # and it can still sign for them
+    tx2 = dave.transfer(3, bob.address)
+    bob.receive_transfer(tx2)
+    assert dave.balance == 0
+    assert bob.balance == 15
+    dave.close()
+    assert Wallet.open(path).balance == 0
+
+
+def test_seeded_wallet(tmp_path):
+    seed = generate_seed()
+    path = str(tmp_path / "dave.db")
+    dave = Wallet.open(path, seed=seed, key_pool_size=8)
+    bob = Wallet(key_pool_size=4)
+    dave.receive_transfer(dave.mint_new_coins(10, 2))
+    # only the key index is stored, not the secret
+    pubkey = dave.pubkeys[0]
+    assert dave.store.secret(pubkey) is None
+    assert dave.pubkey_to_secretkey[pubkey] == derive_keypair(seed, 0)[1]
+    bob.receive_transfer(dave.transfer(5, bob.address))
+    dave.close()
+
+    # the seed is stored with the wallet, and new keys continue after the old ones
+    dave = Wallet.open(path)
+    assert dave.seed == seed
+    assert len(set(dave.pubkeys)) == 11
+    bob.receive_transfer(dave.transfer(15, bob.address))
+    assert dave.balance == 0
+    assert bob.balance == 20
+    assert len(set(dave.pubkeys)) == 11
+    dave.close()
+    bob.close()
+
+
+def test_scan():
+    dave = Wallet()
+    bob = Wallet()
+    alice = Wallet()
+    minted = dave.mint_new_coins(2, 5)
+    dave.receive_transfer(minted)
+    to_bob = dave.transfer(4, bob.address)
+    to_alice = dave.transfer(3, alice.address)
+
+    # everyone follows the whole flow
+    stream = [minted, to_bob, to_alice]
+    assert bob.scan(stream) == [to_bob]
+    assert bob.balance == 4
+    assert alice.scan(stream) == [to_alice]
+    assert alice.balance == 3
+
+    # compact transactions are matched on the UHS IDs of my inputs
+    to_alice2 = bob.transfer(4, alice.address)
+    compact = [CompactTx.create(tx) for tx in stream + [to_alice2]]
+    # the one that created alice's input. The new payment isn't visible
+    assert alice.scan(compact) == [compact[2]]
+    assert alice.balance == 3
+    # dave's change outputs
+    assert dave.scan(compact) == compact[1:3]
+    # bob spent all of his
+    assert bob.scan(compact) == []
+
+    assert b"x" * 32 not in alice.committment_filter()
+    for pubkey in alice.pubkeys:
+        assert alice.witness_committments[pubkey] in alice.committment_filter()
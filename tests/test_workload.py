@@ -0,0 +1,53 @@
+import io
+
+from cbdc.shard import ShardedUhs
+from cbdc.transaction import iter_transactions
+from cbdc.uhs import UhsController
+from cbdc.workload import WorkloadConfig, generate, replay
+
+
+def test_workload():
+    config = WorkloadConfig(
+        txs=300,
+        accounts=20,
+        coins=3,
+        fan_in=(1, 3),
+        fan_out=(2, 4),
+        skew=1.5,
+        double_spend_rate=0.1,
+        seed=7,
+        parts=2,
+    )
+    out = io.BytesIO()
+    assert generate(config, out, workers=2) == 320
+    data = out.getvalue()
+
+    # the same options give the same stream
+    again = io.BytesIO()
+    generate(config, again, workers=1)
+    assert again.getvalue() == data
+
+    txs = list(iter_transactions(io.BytesIO(data)))
+    assert all(not tx.inputs for tx in txs[:20])
+    transfers = txs[20:]
+    assert max(len(tx.inputs) for tx in transfers) == 3
+    assert max(len(tx.outputs) for tx in transfers) == 4
+
+    # transfers re-spending an input spent earlier in the stream
+    spent = set()
+    double_spends = 0
+    for tx in transfers:
+        points = {(i.prev_outpoint.txid, i.prev_outpoint.index) for i in tx.inputs}
+        if not spent.isdisjoint(points):
+            double_spends += 1
+        spent |= points
+    assert double_spends > 0
+
+    digests = []
+    for uhs in (UhsController(), UhsController(uhs=ShardedUhs(4))):
+        accepted, rejected = replay(io.BytesIO(data), uhs)
+        # the double spends, and nothing else
+        assert rejected == double_spends
+        assert accepted == 320 - double_spends
+        digests.append(uhs.state_digest())
+    assert digests[0] == digests[1]